@@ -1,3 +1,79 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-# Register your models here.
+from .documents import refresh_documents
+from .models import Image, ModerationLog, Pass
+
+
+class ImageInline(admin.TabularInline):
+    model = Image
+    fields = ['data', 'title', 'state']
+    readonly_fields = ['state']
+    extra = 0
+
+
+class ModerationLogInline(admin.TabularInline):
+    model = ModerationLog
+    fields = ['created_at', 'from_status', 'to_status', 'moderator', 'comment']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+def moderation_action(to_status, description):
+    def action(modeladmin, request, queryset):
+        selected = queryset.count()
+        moved = queryset.moderate(to_status, moderator=request.user.get_username())
+        modeladmin.message_user(request, f'Статус изменён у {len(moved)} из {selected} перевалов')
+        if len(moved) < selected:
+            modeladmin.message_user(
+                request,
+                f'{selected - len(moved)} перевалов пропущено: переход в этот статус из их статуса запрещён',
+                messages.WARNING,
+            )
+
+    action.__name__ = f'moderate_{to_status}'
+    return admin.action(description=description, permissions=['change'])(action)
+
+
+@admin.register(Pass)
+class PassAdmin(admin.ModelAdmin):
+    list_display = ['id', 'title', 'user', 'status', 'add_time', 'updated_at']
+    list_filter = ['status', 'add_time']
+    search_fields = ['title', 'user__email']
+    list_select_related = ['user']
+    readonly_fields = ['status', 'add_time', 'version', 'updated_at']
+    raw_id_fields = ['user', 'coords', 'level']
+    inlines = [ImageInline, ModerationLogInline]
+    actions = [
+        moderation_action('pending', 'Взять на проверку'),
+        moderation_action('accepted', 'Принять'),
+        moderation_action('rejected', 'Отклонить'),
+        moderation_action('new', 'Вернуть в новые'),
+    ]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # документ перевала собирается, когда записаны и изображения
+        refresh_documents([form.instance.pk])
+
+
+@admin.register(ModerationLog)
+class ModerationLogAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'pass_obj_id', 'from_status', 'to_status', 'moderator']
+    list_filter = ['to_status', 'from_status', 'created_at']
+    search_fields = ['moderator']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
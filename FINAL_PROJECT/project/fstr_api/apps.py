@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FstrApiConfig(AppConfig):
     name = 'fstr_api'
+
+    def ready(self):
+        import fstr_api.signals
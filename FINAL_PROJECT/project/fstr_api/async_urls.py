@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .async_views import pass_detail_async, pass_list_async
+
+
+urlpatterns = [
+    path('', pass_list_async, name='pass_list_async'),
+    path('<int:pk>/', pass_detail_async, name='pass_detail_async'),
+]
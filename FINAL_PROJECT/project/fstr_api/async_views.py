@@ -0,0 +1,56 @@
+"""Асинхронные варианты эндпоинтов перевалов для запуска под ASGI.
+
+Чтение (карточка перевала и список перевалов пользователя) выполняется
+асинхронным ORM и не занимает поток на время запросов к базе. Запись
+(POST и PATCH) передаётся синхронным представлениям DRF через sync_to_async:
+транзакции в ORM Django только синхронные. Проверка ETag, страница списка
+и тела ошибок — общие с синхронными представлениями (модуль reads).
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.request import Request
+
+from .reads import aread_pass_detail, aread_pass_list, server_error
+from .views import submit_data, update_pass
+
+logger = logging.getLogger(__name__)
+
+
+def json_response(data, status_code, headers):
+    if status_code == 304:
+        return HttpResponse(status=304, headers=headers)
+    return JsonResponse(data, status=status_code, headers=headers, json_dumps_params={'ensure_ascii': False})
+
+
+async def read_pass_detail(request, pk):
+    return json_response(*await aread_pass_detail(request, pk))
+
+
+async def read_pass_list(request):
+    try:
+        result = await aread_pass_list(Request(request))
+    except Exception as e:
+        logger.exception('Ошибка при обработке %s %s', request.method, request.path)
+        result = server_error(e)
+    return json_response(*result)
+
+
+@csrf_exempt
+async def pass_list_async(request):
+    if request.method in ('GET', 'HEAD'):
+        return await read_pass_list(request)
+    if request.method == 'POST':
+        return await sync_to_async(submit_data)(request)
+    return HttpResponseNotAllowed(['GET', 'POST'])
+
+
+@csrf_exempt
+async def pass_detail_async(request, pk):
+    if request.method in ('GET', 'HEAD'):
+        return await read_pass_detail(request, pk)
+    if request.method == 'PATCH':
+        return await sync_to_async(update_pass)(request, pk=pk)
+    return HttpResponseNotAllowed(['GET', 'PATCH'])
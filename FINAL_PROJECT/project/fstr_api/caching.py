@@ -0,0 +1,95 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+
+def get_cache():
+    return caches[getattr(settings, 'FSTR_PASS_CACHE', 'default')]
+
+
+def detail_key(pk):
+    return f'pass-detail-{pk}'
+
+
+def pass_etag(pk, version):
+    return quote_etag(f'{pk}-{version}')
+
+
+def list_etag(versions):
+    """ETag страницы списка по парам (id, версия) входящих в неё перевалов."""
+    content = ','.join(f'{pk}-{version}' for pk, version in versions)
+    return quote_etag(hashlib.md5(content.encode()).hexdigest())
+
+
+def get_cached_detail(pk):
+    return get_cache().get(detail_key(pk))
+
+
+async def aget_cached_detail(pk):
+    return await get_cache().aget(detail_key(pk))
+
+
+def detail_entry(pass_obj, data):
+    return {
+        'data': data,
+        'etag': pass_etag(pass_obj.pk, pass_obj.version),
+        'last_modified': pass_obj.updated_at,
+    }
+
+
+def cache_detail(pass_obj, data):
+    """Сохраняет сериализованный перевал вместе с ETag и Last-Modified и возвращает запись кэша."""
+    entry = detail_entry(pass_obj, data)
+    get_cache().set(detail_key(pass_obj.pk), entry, getattr(settings, 'FSTR_PASS_CACHE_TIMEOUT', 300))
+    return entry
+
+
+async def acache_detail(pass_obj, data):
+    entry = detail_entry(pass_obj, data)
+    await get_cache().aset(detail_key(pass_obj.pk), entry, getattr(settings, 'FSTR_PASS_CACHE_TIMEOUT', 300))
+    return entry
+
+
+def invalidate_passes(pks):
+    """Сбрасывает кэш перевалов сразу и ещё раз после фиксации транзакции,
+    чтобы параллельный запрос не успел закэшировать незафиксированное состояние."""
+    keys = [detail_key(pk) for pk in pks]
+    if not keys:
+        return
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def is_conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def not_modified(request, etag, last_modified):
+    """Проверяет условный GET: If-None-Match приоритетнее If-Modified-Since."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = [value.removeprefix('W/') for value in parse_etags(if_none_match)]
+        return '*' in etags or etag in etags
+
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return (if_modified_since is not None and last_modified is not None
+            and int(last_modified.timestamp()) <= if_modified_since)
+
+
+def validator_headers(etag, last_modified):
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return headers
+
+
+def if_match(request, etag):
+    """Проверяет If-Match для изменения записи: без заголовка условие выполнено, слабые ETag не совпадают."""
+    header = request.headers.get('If-Match')
+    if header is None:
+        return True
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
@@ -0,0 +1,50 @@
+from django.db import transaction
+
+from .instrumentation import timed
+from .models import Pass, PassDocument
+
+DOCUMENT_FIELDS = ['user_email', 'add_time', 'version', 'updated_at', 'data']
+
+
+def render_documents(passes):
+    """Документы для перевалов, загруженных через with_related()."""
+    from .serializers import PassSerializer
+
+    passes = list(passes)
+    with timed('serialization'):
+        data = PassSerializer(passes, many=True).data
+    return [
+        PassDocument(pass_obj=pass_obj, user_email=pass_obj.user.email, add_time=pass_obj.add_time,
+                     version=pass_obj.version, updated_at=pass_obj.updated_at, data=data)
+        for pass_obj, data in zip(passes, data)
+    ]
+
+
+def refresh_documents(pks):
+    """Пересобирает документы перевалов по текущему состоянию базы и возвращает их."""
+    documents = render_documents(Pass.objects.with_related().filter(pk__in=list(pks)))
+    if documents:
+        PassDocument.objects.bulk_create(
+            documents, update_conflicts=True, unique_fields=['pass_obj'], update_fields=DOCUMENT_FIELDS,
+        )
+    return documents
+
+
+def rebuild_documents(start=0, batch_size=1000, progress=None):
+    """Пересобирает документы перевалов с id больше start пачками по batch_size.
+
+    progress вызывается после каждой пачки с числом пересобранных документов
+    и id последнего перевала. Возвращает число документов.
+    """
+    last_pk = start
+    rebuilt = 0
+    while True:
+        pks = list(Pass.objects.filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return rebuilt
+        with transaction.atomic():
+            rebuilt += len(refresh_documents(pks))
+        last_pk = pks[-1]
+        if progress:
+            progress(rebuilt, last_pk)
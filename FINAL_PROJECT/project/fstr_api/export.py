@@ -0,0 +1,75 @@
+import json
+
+from .documents import refresh_documents
+from .models import Pass
+
+EXPORT_FORMATS = ['ndjson', 'geojson']
+EXPORT_CHUNK_SIZE = 1000
+
+
+def iter_documents(after_id=0, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Документы перевалов по возрастанию id, прочитанные пачками по ключу.
+
+    В памяти одновременно не больше одной пачки, и каждая читается условием
+    по первичному ключу, а не смещением. after_id — id последнего полученного
+    перевала (продолжение прерванной выгрузки), since — только перевалы,
+    изменённые с этого момента. Отсутствующие документы (перевал ещё не
+    пересобран) собираются на лету, как при чтении карточки.
+    """
+    passes = Pass.objects.order_by('pk')
+    if since is not None:
+        passes = passes.filter(updated_at__gte=since)
+    last_pk = after_id
+    while True:
+        chunk = list(passes.filter(pk__gt=last_pk).values_list('pk', 'document__data')[:chunk_size])
+        missing = [pk for pk, data in chunk if data is None]
+        built = {document.pass_obj_id: document.data for document in refresh_documents(missing)} if missing else {}
+        for pk, data in chunk:
+            data = built.get(pk) if data is None else data
+            # перевал мог быть удалён, пока собирался документ
+            if data is not None:
+                yield pk, data
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def to_feature(pk, data):
+    """GeoJSON Feature: координаты — геометрия-точка, остальные поля — свойства."""
+    properties = dict(data)
+    coords = properties.pop('coords')
+    return {
+        'type': 'Feature',
+        'id': pk,
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [float(coords['longitude']), float(coords['latitude']), coords['height']],
+        },
+        'properties': properties,
+    }
+
+
+def export_ndjson(documents):
+    for _, data in documents:
+        yield dumps(data) + '\n'
+
+
+def export_geojson(documents):
+    yield '{"type":"FeatureCollection","features":[\n'
+    separator = ''
+    for pk, data in documents:
+        yield separator + dumps(to_feature(pk, data))
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+def stream_export(output='ndjson', after_id=0, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Части выгрузки перевалов в формате output ('ndjson' или 'geojson')."""
+    documents = iter_documents(after_id, since, chunk_size)
+    if output == 'geojson':
+        return export_geojson(documents)
+    return export_ndjson(documents)
@@ -0,0 +1,134 @@
+import math
+
+from django.db import models
+
+# Сетка 0.1° × 0.1°; номер ячейки = строка (широта) * COLS + столбец (долгота),
+# поэтому ячейки одной полосы широт идут подряд и покрываются одним диапазоном.
+CELLS_PER_DEGREE = 10
+ROWS = 180 * CELLS_PER_DEGREE
+COLS = 360 * CELLS_PER_DEGREE
+MAX_CELL_RANGES = 256
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def cell_row(latitude):
+    return min(int((float(latitude) + 90) * CELLS_PER_DEGREE), ROWS - 1)
+
+
+def cell_col(longitude):
+    return min(int((float(longitude) + 180) * CELLS_PER_DEGREE), COLS - 1)
+
+
+def cell_for(latitude, longitude):
+    return cell_row(latitude) * COLS + cell_col(longitude)
+
+
+class GridCellField(models.IntegerField):
+    """Номер ячейки сетки, вычисляемый из latitude и longitude при каждой записи,
+    в том числе при bulk_create."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('default', 0)
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = cell_for(model_instance.latitude, model_instance.longitude)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def cell_ranges(min_lat, min_lon, max_lat, max_lon):
+    """Диапазоны номеров ячеек, покрывающие прямоугольник.
+
+    Если min_lon > max_lon, прямоугольник пересекает 180-й меридиан.
+    При слишком большом числе диапазонов возвращается одна полоса широт.
+    """
+    first_row, last_row = cell_row(min_lat), cell_row(max_lat)
+    if min_lon <= max_lon:
+        col_spans = [(cell_col(min_lon), cell_col(max_lon))]
+    else:
+        col_spans = [(0, cell_col(max_lon)), (cell_col(min_lon), COLS - 1)]
+
+    if (last_row - first_row + 1) * len(col_spans) > MAX_CELL_RANGES:
+        return [(first_row * COLS, last_row * COLS + COLS - 1)]
+
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        for first_col, last_col in col_spans:
+            low, high = row * COLS + first_col, row * COLS + last_col
+            if ranges and ranges[-1][1] + 1 >= low:
+                ranges[-1] = (ranges[-1][0], high)
+            else:
+                ranges.append((low, high))
+    return ranges
+
+
+def bbox_q(prefix, min_lat, min_lon, max_lat, max_lon):
+    """Условие попадания координат в прямоугольник: отбор по индексу ячеек и точная проверка."""
+    cells = models.Q()
+    for low, high in cell_ranges(min_lat, min_lon, max_lat, max_lon):
+        cells |= models.Q(**{f'{prefix}cell__range': (low, high)})
+
+    latitude = models.Q(**{f'{prefix}latitude__gte': min_lat, f'{prefix}latitude__lte': max_lat})
+    if min_lon <= max_lon:
+        longitude = models.Q(**{f'{prefix}longitude__gte': min_lon, f'{prefix}longitude__lte': max_lon})
+    else:
+        longitude = models.Q(**{f'{prefix}longitude__gte': min_lon}) | models.Q(**{f'{prefix}longitude__lte': max_lon})
+    return cells & latitude & longitude
+
+
+def longitude_half_width(latitude, half_size):
+    """Полуширина по долготе, в которую входит круг радиусом half_size градусов дуги.
+
+    None, если круг доходит до полюса и охватывает все долготы.
+    """
+    if half_size >= 180 or abs(latitude) + half_size >= 90:
+        return None
+    return math.degrees(math.asin(math.sin(math.radians(half_size)) / math.cos(math.radians(latitude))))
+
+
+def box_around(latitude, longitude, half_size):
+    """Прямоугольник вокруг круга радиусом half_size градусов дуги с центром в точке.
+
+    Ближе к полюсам прямоугольник шире по долготе; круг, доходящий до полюса,
+    покрывается полосой широт по всем долготам.
+    """
+    min_lat, max_lat = max(-90.0, latitude - half_size), min(90.0, latitude + half_size)
+    lon_half = longitude_half_width(latitude, half_size)
+    if lon_half is None:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon, max_lon = longitude - lon_half, longitude + lon_half
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def covered_radius_km(latitude, half_size):
+    """Радиус круга вокруг точки, целиком лежащего в box_around(latitude, ..., half_size).
+
+    Это расстояние до ближайшей границы прямоугольника; полюс границей не считается,
+    если прямоугольник охватывает все долготы.
+    """
+    min_lat, _, max_lat, _ = box_around(latitude, 0.0, half_size)
+    lon_half = longitude_half_width(latitude, half_size)
+    edges = []
+    if min_lat > -90 or lon_half is not None:
+        edges.append(latitude - min_lat)
+    if max_lat < 90 or lon_half is not None:
+        edges.append(max_lat - latitude)
+    if lon_half is not None:
+        # расстояние до меридиана, отстоящего на lon_half по долготе
+        edges.append(math.degrees(math.asin(math.cos(math.radians(latitude)) * math.sin(math.radians(lon_half)))))
+    return min(edges, default=180.0) * KM_PER_DEGREE
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
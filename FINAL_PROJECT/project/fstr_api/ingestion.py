@@ -0,0 +1,322 @@
+import hashlib
+import io
+import ipaddress
+import logging
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.utils.module_loading import import_string
+
+from .models import Image, ImageBlob, Pass
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {
+    'thumbnail': 256,
+    'medium': 1024,
+}
+
+
+class UnsafeURL(ValueError):
+    pass
+
+
+def check_public_address(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if not ip.is_global or ip.is_multicast:
+        raise UnsafeURL(f'Адрес {address} не является публичным')
+
+
+class PublicAddressMixin:
+    """Соединение urllib3, которое проверяет адрес сразу после подключения, до отправки запроса."""
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        try:
+            check_public_address(sock.getpeername()[0])
+        except UnsafeURL:
+            sock.close()
+            raise
+        return sock
+
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = type('PublicHTTPConnection', (PublicAddressMixin, HTTPConnection), {})
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = type('PublicHTTPSConnection', (PublicAddressMixin, HTTPSConnection), {})
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': PublicHTTPConnectionPool,
+            'https': PublicHTTPSConnectionPool,
+        }
+
+
+class HttpImageFetcher:
+    """Скачивает изображения по ссылкам из заявок.
+
+    Ссылки присылают клиенты, поэтому допускаются только http и https на
+    публичные адреса. Имя хоста проверяется до запроса, а адрес, с которым
+    фактически установлено соединение, — до отправки запроса (на случай подмены
+    DNS). Перенаправления проходят ту же проверку, прокси из окружения не
+    используются, размер ответа ограничен max_size.
+    """
+    timeout = 10
+    max_size = 20 * 1024 * 1024
+    max_redirects = 5
+    chunk_size = 64 * 1024
+
+    def fetch(self, url):
+        with requests.Session() as session:
+            session.trust_env = False
+            session.mount('http://', PublicAddressAdapter())
+            session.mount('https://', PublicAddressAdapter())
+            for _ in range(self.max_redirects + 1):
+                self.check_url(url)
+                with session.get(url, timeout=self.timeout, stream=True, allow_redirects=False) as response:
+                    if response.is_redirect:
+                        url = urljoin(url, response.headers['Location'])
+                        continue
+                    response.raise_for_status()
+                    return self.read(url, response)
+        raise UnsafeURL(f'Слишком много перенаправлений: {url}')
+
+    def check_url(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise UnsafeURL(f'Недопустимая ссылка на изображение: {url}')
+        try:
+            addresses = socket.getaddrinfo(parts.hostname, parts.port or parts.scheme, type=socket.SOCK_STREAM)
+        except socket.gaierror as exc:
+            raise UnsafeURL(f'Не удалось разрешить адрес {parts.hostname}') from exc
+        for *_, sockaddr in addresses:
+            check_public_address(sockaddr[0])
+
+    def read(self, url, response):
+        declared = response.headers.get('Content-Length')
+        if declared and declared.isdigit() and int(declared) > self.max_size:
+            raise ValueError(f'Изображение {url} больше {self.max_size} байт')
+        content = bytearray()
+        for chunk in response.iter_content(self.chunk_size):
+            content += chunk
+            if len(content) > self.max_size:
+                raise ValueError(f'Изображение {url} больше {self.max_size} байт')
+        return bytes(content)
+
+
+class LocalImageFetcher:
+    """Подставной загрузчик для тестов и локальной разработки без сети.
+
+    Отдаёт содержимое из словаря url -> bytes или читает файлы по ссылкам file://.
+    """
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+
+    def fetch(self, url):
+        if url in self.files:
+            return self.files[url]
+        if url.startswith('file://'):
+            return Path(url[len('file://'):]).read_bytes()
+        raise FileNotFoundError(url)
+
+
+def get_fetcher():
+    return import_string(getattr(settings, 'FSTR_IMAGE_FETCHER', 'fstr_api.ingestion.HttpImageFetcher'))()
+
+
+def blob_path(content_hash, name):
+    return f'passes/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}/{name}'
+
+
+def variant_urls(content_hash):
+    return {name: default_storage.url(blob_path(content_hash, f'{name}.jpg')) for name in VARIANT_SIZES}
+
+
+def render_variants(content):
+    """Строит уменьшенные копии изображения. Выполняется в пуле процессов."""
+    from PIL import Image as PILImage
+
+    variants = {}
+    with PILImage.open(io.BytesIO(content)) as original:
+        original = original.convert('RGB')
+        for name, size in VARIANT_SIZES.items():
+            variant = original.copy()
+            variant.thumbnail((size, size))
+            buffer = io.BytesIO()
+            variant.save(buffer, 'JPEG', quality=85)
+            variants[name] = buffer.getvalue()
+    return variants
+
+
+def delete_content(content_hash):
+    for name in ['original', *(f'{name}.jpg' for name in VARIANT_SIZES)]:
+        default_storage.delete(blob_path(content_hash, name))
+
+
+def collect_garbage(content_hashes):
+    """Удаляет содержимое, на которое больше не ссылается ни одно изображение."""
+    for content_hash in set(content_hashes):
+        deleted, _ = ImageBlob.objects.filter(pk=content_hash, ref_count=0).delete()
+        if deleted:
+            delete_content(content_hash)
+
+
+def release_blob(content_hash):
+    """Снимает ссылку на содержимое; освободившиеся файлы удаляются после фиксации транзакции."""
+    ImageBlob.release(content_hash)
+    transaction.on_commit(lambda: collect_garbage([content_hash]))
+
+
+def save_once(path, content):
+    """Записывает файл содержимого, если его ещё нет.
+
+    Имя файла однозначно задаётся хэшем, поэтому файл, записанный параллельным
+    обработчиком, совпадает с нашим; копия с суффиксом, которую хранилище
+    создаёт при совпадении имён, удаляется.
+    """
+    if default_storage.exists(path):
+        return
+    name = default_storage.save(path, ContentFile(content))
+    if name != path:
+        default_storage.delete(name)
+
+
+def store_content(content, render):
+    """Сохраняет оригинал и его копии по хэшу содержимого, если их ещё нет, и возвращает хэш.
+
+    Вызывается, пока на содержимое взята ссылка (ImageBlob.acquire): иначе сборка
+    мусора может удалить файлы, которые здесь посчитаны уже записанными.
+    """
+    content_hash = hashlib.sha256(content).hexdigest()
+    original_path = blob_path(content_hash, 'original')
+    if not default_storage.exists(original_path):
+        for name, variant in render(content).items():
+            save_once(blob_path(content_hash, f'{name}.jpg'), variant)
+        # оригинал пишется последним: его наличие означает, что копии уже готовы
+        save_once(original_path, content)
+    return content_hash
+
+
+class ImageIngestionPipeline:
+    """Фоновая загрузка изображений перевалов.
+
+    Скачивание выполняется в пуле потоков, построение копий — в пуле процессов,
+    поэтому запрос, создавший записи Image, не ждёт ни того, ни другого.
+    При render_workers=0 копии строятся в потоке загрузки. На SQLite, который
+    не допускает параллельной записи из потоков одного процесса, обращения
+    потоков к базе выполняются по очереди; скачивание и копии остаются параллельными.
+    """
+
+    def __init__(self, fetcher=None, fetch_workers=4, render_workers=None):
+        self.fetcher = fetcher
+        self.fetch_workers = fetch_workers
+        self.render_workers = render_workers
+        self._fetch_pool = None
+        self._render_pool = None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    def database(self):
+        return self._db_lock if connection.vendor == 'sqlite' else nullcontext()
+
+    def submit(self, image_ids):
+        with self._lock:
+            if self.fetcher is None:
+                self.fetcher = get_fetcher()
+            if self._fetch_pool is None:
+                self._fetch_pool = ThreadPoolExecutor(self.fetch_workers, thread_name_prefix='fstr-images')
+            if self._render_pool is None and self.render_workers != 0:
+                self._render_pool = ProcessPoolExecutor(self.render_workers)
+        return [self._fetch_pool.submit(self.process, image_id) for image_id in image_ids]
+
+    def render(self, content):
+        if self._render_pool is None:
+            return render_variants(content)
+        return self._render_pool.submit(render_variants, content).result()
+
+    def process(self, image_id):
+        try:
+            with self.database():
+                image = Image.objects.filter(pk=image_id, state='pending').first()
+                if image is None:
+                    return
+                known = None
+                if getattr(settings, 'FSTR_IMAGE_REUSE_KNOWN_URLS', True):
+                    # та же ссылка уже загружалась: содержимое берётся из хранилища без повторного скачивания
+                    known = (Image.objects.filter(data=image.data, state='ready', blob__isnull=False)
+                             .values_list('blob_id', 'blob__size').first())
+            try:
+                if known:
+                    content_hash, size = known
+                    with self.database(), transaction.atomic():
+                        ImageBlob.acquire(content_hash, size)
+                else:
+                    content = self.fetcher.fetch(image.data)
+                    content_hash = hashlib.sha256(content).hexdigest()
+                    # ссылка берётся до записи файлов, чтобы сборка мусора их не удалила
+                    with self.database(), transaction.atomic():
+                        ImageBlob.acquire(content_hash, len(content))
+                    try:
+                        store_content(content, self.render)
+                    except Exception:
+                        self.release(content_hash)
+                        raise
+            except Exception:
+                logger.warning('Не удалось загрузить изображение %s (%s)', image_id, image.data, exc_info=True)
+                with self.database():
+                    Image.objects.filter(pk=image_id).update(state='failed')
+                    Pass.objects.filter(pk=image.pass_obj_id).touch()
+                return
+
+            with self.database(), transaction.atomic():
+                if Image.objects.filter(pk=image_id, state='pending').update(state='ready', blob_id=content_hash):
+                    Pass.objects.filter(pk=image.pass_obj_id).touch()
+                    return
+            # изображение удалено или обработано параллельно, пока шла загрузка
+            self.release(content_hash)
+        except Exception:
+            logger.exception('Ошибка обработки изображения %s', image_id)
+        finally:
+            close_old_connections()
+
+    def release(self, content_hash):
+        """Снимает взятую ссылку; файлы, на которые больше никто не ссылается, удаляются."""
+        with self.database(), transaction.atomic():
+            release_blob(content_hash)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            for pool in (self._fetch_pool, self._render_pool):
+                if pool is not None:
+                    pool.shutdown(wait=wait)
+            self._fetch_pool = self._render_pool = None
+
+
+pipeline = ImageIngestionPipeline()
+
+
+def schedule_ingestion(image_ids):
+    """Ставит изображения в очередь загрузки после фиксации текущей транзакции."""
+    image_ids = list(image_ids)
+    if image_ids:
+        transaction.on_commit(lambda: pipeline.submit(image_ids))
@@ -0,0 +1,250 @@
+"""Замеры запросов к API: этапы обработки, запросы к базе, метрики и журнал медленных запросов.
+
+InstrumentationMiddleware заводит на каждый запрос RequestTimings. Этапы
+(validation, serialization, render) отмечаются через timed(), запросы к базе
+считает обёртка выполнения SQL, которую получает каждое соединение. По итогам
+запроса ответ получает заголовок Server-Timing, сводка попадает в метрики
+процесса (эндпоинт metrics, формат Prometheus), а медленные запросы — в журнал
+fstr_api.slow_requests.
+"""
+import heapq
+import hmac
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('fstr_api.slow_requests')
+
+PHASES = ['validation', 'db', 'serialization', 'render']
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SLOWEST_QUERIES = 3
+
+current_timings = ContextVar('fstr_request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.query_count = 0
+        self.slowest_queries = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_query(self, sql, seconds):
+        self.query_count += 1
+        self.phases['db'] += seconds
+        entry = (seconds, self.query_count, sql)
+        if len(self.slowest_queries) < SLOWEST_QUERIES:
+            heapq.heappush(self.slowest_queries, entry)
+        else:
+            heapq.heappushpop(self.slowest_queries, entry)
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        items = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.phases.items() if seconds]
+        items.append(f'db-queries;desc="{self.query_count}"')
+        items.append(f'total;dur={self.total * 1000:.2f}')
+        return ', '.join(items)
+
+
+@contextmanager
+def timed(phase):
+    """Добавляет время блока к этапу phase текущего запроса; вне запроса ничего не делает."""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid='fstr_api_record_query')
+
+
+class Metrics:
+    """Счётчики и гистограммы запросов процесса в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.durations = {}
+            self.phases = {}
+            self.queries = {}
+
+    def observe(self, view, method, status_code, timings):
+        with self.lock:
+            key = (view, method, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            buckets, total, count = self.durations.get(view, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            buckets = [n + (timings.total <= bound) for n, bound in zip(buckets, DURATION_BUCKETS)]
+            self.durations[view] = (buckets, total + timings.total, count + 1)
+
+            for phase, seconds in timings.phases.items():
+                self.phases[(view, phase)] = self.phases.get((view, phase), 0.0) + seconds
+            self.queries[view] = self.queries.get(view, 0) + timings.query_count
+
+    def render(self):
+        with self.lock:
+            lines = [
+                '# HELP fstr_requests_total Запросы к API по представлению, методу и коду ответа.',
+                '# TYPE fstr_requests_total counter',
+            ]
+            for (view, method, status_code), value in sorted(self.requests.items()):
+                lines.append(f'fstr_requests_total{{view="{view}",method="{method}",status="{status_code}"}} {value}')
+
+            lines += [
+                '# HELP fstr_request_duration_seconds Время обработки запроса.',
+                '# TYPE fstr_request_duration_seconds histogram',
+            ]
+            for view, (buckets, total, count) in sorted(self.durations.items()):
+                for bound, value in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f'fstr_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {value}')
+                lines.append(f'fstr_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}')
+                lines.append(f'fstr_request_duration_seconds_sum{{view="{view}"}} {total:.6f}')
+                lines.append(f'fstr_request_duration_seconds_count{{view="{view}"}} {count}')
+
+            lines += [
+                '# HELP fstr_request_phase_seconds_total Суммарное время этапов обработки запросов.',
+                '# TYPE fstr_request_phase_seconds_total counter',
+            ]
+            for (view, phase), value in sorted(self.phases.items()):
+                lines.append(f'fstr_request_phase_seconds_total{{view="{view}",phase="{phase}"}} {value:.6f}')
+
+            lines += [
+                '# HELP fstr_db_queries_total Запросы к базе, выполненные при обработке запросов к API.',
+                '# TYPE fstr_db_queries_total counter',
+            ]
+            for view, value in sorted(self.queries.items()):
+                lines.append(f'fstr_db_queries_total{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name or match.view_name if match else 'unmatched'
+
+
+def log_slow_request(request, response, timings):
+    threshold = getattr(settings, 'FSTR_SLOW_REQUEST_SECONDS', 1.0)
+    if timings.total < threshold or random.random() >= getattr(settings, 'FSTR_SLOW_REQUEST_SAMPLE_RATE', 1.0):
+        return
+    phases = ', '.join(f'{phase}={seconds * 1000:.1f}ms' for phase, seconds in timings.phases.items())
+    queries = '; '.join(f'{seconds * 1000:.1f}ms {sql[:200]}'
+                        for seconds, _, sql in sorted(timings.slowest_queries, reverse=True))
+    logger.warning(
+        'Медленный запрос %s %s: %s за %.1f мс (%s), запросов к базе: %d; самые долгие: %s',
+        request.method, request.get_full_path(), response.status_code, timings.total * 1000,
+        phases, timings.query_count, queries or '-',
+    )
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        # соединения, открытые до загрузки middleware, сигнал connection_created уже пропустили
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        # ответы DRF отрисовываются после представления: замеряем до конца отрисовки
+        timings = current_timings.get()
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: timings.add('render', time.perf_counter() - started))
+        return response
+
+    def finish(self, request, response, timings):
+        timings.finish()
+        view = view_label(request)
+        if view == 'metrics':
+            return response
+        metrics.observe(view, request.method, response.status_code, timings)
+        if getattr(settings, 'FSTR_SERVER_TIMING', True):
+            response['Server-Timing'] = timings.server_timing()
+        log_slow_request(request, response, timings)
+        return response
+
+
+def metrics_allowed(request):
+    """Метрики отдаются по токену FSTR_METRICS_TOKEN в заголовке Authorization: Bearer или персоналу.
+
+    Адрес клиента не проверяется: за обратным прокси это адрес самого прокси.
+    """
+    token = getattr(settings, 'FSTR_METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_staff)
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus; доступ проверяет metrics_allowed."""
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,272 @@
+import io
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import accumulate
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count
+from django.urls import reverse
+
+from ...caching import get_cache
+from ...models import PassDocument, User
+from ...synthetic import generate_dataset, make_phone
+
+SCENARIOS = ['submit', 'detail', 'list']
+# пользователи набора нумеруются с этого места, новые пользователи заявок — после них
+DATASET_START = 10**9
+SUBMIT_START = 3 * 10**9
+QUERIES_RE = re.compile(r'db-queries;desc="(\d+)"')
+
+
+def percentile(values, share):
+    return values[int(share * (len(values) - 1))] if values else 0.0
+
+
+def same_database(first, second):
+    return all(first.get(key) == second.get(key) for key in ('ENGINE', 'NAME', 'HOST', 'PORT'))
+
+
+def check_bench_database(alias):
+    """Псевдоним отдельной базы для нагрузочной проверки; основную базу не принимает."""
+    if alias not in connections.settings:
+        raise CommandError(f"В DATABASES нет базы {alias}: задайте FSTR_BENCH_DB_NAME или укажите --database")
+    if alias == DEFAULT_DB_ALIAS or same_database(connections.settings[alias],
+                                                  connections.settings[DEFAULT_DB_ALIAS]):
+        raise CommandError("Данные нагрузочной проверки остаются в базе: "
+                           "укажите отдельную базу, а не основную")
+    return alias
+
+
+@contextmanager
+def serve_from(alias):
+    """На время блока все запросы к базе по умолчанию, в том числе из потоков, идут в базу alias."""
+    default = connections.settings[DEFAULT_DB_ALIAS]
+    drop_default_connection()
+    connections.settings[DEFAULT_DB_ALIAS] = connections.settings[alias]
+    try:
+        yield
+    finally:
+        drop_default_connection()
+        connections.settings[DEFAULT_DB_ALIAS] = default
+
+
+def drop_default_connection():
+    # открытое соединение помнит параметры базы, при следующем обращении создаётся новое
+    connections[DEFAULT_DB_ALIAS].close()
+    del connections[DEFAULT_DB_ALIAS]
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочная проверка API перевалов на отдельной базе --database (по умолчанию bench, "
+            "задаётся переменной FSTR_BENCH_DB_NAME и создаётся migrate --database bench). "
+            "Если синтетических перевалов меньше --passes, набор догенерируется и сохраняется для "
+            "следующих запусков; удаляется он вместе с базой (или flush --database bench). "
+            "С основной базой команда не работает. Сценарии: submit — поток заявок, половина от уже известных "
+            "пользователей; detail — карточки с распределением Ципфа по --hot-keys самым "
+            "запрашиваемым перевалам; list — постраничный обход списков тяжёлых пользователей. "
+            "Для каждого сценария выводятся запросы в секунду, задержки p50/p95/p99 и число запросов "
+            "к базе на запрос (из заголовка Server-Timing). С --baseline результат сравнивается "
+            "с сохранённым через --json, и команда завершается ошибкой при регрессии.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='bench',
+                            help="Псевдоним базы из DATABASES, в которую пишутся набор и заявки; не default")
+        parser.add_argument('--scenario', choices=SCENARIOS, action='append',
+                            help="Сценарий; можно указать несколько раз, по умолчанию все")
+        parser.add_argument('--requests', type=int, default=2000, help="Запросов в каждом сценарии")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--passes', type=int, default=1_000_000)
+        parser.add_argument('--images', type=int, default=2, help="Изображений у каждого перевала набора")
+        parser.add_argument('--submit-images', type=int, default=0,
+                            help="Изображений в заявках submit; их ссылки скачиваются в фоне загрузчиком "
+                                 "FSTR_IMAGE_FETCHER")
+        parser.add_argument('--heavy-users', type=int, default=10)
+        parser.add_argument('--heavy-share', type=float, default=0.05,
+                            help="Доля перевалов набора у тяжёлых пользователей")
+        parser.add_argument('--hot-keys', type=int, default=1000)
+        parser.add_argument('--zipf', type=float, default=1.1, help="Показатель распределения Ципфа")
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--list-pages', type=int, default=10, help="Страниц в одном обходе списка")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help="Сохранить результаты в файл")
+        parser.add_argument('--baseline', help="Файл результатов, с которым сравнивать")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Допустимый рост p95 относительно --baseline")
+
+    def handle(self, *args, **options):
+        alias = check_bench_database(options['database'])
+        with serve_from(alias):
+            self.run(options)
+
+    def run(self, options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        heavy_emails = self.ensure_dataset()
+        self.application = get_wsgi_application()
+
+        results = {}
+        self.stdout.write(f"{'Сценарий':<10} {'запросов':>9} {'RPS':>8} {'p50, мс':>9} {'p95, мс':>9} "
+                          f"{'p99, мс':>9} {'SQL/запрос':>11} {'ошибки':>7}")
+        for scenario in options['scenario'] or SCENARIOS:
+            get_cache().clear()
+            if scenario == 'submit':
+                result = self.run_tasks(self.submit_tasks())
+            elif scenario == 'detail':
+                result = self.run_tasks(self.detail_tasks())
+            else:
+                result = self.run_tasks(self.list_tasks(heavy_emails))
+            connections.close_all()
+            results[scenario] = result
+            self.stdout.write(
+                f"{scenario:<10} {result['requests']:>9} {result['rps']:>8.0f} {result['p50_ms']:>9.2f} "
+                f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['queries_per_request']:>11.2f} "
+                f"{result['errors']:>7}"
+            )
+
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def ensure_dataset(self):
+        options = self.options
+        missing_passes = options['passes'] - PassDocument.objects.count()
+        if missing_passes > 0:
+            self.stdout.write(f"Генерация набора: {options['users']} пользователей, {missing_passes} перевалов")
+            started = time.perf_counter()
+            generate_dataset(
+                options['users'], missing_passes, options['images'], options['heavy_users'],
+                options['heavy_share'], start=DATASET_START + User.objects.count(), seed=options['seed'],
+                progress=lambda stage, done: self.stdout.write(f"\r{stage}: {done}", ending=''),
+            )
+            self.stdout.write(f"\nНабор сгенерирован за {time.perf_counter() - started:.1f} с")
+
+        return list(
+            PassDocument.objects.values('user_email').annotate(passes=Count('pk'))
+            .order_by('-passes').values_list('user_email', flat=True)[:options['heavy_users']]
+        )
+
+    def submit_tasks(self):
+        known = list(User.objects.order_by('?').values('email', 'fam', 'name', 'otc', 'phone')[:1000])
+        offset = SUBMIT_START + User.objects.filter(email__startswith='bench').count()
+        tasks = []
+        for i in range(self.options['requests']):
+            if known and i % 2 == 0:
+                user = self.rng.choice(known)
+            else:
+                number = offset + i
+                user = {'email': f'bench{number}@example.com', 'fam': 'Петров', 'name': 'Пётр',
+                        'otc': 'Петрович', 'phone': make_phone(number)}
+            payload = {
+                'title': f'Перевал {i}',
+                'user': user,
+                'coords': {
+                    'latitude': f'{self.rng.uniform(-90, 90):.4f}',
+                    'longitude': f'{self.rng.uniform(-180, 180):.4f}',
+                    'height': self.rng.randint(0, 8848),
+                },
+                'level': {'summer': '1А'},
+                'images': [{'data': f'https://example.com/bench/{offset + i}/{n}.jpg', 'title': f'Фото {n}'}
+                           for n in range(self.options['submit_images'])],
+            }
+            tasks.append([('POST', reverse('pass_list'), '', json.dumps(payload, ensure_ascii=False))])
+        return tasks
+
+    def detail_tasks(self):
+        hot = list(PassDocument.objects.order_by('?').values_list('pk', flat=True)[:self.options['hot_keys']])
+        weights = list(accumulate(1 / rank ** self.options['zipf'] for rank in range(1, len(hot) + 1)))
+        picks = self.rng.choices(hot, cum_weights=weights, k=self.options['requests'])
+        return [[('GET', reverse('pass_detail', args=[pk]), '', None)] for pk in picks]
+
+    def list_tasks(self, emails):
+        # задача — обход до --list-pages страниц одного пользователя по курсору
+        walks = max(self.options['requests'] // self.options['list_pages'], 1) if emails else 0
+        return [('list', self.rng.choice(emails)) for _ in range(walks)]
+
+    def call(self, method, path, query, body):
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO((body or '').encode()),
+            'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False, 'wsgi.version': (1, 0),
+        }
+        if body is not None:
+            environ['CONTENT_TYPE'] = 'application/json'
+            environ['CONTENT_LENGTH'] = str(len(environ['wsgi.input'].getvalue()))
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+
+        started = time.perf_counter()
+        chunks = self.application(environ, start_response)
+        content = b''.join(chunks)
+        chunks.close()
+        elapsed = time.perf_counter() - started
+        match = QUERIES_RE.search(response['headers'].get('Server-Timing', ''))
+        return elapsed, response['status'], int(match.group(1)) if match else None, content
+
+    def run_task(self, task):
+        results = []
+        if task[0] == 'list':
+            cursor = ''
+            page_size = self.options['page_size']
+            while True:
+                query = {'user__email': task[1], 'page_size': page_size}
+                if cursor:
+                    query['cursor'] = cursor
+                elapsed, status_code, queries, content = self.call('GET', reverse('pass_list'), urlencode(query), None)
+                results.append((elapsed, status_code, queries))
+                cursor = json.loads(content).get('next_cursor') if status_code == 200 else None
+                if not cursor or len(results) >= self.options['list_pages']:
+                    return results
+        for method, path, query, body in task:
+            elapsed, status_code, queries, _ = self.call(method, path, query, body)
+            results.append((elapsed, status_code, queries))
+        return results
+
+    def run_tasks(self, tasks):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options['concurrency']) as executor:
+            results = [result for results in executor.map(self.run_task, tasks) for result in results]
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(result[0] for result in results)
+        queries = [result[2] for result in results if result[2] is not None]
+        return {
+            'requests': len(results),
+            'errors': sum(1 for result in results if result[1] >= 400),
+            'rps': len(results) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(timings, 0.50) * 1000,
+            'p95_ms': percentile(timings, 0.95) * 1000,
+            'p99_ms': percentile(timings, 0.99) * 1000,
+            'queries_per_request': sum(queries) / len(queries) if queries else 0.0,
+            'max_queries': max(queries, default=0),
+        }
+
+    def compare(self, results, path, tolerance):
+        with open(path) as file:
+            baseline = json.load(file)
+        regressions = []
+        for scenario, result in results.items():
+            before = baseline.get(scenario)
+            if before is None:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{scenario}: p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} мс")
+            if result['max_queries'] > before['max_queries']:
+                regressions.append(f"{scenario}: запросов к базе {before['max_queries']} -> {result['max_queries']}")
+        if regressions:
+            raise CommandError("Регрессия относительно базового запуска:\n" + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS("Регрессий относительно базового запуска нет"))
@@ -0,0 +1,145 @@
+import asyncio
+import io
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.urls import reverse
+
+from ...caching import get_cache
+from ...documents import refresh_documents
+from ...models import Pass, PassDocument
+from ...synthetic import generate_passes, generate_users
+from .bench_api import check_bench_database, serve_from
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает пропускную способность и задержки эндпоинтов перевалов под WSGI "
+            "(синхронные представления, пул потоков) и ASGI (асинхронные представления). "
+            "Приложения вызываются в процессе, без HTTP-сервера, на отдельной базе --database "
+            "(по умолчанию bench, как у bench_api); с основной базой команда не работает. "
+            "Если документов перевалов в ней нет, создаётся --passes синтетических записей.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='bench',
+                            help="Псевдоним базы из DATABASES, из которой читаются перевалы; не default")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help="Одновременных запросов: потоков под WSGI, задач под ASGI")
+        parser.add_argument('--scenario', choices=['detail', 'list', 'mixed'], default='mixed')
+        parser.add_argument('--passes', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with serve_from(check_bench_database(options['database'])):
+            self.run(options)
+
+    def run(self, options):
+        self.ensure_data(options['passes'])
+        rng = random.Random(options['seed'])
+        pks = list(PassDocument.objects.values_list('pk', flat=True)[:10_000])
+        emails = list(PassDocument.objects.values_list('user_email', flat=True).distinct()[:10_000])
+
+        requests = []
+        for _ in range(options['requests']):
+            scenario = options['scenario']
+            if scenario == 'mixed':
+                scenario = rng.choice(['detail', 'list'])
+            if scenario == 'detail':
+                pk = rng.choice(pks)
+                requests.append(('pass_detail', [pk], ''))
+            else:
+                requests.append(('pass_list', [], urlencode({'user__email': rng.choice(emails), 'page_size': 20})))
+
+        runs = [
+            ('WSGI, синхронные', self.run_wsgi, ''),
+            ('ASGI, синхронные', self.run_asgi, ''),
+            ('ASGI, асинхронные', self.run_asgi, '_async'),
+        ]
+        self.stdout.write(f"Запросов: {len(requests)}, сценарий: {options['scenario']}, "
+                          f"одновременно: {options['concurrency']}")
+        self.stdout.write(f"{'Развёртывание':<20} {'RPS':>8} {'p50, мс':>9} {'p99, мс':>9} {'ошибки':>7}")
+        for name, run, suffix in runs:
+            paths = [(reverse(url_name + suffix, args=args), query) for url_name, args, query in requests]
+            get_cache().clear()
+            elapsed, timings, errors = run(paths, options['concurrency'])
+            connections.close_all()
+            timings.sort()
+            p50 = timings[int(0.50 * (len(timings) - 1))]
+            p99 = timings[int(0.99 * (len(timings) - 1))]
+            self.stdout.write(f"{name:<20} {len(paths) / elapsed:>8.0f} "
+                              f"{p50 * 1000:>9.2f} {p99 * 1000:>9.2f} {errors:>7}")
+
+    def ensure_data(self, count):
+        if PassDocument.objects.exists():
+            return
+        self.stdout.write(f"Документов перевалов нет, создаю {count} синтетических записей")
+        users = generate_users(max(count // 20, 1), start=10**9)
+        generate_passes(users, count)
+        refresh_documents(Pass.objects.filter(user__in=users).values_list('pk', flat=True))
+
+    def run_wsgi(self, paths, threads):
+        application = get_wsgi_application()
+
+        def call(item):
+            path, query = item
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                       'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO()}
+            setup_testing_defaults(environ)
+            statuses = []
+            started = time.perf_counter()
+            body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            b''.join(body)
+            body.close()
+            return time.perf_counter() - started, not statuses[0].startswith('200')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(call, paths))
+        return time.perf_counter() - started, [t for t, _ in results], sum(error for _, error in results)
+
+    def run_asgi(self, paths, concurrency):
+        application = get_asgi_application()
+
+        async def call(path, query, semaphore):
+            async with semaphore:
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+                    'query_string': query.encode(), 'headers': [(b'host', b'localhost')],
+                    'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+                }
+                finished = asyncio.Event()
+                messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+                statuses = []
+
+                async def receive():
+                    message = next(messages, None)
+                    if message is None:
+                        await finished.wait()
+                        return {'type': 'http.disconnect'}
+                    return message
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        statuses.append(message['status'])
+                    elif not message.get('more_body'):
+                        finished.set()
+
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                return time.perf_counter() - started, statuses[0] != 200
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(call(path, query, semaphore) for path, query in paths))
+
+        started = time.perf_counter()
+        results = asyncio.run(main())
+        return time.perf_counter() - started, [t for t, _ in results], sum(error for _, error in results)
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ...models import Pass
+from ...synthetic import generate_passes, generate_users
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Заполняет таблицу перевалов синтетическими данными, выводит план и время "
+            "запроса очереди модерации. Данные откатываются, если не указан --keep.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--keep', action='store_true', help="Не откатывать сгенерированные данные")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("Сгенерированные данные откачены")
+
+    def run(self, options):
+        started = time.perf_counter()
+        users = generate_users(options['users'], start=10**9)
+        generate_passes(
+            users, options['rows'],
+            progress=lambda done: self.stdout.write(f"\rСоздано перевалов: {done}", ending=''),
+        )
+        self.stdout.write(f"\nДанные сгенерированы за {time.perf_counter() - started:.1f} с")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Pass._meta.db_table}')
+
+        queryset = (Pass.objects
+                    .filter(status__in=Pass.MODERATION_STATUSES)
+                    .order_by('add_time', 'id')[:options['page_size']])
+
+        plan = queryset.explain()
+        self.stdout.write("План запроса очереди модерации:")
+        self.stdout.write(plan)
+        index_name = 'pass_status_add_time_idx'
+        if index_name in plan:
+            self.stdout.write(self.style.SUCCESS(f"Запрос использует индекс {index_name}"))
+        else:
+            self.stdout.write(self.style.WARNING(f"Индекс {index_name} в плане не найден"))
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            list(queryset.all())
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f"Время страницы из {options['page_size']} записей: "
+            f"медиана {timings[len(timings) // 2] * 1000:.2f} мс, максимум {timings[-1] * 1000:.2f} мс"
+        )
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.urls import resolve, reverse
+
+
+class Command(BaseCommand):
+    help = ("Измеряет время разрешения путей API и показывает, в какой обработчик "
+            "попадает каждый HTTP-метод.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        paths = [
+            reverse('pass_list'),
+            reverse('pass_detail', args=[1]),
+            reverse('submit_data_bulk'),
+            reverse('moderation_queue'),
+            reverse('nearest_passes'),
+        ]
+        for path in paths:
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                match = resolve(path)
+            elapsed = (time.perf_counter() - started) / options['repeat']
+
+            view_class = match.func.cls
+            handlers = getattr(view_class, 'handlers', None)
+            if handlers is None:
+                handlers = {method: match.func for method in view_class.http_method_names
+                            if method not in ('options', 'head')}
+            routes = ', '.join(f'{method.upper()} -> {view.cls.__name__}' for method, view in handlers.items())
+            self.stdout.write(f"{path:<40} {elapsed * 1_000_000:7.2f} мкс  {routes}")
@@ -0,0 +1,138 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...serializers import PassSerializer, UserLookup
+from ...synthetic import generate_users, make_phone
+from ...validation import pass_validator
+
+# порча корректной заявки: (описание, путь к полю, значение; None — удалить поле)
+MUTATIONS = [
+    ('нет названия', ('title',), None),
+    ('длинное название', ('title',), 'П' * 300),
+    ('неверный телефон', ('user', 'phone'), '89001234567'),
+    ('неверный email', ('user', 'email'), 'not-an-email'),
+    ('чужие ФИО', ('user', 'fam'), 'Другой'),
+    ('широта вне диапазона', ('coords', 'latitude'), '91.5'),
+    ('лишние знаки широты', ('coords', 'longitude'), '7.123456'),
+    ('высота строкой', ('coords', 'height'), 'высоко'),
+    ('изображения не списком', ('images',), 'https://example.com/1.jpg'),
+    ('неизвестный статус', ('status',), 'draft'),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает время проверки заявок PassSerializer и скомпилированным валидатором "
+            "на пачке со смесью корректных и ошибочных заявок и сверяет результаты.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payloads', type=int, default=500)
+        parser.add_argument('--invalid', type=float, default=0.1, help="Доля ошибочных заявок")
+        parser.add_argument('--images', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def make_payloads(self, options):
+        rng = random.Random(options['seed'])
+        users = generate_users(options['payloads'] // 2, start=10**9)
+        payloads = []
+        for i in range(options['payloads']):
+            if i % 2 == 0 and users:
+                user = rng.choice(users)
+                user_data = {'email': user.email, 'fam': user.fam, 'name': user.name,
+                             'otc': user.otc, 'phone': user.phone}
+            else:
+                number = 2 * 10**9 + i
+                user_data = {'email': f'new{number}@example.com', 'fam': 'Петров', 'name': 'Пётр',
+                             'otc': 'Петрович', 'phone': make_phone(number)}
+            payload = {
+                'beauty_title': 'пер. ',
+                'title': f'Перевал {i}',
+                'other_titles': 'Триев',
+                'connect': '',
+                'user': user_data,
+                'coords': {
+                    'latitude': f'{rng.uniform(-90, 90):.4f}',
+                    'longitude': f'{rng.uniform(-180, 180):.4f}',
+                    'height': rng.randint(0, 8848),
+                },
+                'level': {'winter': '', 'summer': '1А', 'autumn': '1А', 'spring': ''},
+                'images': [
+                    {'data': f'https://example.com/{i}/{n}.jpg', 'title': f'Фото {n}'}
+                    for n in range(options['images'])
+                ],
+            }
+            if rng.random() < options['invalid']:
+                _, path, value = rng.choice(MUTATIONS)
+                target = payload
+                for key in path[:-1]:
+                    target = target[key]
+                if value is None:
+                    target.pop(path[-1], None)
+                else:
+                    target[path[-1]] = value
+            payloads.append(payload)
+        return payloads
+
+    def run_serializer(self, payloads):
+        context = {'users': UserLookup.for_payloads(payloads)}
+        results = []
+        for payload in payloads:
+            serializer = PassSerializer(data=payload, context=context)
+            if serializer.is_valid():
+                results.append((serializer.validated_data, {}))
+            else:
+                results.append((None, serializer.errors))
+        return results
+
+    def run_validator(self, payloads):
+        context = {'users': UserLookup.for_payloads(payloads)}
+        return pass_validator.validate_many(payloads, context)
+
+    def measure(self, run, payloads, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = run(payloads)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return results, timings[len(timings) // 2]
+
+    def run(self, options):
+        payloads = self.make_payloads(options)
+        count = len(payloads)
+
+        expected, serializer_time = self.measure(self.run_serializer, payloads, options['repeat'])
+        actual, validator_time = self.measure(self.run_validator, payloads, options['repeat'])
+
+        invalid = sum(1 for _, errors in expected if errors)
+        self.stdout.write(f"Заявок: {count}, из них ошибочных: {invalid}")
+        for name, elapsed in (('PassSerializer', serializer_time), ('pass_validator', validator_time)):
+            self.stdout.write(
+                f"{name:<16} {elapsed * 1000:8.1f} мс на пачку, {elapsed / count * 1_000_000:7.1f} мкс на заявку"
+            )
+        self.stdout.write(f"Ускорение: {serializer_time / validator_time:.1f}x")
+
+        mismatches = [
+            index for index, (left, right) in enumerate(zip(expected, actual))
+            if (left[0] is None) != (right[0] is None) or left[1] != right[1]
+            or (left[0] is not None and dict(left[0]) != right[0])
+        ]
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"Результаты расходятся для заявок: {mismatches[:20]}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Результаты и ошибки совпадают"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, stream_export
+from ...views import parse_date_bound
+
+
+class Command(BaseCommand):
+    help = ("Выгружает все перевалы в NDJSON или GeoJSON, читая их пачками. "
+            "Прерванную выгрузку можно продолжить с --after-id.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--file', help="Файл для выгрузки (по умолчанию стандартный вывод)")
+        parser.add_argument('--after-id', type=int, default=0, help="Выгрузить перевалы с id больше указанного")
+        parser.add_argument('--since', help="Только изменённые с этого момента (дата или дата-время ISO 8601)")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_date_bound(options['since']) if options['since'] else None
+        except ValueError:
+            raise CommandError(f"Некорректная дата: {options['since']}")
+
+        parts = stream_export(options['output'], options['after_id'], since, options['chunk_size'])
+        if not options['file']:
+            for part in parts:
+                self.stdout.write(part, ending='')
+            return
+
+        # продолжение NDJSON дописывается в тот же файл; GeoJSON — всегда отдельный документ
+        append = options['after_id'] and options['output'] == 'ndjson'
+        with open(options['file'], 'a' if append else 'w', encoding='utf-8') as out:
+            out.writelines(parts)
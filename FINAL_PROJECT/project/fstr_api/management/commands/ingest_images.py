@@ -0,0 +1,28 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from ...ingestion import pipeline
+from ...models import Image
+
+
+class Command(BaseCommand):
+    help = ("Загружает изображения перевалов, оставшиеся в состоянии pending "
+            "(например, после перезапуска сервера), и строит их уменьшенные копии.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help="Повторить и неудавшиеся загрузки")
+
+    def handle(self, *args, **options):
+        images = Image.objects.all()
+        if options['retry_failed']:
+            images.filter(state='failed').update(state='pending')
+        image_ids = list(images.filter(state='pending').values_list('id', flat=True))
+
+        wait(pipeline.submit(image_ids))
+        pipeline.shutdown()
+
+        states = Image.objects.filter(id__in=image_ids).values_list('state', flat=True)
+        self.stdout.write(f"Обработано изображений: {len(image_ids)}, "
+                          f"загружено: {sum(state == 'ready' for state in states)}, "
+                          f"с ошибкой: {sum(state == 'failed' for state in states)}")
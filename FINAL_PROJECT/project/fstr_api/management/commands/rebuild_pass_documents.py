@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ...documents import rebuild_documents
+
+
+class Command(BaseCommand):
+    help = ("Пересобирает документы перевалов, из которых отдаются карточка и список: "
+            "после миграции, добавившей их, или для проверки расхождений. Работает пачками по id.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start', type=int, default=0, help="Начать с перевалов с id больше этого")
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_documents(
+            options['start'], options['batch_size'],
+            progress=lambda done, last_pk: self.stdout.write(
+                f"\rПересобрано документов: {done} (последний id {last_pk})", ending=''),
+        )
+        self.stdout.write(f"\nГотово, документов: {rebuilt}")
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.3 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0006_pass_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pass',
+            index=models.Index(fields=['user', 'add_time', 'id'], name='pass_user_add_time_idx'),
+        ),
+    ]
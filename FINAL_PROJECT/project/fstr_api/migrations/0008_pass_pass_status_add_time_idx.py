@@ -0,0 +1,17 @@
+# Generated by Django 6.0.3 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0007_pass_pass_user_add_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pass',
+            index=models.Index(fields=['status', 'add_time'], name='pass_status_add_time_idx'),
+        ),
+    ]
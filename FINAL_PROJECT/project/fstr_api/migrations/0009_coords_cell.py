@@ -0,0 +1,33 @@
+# Generated by Django 6.0.3 on 2026-10-17 13:05
+
+import fstr_api.geo
+from django.db import migrations
+
+
+def fill_cells(apps, schema_editor):
+    Coords = apps.get_model('fstr_api', 'Coords')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for coords in Coords.objects.using(db_alias).only('id', 'latitude', 'longitude').iterator(chunk_size=2000):
+        coords.cell = fstr_api.geo.cell_for(coords.latitude, coords.longitude)
+        batch.append(coords)
+        if len(batch) == 2000:
+            Coords.objects.using(db_alias).bulk_update(batch, ['cell'])
+            batch = []
+    Coords.objects.using(db_alias).bulk_update(batch, ['cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0008_pass_pass_status_add_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coords',
+            name='cell',
+            field=fstr_api.geo.GridCellField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.3 on 2026-10-17 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0009_coords_cell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Ожидает загрузки'), ('ready', 'Загружено'), ('failed', 'Ошибка загрузки')], default='pending', max_length=10),
+        ),
+    ]
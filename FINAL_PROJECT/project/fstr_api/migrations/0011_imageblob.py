@@ -0,0 +1,47 @@
+# Generated by Django 6.0.3 on 2026-10-17 15:02
+
+import django.db.models.deletion
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def link_blobs(apps, schema_editor):
+    Image = apps.get_model('fstr_api', 'Image')
+    ImageBlob = apps.get_model('fstr_api', 'ImageBlob')
+    db_alias = schema_editor.connection.alias
+    counts = (Image.objects.using(db_alias).exclude(content_hash='')
+              .values('content_hash').annotate(count=models.Count('id')))
+    for row in counts:
+        content_hash = row['content_hash']
+        original = f'passes/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}/original'
+        size = default_storage.size(original) if default_storage.exists(original) else 0
+        ImageBlob.objects.using(db_alias).create(content_hash=content_hash, size=size, ref_count=row['count'])
+        Image.objects.using(db_alias).filter(content_hash=content_hash).update(blob_id=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0010_image_state_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('content_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='images', to='fstr_api.imageblob'),
+        ),
+        migrations.RunPython(link_blobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='image',
+            name='content_hash',
+        ),
+    ]
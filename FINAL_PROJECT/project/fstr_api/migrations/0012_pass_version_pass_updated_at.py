@@ -0,0 +1,25 @@
+# Generated by Django 6.0.3 on 2026-10-17 16:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0011_imageblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pass',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
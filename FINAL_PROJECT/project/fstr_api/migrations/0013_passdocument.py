@@ -0,0 +1,29 @@
+# Generated by Django 6.0.3 on 2026-10-17 19:30
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0012_pass_version_pass_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PassDocument',
+            fields=[
+                ('pass_obj', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='fstr_api.pass')),
+                ('user_email', models.EmailField(max_length=254)),
+                ('add_time', models.DateTimeField()),
+                ('version', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField()),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_email', 'add_time', 'pass_obj'], name='passdoc_email_add_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.3 on 2026-10-17 19:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fstr_api', '0013_passdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('new', 'Новая'), ('pending', 'На проверке'), ('accepted', 'Принята'), ('rejected', 'Отклонена')], max_length=20)),
+                ('to_status', models.CharField(choices=[('new', 'Новая'), ('pending', 'На проверке'), ('accepted', 'Принята'), ('rejected', 'Отклонена')], max_length=20)),
+                ('moderator', models.CharField(blank=True, default='', max_length=150)),
+                ('comment', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('pass_obj', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='moderation_log', to='fstr_api.pass')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pass_obj', 'created_at'], name='modlog_pass_created_idx')],
+            },
+        ),
+    ]
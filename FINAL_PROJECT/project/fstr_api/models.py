@@ -1,6 +1,11 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from .caching import invalidate_passes
+from .geo import GridCellField, bbox_q, box_around, covered_radius_km, distance_km
 
 
 class User(models.Model):
@@ -32,6 +37,7 @@ class Coords(models.Model):
         validators=[MinValueValidator(-180), MaxValueValidator(180)],
     )
     height = models.IntegerField()
+    cell = GridCellField(db_index=True)
 
 
 class Level(models.Model):
@@ -41,6 +47,92 @@ class Level(models.Model):
     spring = models.CharField(max_length=10, blank=True, default='')
 
 
+MODERATION_CHUNK_SIZE = 1000
+
+
+class VersionConflict(Exception):
+    """Запись изменена после того, как её прочитали для редактирования."""
+
+
+class PassQuerySet(models.QuerySet):
+    def with_related(self):
+        """Подгружает всё, что выводит PassSerializer, фиксированным числом запросов."""
+        return self.select_related('user', 'coords', 'level').prefetch_related('images')
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        return self.filter(bbox_q('coords__', min_lat, min_lon, max_lat, max_lon))
+
+    def nearest(self, latitude, longitude, k, initial_half_size=0.5):
+        """k ближайших к точке перевалов в виде пар (перевал, расстояние в км).
+
+        Квадрат поиска расширяется, пока k-й кандидат не окажется ближе
+        гарантированно просмотренного радиуса.
+        """
+        half_size = initial_half_size
+        while True:
+            rows = (self.prefetch_related(None)
+                    .in_bbox(*box_around(latitude, longitude, half_size))
+                    .values_list('id', 'coords__latitude', 'coords__longitude'))
+            ranked = sorted(
+                (distance_km(latitude, longitude, lat, lon), pk) for pk, lat, lon in rows
+            )
+            if half_size >= 180 or (len(ranked) >= k and ranked[k - 1][0] <= covered_radius_km(latitude, half_size)):
+                break
+            half_size *= 4
+
+        ranked = ranked[:k]
+        passes = self.in_bulk([pk for _, pk in ranked])
+        return [(passes[pk], distance) for distance, pk in ranked]
+
+    def moderate(self, to_status, moderator='', comment=''):
+        """Переводит перевалы набора в статус to_status по таблице Pass.STATUS_TRANSITIONS.
+
+        Перевалы, из статуса которых переход запрещён, пропускаются. Остальные
+        блокируются и переводятся пачками по MODERATION_CHUNK_SIZE: на пачку один
+        UPDATE, одна вставка в журнал ModerationLog и пересборка документов.
+        Возвращает пары (id, прежний статус) переведённых перевалов.
+        """
+        if to_status not in dict(Pass.STATUS_CHOICES):
+            raise ValueError(f'Неизвестный статус: {to_status}')
+        sources = [status for status, targets in Pass.STATUS_TRANSITIONS.items() if to_status in targets]
+
+        from .documents import refresh_documents
+        with transaction.atomic():
+            moved = list(
+                self.model.objects.filter(pk__in=self.values('pk'), status__in=sources)
+                .order_by('pk').select_for_update().values_list('pk', 'status')
+            )
+            now = timezone.now()
+            for start in range(0, len(moved), MODERATION_CHUNK_SIZE):
+                chunk = moved[start:start + MODERATION_CHUNK_SIZE]
+                pks = [pk for pk, _ in chunk]
+                self.model.objects.filter(pk__in=pks).update(
+                    status=to_status,
+                    version=models.F('version') + 1,
+                    updated_at=now,
+                )
+                ModerationLog.objects.bulk_create([
+                    ModerationLog(pass_obj_id=pk, from_status=from_status, to_status=to_status,
+                                  moderator=moderator, comment=comment, created_at=now)
+                    for pk, from_status in chunk
+                ])
+                invalidate_passes(pks)
+                refresh_documents(pks)
+        return moved
+
+    def touch(self):
+        """Отмечает изменение перевалов, записанное в обход save(): увеличивает версию и сбрасывает кэш."""
+        pks = list(self.values_list('pk', flat=True))
+        updated = self.model.objects.filter(pk__in=pks).update(
+            version=models.F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        invalidate_passes(pks)
+        from .documents import refresh_documents
+        refresh_documents(pks)
+        return updated
+
+
 class Pass(models.Model):
     STATUS_CHOICES = [
         ('new', 'Новая'),
@@ -48,6 +140,14 @@ class Pass(models.Model):
         ('accepted', 'Принята'),
         ('rejected', 'Отклонена'),
     ]
+    MODERATION_STATUSES = ['new', 'pending']
+    # статус -> статусы, в которые его может перевести модератор
+    STATUS_TRANSITIONS = {
+        'new': ['pending', 'accepted', 'rejected'],
+        'pending': ['new', 'accepted', 'rejected'],
+        'accepted': [],
+        'rejected': ['pending'],
+    }
 
     beauty_title = models.CharField(max_length=255, blank=True, null=True)
     title = models.CharField(max_length=255)
@@ -62,10 +162,125 @@ class Pass(models.Model):
         choices=STATUS_CHOICES,
         default='new',
     )
+    version = models.PositiveIntegerField(default=1) #увеличивается при каждом изменении записи
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PassQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'add_time', 'id'], name='pass_user_add_time_idx'),
+            models.Index(fields=['status', 'add_time'], name='pass_status_add_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def save_if_version(self, expected_version, **fields):
+        """Записывает поля условным UPDATE: только если версия в базе всё ещё равна expected_version.
+
+        Строка заранее не блокируется; если её успели изменить, ничего не
+        записывается и вызывается VersionConflict. Кэш и документ перевала
+        обновляет вызывающий код, когда запишет и связанные объекты.
+        """
+        updated_at = timezone.now()
+        updated = Pass.objects.filter(pk=self.pk, version=expected_version).update(
+            version=models.F('version') + 1,
+            updated_at=updated_at,
+            **fields
+        )
+        if not updated:
+            raise VersionConflict(self.pk)
+        for attr, value in fields.items():
+            setattr(self, attr, value)
+        self.version = expected_version + 1
+        self.updated_at = updated_at
+
+
+class ModerationLogQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError('Журнал модерации нельзя изменять')
+
+    def delete(self):
+        raise TypeError('Из журнала модерации нельзя удалять записи')
+
+
+class ModerationLog(models.Model):
+    """Журнал переходов статусов перевалов: записи только добавляются и сохраняются после удаления перевала."""
+    pass_obj = models.ForeignKey(Pass, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 related_name="moderation_log")
+    from_status = models.CharField(max_length=20, choices=Pass.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Pass.STATUS_CHOICES)
+    moderator = models.CharField(max_length=150, blank=True, default='')
+    comment = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = ModerationLogQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pass_obj', 'created_at'], name='modlog_pass_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError('Журнал модерации нельзя изменять')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError('Из журнала модерации нельзя удалять записи')
+
+
+class ImageBlob(models.Model):
+    """Содержимое изображения, хранящееся один раз для всех ссылающихся на него Image."""
+    content_hash = models.CharField(max_length=64, primary_key=True) #sha256 содержимого
+    size = models.PositiveIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def acquire(cls, content_hash, size):
+        """Увеличивает счётчик ссылок на содержимое, создавая запись при первой ссылке."""
+        if cls.objects.filter(pk=content_hash).update(ref_count=models.F('ref_count') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(content_hash=content_hash, size=size, ref_count=1)
+        except IntegrityError:
+            cls.objects.filter(pk=content_hash).update(ref_count=models.F('ref_count') + 1)
+
+    @classmethod
+    def release(cls, content_hash):
+        cls.objects.filter(pk=content_hash).update(ref_count=models.F('ref_count') - 1)
 
 
 class Image(models.Model):
+    STATE_CHOICES = [
+        ('pending', 'Ожидает загрузки'),
+        ('ready', 'Загружено'),
+        ('failed', 'Ошибка загрузки'),
+    ]
+
     data = models.CharField(max_length=255) #принимает url изображения
     title = models.CharField(max_length=255)
     pass_obj = models.ForeignKey(Pass, on_delete=models.CASCADE, related_name="images")
-    
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='pending')
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, null=True, blank=True, related_name="images")
+
+
+class PassDocument(models.Model):
+    """Готовый ответ PassSerializer по перевалу, собранный при записи и отдаваемый без соединений."""
+    pass_obj = models.OneToOneField(Pass, on_delete=models.CASCADE, primary_key=True, related_name="document")
+    user_email = models.EmailField()
+    add_time = models.DateTimeField()
+    version = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_email', 'add_time', 'pass_obj'], name='passdoc_email_add_time_idx'),
+        ]
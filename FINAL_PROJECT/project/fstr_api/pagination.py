@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db import models
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class PassCursorPagination:
+    """Постраничная выдача перевалов или их документов по ключу (add_time, pk).
+
+    Курсор хранит ключ последней записи страницы, поэтому следующая страница
+    выбирается условием по индексу, а не смещением, и глубокие страницы
+    стоят столько же, сколько первая.
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.next_cursor = None
+        self.fetched = []
+
+    def page_queryset(self, queryset, request):
+        """Упорядочивает queryset и отбрасывает записи до курсора; размер страницы — в self.page_size."""
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        queryset = queryset.order_by('add_time', 'pk')
+        if cursor:
+            add_time, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                models.Q(add_time__gt=add_time) | models.Q(add_time=add_time, pk__gt=pk)
+            )
+        return queryset
+
+    def paginate_queryset(self, queryset, request):
+        queryset = self.page_queryset(queryset, request)
+        # на одну запись больше страницы: по ней видно, есть ли следующая
+        self.fetched = list(queryset[:self.page_size + 1])
+        page = self.fetched[:self.page_size]
+        if len(self.fetched) > self.page_size:
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    async def apaginate_queryset(self, queryset, request):
+        queryset = self.page_queryset(queryset, request)
+        self.fetched = [obj async for obj in queryset[:self.page_size + 1]]
+        page = self.fetched[:self.page_size]
+        if len(self.fetched) > self.page_size:
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise InvalidCursor(f'Параметр {self.page_size_query_param} должен быть целым числом')
+        if page_size < 1:
+            raise InvalidCursor(f'Параметр {self.page_size_query_param} должен быть положительным')
+        return min(page_size, self.max_page_size)
+
+    @staticmethod
+    def encode_cursor(pass_obj):
+        raw = json.dumps([pass_obj.add_time.isoformat(), pass_obj.pk])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            add_time, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(add_time), int(pk)
+        except (ValueError, TypeError):
+            raise InvalidCursor('Некорректный курсор')
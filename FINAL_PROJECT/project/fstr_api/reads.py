@@ -0,0 +1,162 @@
+"""Чтение карточки и списка перевалов из документов — общее для синхронных и асинхронных представлений.
+
+Функции возвращают тройку (тело, код ответа, заголовки), которую представление
+оборачивает в свой тип ответа. Синхронная и асинхронная версии отличаются только
+обращениями к базе и кэшу; проверка ETag, страница списка и тела ошибок собираются
+одними и теми же функциями.
+"""
+from asgiref.sync import sync_to_async
+
+from .caching import (acache_detail, aget_cached_detail, cache_detail, get_cached_detail, is_conditional,
+                      list_etag, not_modified, pass_etag, validator_headers)
+from .documents import refresh_documents
+from .models import PassDocument, User
+from .pagination import InvalidCursor, PassCursorPagination
+
+
+def error(status_code, message):
+    return {'status': status_code, 'message': message}, status_code, {}
+
+
+def server_error(e):
+    body, status_code, headers = error(500, 'Ошибка при выполнении операции')
+    return {**body, 'error_details': str(e)}, status_code, headers
+
+
+def unchanged(request, etag, last_modified):
+    """Ответ 304, если у клиента актуальная версия, иначе None."""
+    if not_modified(request, etag, last_modified):
+        return None, 304, validator_headers(etag, last_modified)
+    return None
+
+
+def current_version_query(pk):
+    # проверка версии без чтения самого документа
+    return PassDocument.objects.filter(pk=pk).values('version', 'updated_at')
+
+
+def unchanged_pass(request, pk, current):
+    if current is None:
+        return None
+    return unchanged(request, pass_etag(pk, current['version']), current['updated_at'])
+
+
+def pass_not_found():
+    return {'error': 'Запись не найдена'}, 404, {}
+
+
+def cached_pass(request, entry):
+    return (unchanged(request, entry['etag'], entry['last_modified'])
+            or (entry['data'], 200, validator_headers(entry['etag'], entry['last_modified'])))
+
+
+def read_pass_detail(request, pk):
+    entry = get_cached_detail(pk)
+    if entry is None and is_conditional(request):
+        result = unchanged_pass(request, pk, current_version_query(pk).first())
+        if result:
+            return result
+
+    if entry is None:
+        document = PassDocument.objects.filter(pk=pk).first()
+        if document is None:
+            # документ ещё не собран: собираем по самому перевалу
+            documents = refresh_documents([pk])
+            if not documents:
+                return pass_not_found()
+            document = documents[0]
+        entry = cache_detail(document, document.data)
+    return cached_pass(request, entry)
+
+
+async def aread_pass_detail(request, pk):
+    entry = await aget_cached_detail(pk)
+    if entry is None and is_conditional(request):
+        result = unchanged_pass(request, pk, await current_version_query(pk).afirst())
+        if result:
+            return result
+
+    if entry is None:
+        document = await PassDocument.objects.filter(pk=pk).afirst()
+        if document is None:
+            documents = await sync_to_async(refresh_documents)([pk])
+            if not documents:
+                return pass_not_found()
+            document = documents[0]
+        entry = await acache_detail(document, document.data)
+    return cached_pass(request, entry)
+
+
+def page_versions_query(paginator, documents, request):
+    # проверка версий страницы без чтения самих документов
+    return (paginator.page_queryset(documents, request)
+            .values_list('pk', 'version', 'updated_at')[:paginator.page_size + 1])
+
+
+def unchanged_page(request, page_versions):
+    if not page_versions:
+        return None
+    return unchanged(request, list_etag((pk, version) for pk, version, _ in page_versions),
+                     max(updated_at for _, _, updated_at in page_versions))
+
+
+def user_not_found(email):
+    return error(404, f'Пользователь с email {email} не найден')
+
+
+def pass_list_page(paginator, documents):
+    headers = {}
+    if documents:
+        page_versions = [(document.pk, document.version) for document in paginator.fetched]
+        last_modified = max(document.updated_at for document in paginator.fetched)
+        headers = validator_headers(list_etag(page_versions), last_modified)
+    return {
+        'status': 200,
+        'count': len(documents),
+        'next_cursor': paginator.next_cursor,
+        'results': [document.data for document in documents]
+    }, 200, headers
+
+
+def read_pass_list(request):
+    """request — запрос DRF: параметры страницы читаются из query_params."""
+    email = request.query_params.get('user__email')
+    if not email:
+        return error(400, 'Параметр user__email обязателен')
+
+    paginator = PassCursorPagination()
+    user_documents = PassDocument.objects.filter(user_email=email)
+    try:
+        if is_conditional(request):
+            result = unchanged_page(request, list(page_versions_query(paginator, user_documents, request)))
+            if result:
+                return result
+
+        documents = paginator.paginate_queryset(user_documents, request)
+        if not documents and not User.objects.filter(email=email).exists():
+            return user_not_found(email)
+    except InvalidCursor as e:
+        return error(400, str(e))
+    return pass_list_page(paginator, documents)
+
+
+async def aread_pass_list(request):
+    email = request.query_params.get('user__email')
+    if not email:
+        return error(400, 'Параметр user__email обязателен')
+
+    paginator = PassCursorPagination()
+    user_documents = PassDocument.objects.filter(user_email=email)
+    try:
+        if is_conditional(request):
+            page_versions = [row async for row in page_versions_query(paginator, user_documents, request)]
+            result = unchanged_page(request, page_versions)
+            if result:
+                return result
+
+        documents = await paginator.apaginate_queryset(user_documents, request)
+        if not documents and not await User.objects.filter(email=email).aexists():
+            return user_not_found(email)
+    except InvalidCursor as e:
+        return error(400, str(e))
+    return pass_list_page(paginator, documents)
@@ -0,0 +1,41 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.views import APIView
+
+# настройки, которые @api_view переносит на класс представления
+POLICY_ATTRIBUTES = [
+    'renderer_classes', 'parser_classes', 'authentication_classes', 'throttle_classes',
+    'permission_classes', 'content_negotiation_class', 'metadata_class', 'versioning_class',
+]
+
+
+def dispatch_by_method(name, **views):
+    """Собирает из функций-представлений @api_view одно представление для общего пути.
+
+    Django сопоставляет путь только с первым подходящим шаблоном, поэтому
+    несколько представлений на одном пути недостижимы. Здесь каждый HTTP-метод
+    сразу попадает в обработчик своей функции за один проход DRF, а аннотации
+    extend_schema этих функций сохраняются для схемы OpenAPI. Права, ограничения
+    частоты, парсеры и прочие настройки (@permission_classes и т. п.) берутся
+    у функций; если они у функций разные, представление не собирается.
+
+        dispatch_by_method('PassListView', get=list_by_user_email, post=submit_data)
+    """
+    http_method_names = [*views, 'options']
+    if 'get' in views:
+        http_method_names.append('head')
+
+    attrs = {
+        '__module__': __name__,
+        'http_method_names': http_method_names,
+        'handlers': views,
+    }
+    for attribute in POLICY_ATTRIBUTES:
+        values = {method: getattr(view.cls, attribute) for method, view in views.items()}
+        first, *others = values.values()
+        if any(value != first for value in others):
+            details = ', '.join(f'{method.upper()}: {value}' for method, value in values.items())
+            raise ImproperlyConfigured(f"{name}: у обработчиков разные {attribute} ({details})")
+        attrs[attribute] = first
+    for method, view in views.items():
+        attrs[method] = getattr(view.cls, method)
+    return type(name, (APIView,), attrs).as_view()
@@ -1,38 +1,99 @@
 import re
 
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
+from .caching import invalidate_passes
+from .documents import refresh_documents
+from .ingestion import schedule_ingestion, variant_urls
 from .models import *
 
+PHONE_RE = re.compile(r'^\+7 \(\d{3}\) \d{3}-\d\d-\d\d$')
+MAX_MODERATION_BATCH = 10000
 
-class UserSerializer(serializers.Serializer):
+
+class UserLookup:
+    """Пользователи пачки заявок, загруженные одним запросом по email и телефону."""
+
+    def __init__(self, users=()):
+        self.by_email = {}
+        self.by_phone = {}
+        for user in users:
+            self.add(user)
+
+    @classmethod
+    def for_payloads(cls, payloads):
+        emails, phones = set(), set()
+        for item in payloads:
+            user_data = item.get('user') if isinstance(item, dict) else None
+            if not isinstance(user_data, dict):
+                continue
+            if user_data.get('email'):
+                emails.add(user_data['email'])
+            if user_data.get('phone'):
+                phones.add(user_data['phone'])
+
+        if not emails and not phones:
+            return cls()
+        return cls(User.objects.filter(models.Q(email__in=emails) | models.Q(phone__in=phones)))
+
+    def add(self, user):
+        self.by_email.setdefault(user.email, user)
+        self.by_phone.setdefault(user.phone, user)
+
+    def find(self, email, phone):
+        return self.by_email.get(email) or self.by_phone.get(phone)
+
+
+class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['email', 'fam', 'name', 'otc', 'phone']
+        # уникальность проверяется в validate: существующий пользователь допустим
+        extra_kwargs = {
+            'email': {'validators': []},
+            'phone': {'validators': []},
+        }
 
     def validate_phone(self, phone):
-        regex=r'^\+7 \(\d{3}\) \d{3}-\d\d-\d\d$'
-        if not re.match(regex, phone):
+        if not PHONE_RE.match(phone):
             raise serializers.ValidationError('Телефон должен быть в формате: +7 (xxx) xxx-xx-xx')
         return phone
     
     def validate(self, data):
-        email = data.get('email')
-        fam = data.get('fam')
-        name = data.get('name')
-        otc = data.get('otc')
-        phone = data.get('phone')
-
-        existing_user = User.objects.filter(models.Q(email=email) | models.Q(phone=phone)).first()
+        users = self.context.get('users')
+        if users is None:
+            # одиночная заявка: найденный здесь пользователь переиспользуется при сохранении
+            users = self.context['users'] = UserLookup.for_payloads([{'user': data}])
 
+        existing_user = users.find(data.get('email'), data.get('phone'))
         if existing_user:
-            if (existing_user.fam != fam or
-                existing_user.name != name or
-                (existing_user.otc or '') != (otc or '')):
-                raise serializers.ValidationError({
-                    'user': 'Пользователь с таким email или телефоном уже существует, но данные не совпадают. Изменение данных запрещено.'
-                })
+            self.check_unchanged(existing_user, data)
+        else:
+            users.add(User(**data))
         return data
+
+    def check_unchanged(self, user, data):
+        if (user.fam != data.get('fam') or
+            user.name != data.get('name') or
+            (user.otc or '') != (data.get('otc') or '')):
+            raise serializers.ValidationError({
+                'user': 'Пользователь с таким email или телефоном уже существует, но данные не совпадают. Изменение данных запрещено.'
+            })
+
+    def create(self, validated_data):
+        """Создаёт пользователя; если его уже сохранила параллельная заявка, возвращает существующего."""
+        try:
+            with transaction.atomic():
+                return User.objects.create(**validated_data)
+        except IntegrityError:
+            user = User.objects.filter(
+                models.Q(email=validated_data['email']) | models.Q(phone=validated_data['phone'])
+            ).first()
+            if user is None:
+                raise
+            self.check_unchanged(user, validated_data)
+            return user
     
 
 class CoordsSerializer(serializers.ModelSerializer):
@@ -58,11 +119,89 @@ class LevelSerializer(serializers.ModelSerializer):
 
 
 class ImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
-        fields = ['data', 'title']
+        fields = ['data', 'title', 'state', 'variants']
+        read_only_fields = ['state']
+
+    def get_variants(self, image):
+        if image.state != 'ready':
+            return None
+        return variant_urls(image.blob_id)
     
 
+class PassListSerializer(serializers.ListSerializer):
+    """Сохраняет пачку проверенных заявок фиксированным числом запросов.
+
+    Пользователя, которого между проверкой и сохранением создала параллельная
+    заявка, берём из базы; если его данные не совпадают с заявкой, она не
+    сохраняется, а её ошибка записывается в conflicts по номеру в пачке.
+    """
+
+    def create(self, validated_data):
+        users = self.context['users']
+        pass_users = [
+            users.find(item['user']['email'], item['user']['phone'])
+            for item in validated_data
+        ]
+        new_users = list({id(user): user for user in pass_users if user.pk is None}.values())
+        self.conflicts = {}
+
+        with transaction.atomic():
+            if new_users:
+                User.objects.bulk_create(new_users, ignore_conflicts=True)
+                # при ignore_conflicts первичные ключи не возвращаются
+                saved = UserLookup(User.objects.filter(
+                    models.Q(email__in=[user.email for user in new_users]) |
+                    models.Q(phone__in=[user.phone for user in new_users])
+                ))
+                pass_users = [
+                    user if user.pk else self.saved_user(saved, index, item['user'])
+                    for index, (item, user) in enumerate(zip(validated_data, pass_users))
+                ]
+            items = [
+                (item, user) for item, user in zip(validated_data, pass_users) if user is not None
+            ]
+            coords = Coords.objects.bulk_create(
+                [Coords(**item['coords']) for item, _ in items]
+            )
+            levels = Level.objects.bulk_create(
+                [Level(**item['level']) for item, _ in items]
+            )
+
+            pass_objs = []
+            for (item, user), coords_obj, level_obj in zip(items, coords, levels):
+                pass_data = {
+                    key: value for key, value in item.items()
+                    if key not in ('user', 'coords', 'level', 'images')
+                }
+                pass_objs.append(Pass(user=user, coords=coords_obj, level=level_obj, **pass_data))
+            Pass.objects.bulk_create(pass_objs)
+
+            images = Image.objects.bulk_create([
+                Image(pass_obj=pass_obj, **image_data)
+                for (item, _), pass_obj in zip(items, pass_objs)
+                for image_data in item.get('images', [])
+            ])
+            schedule_ingestion(image.pk for image in images)
+            refresh_documents(pass_obj.pk for pass_obj in pass_objs)
+
+        return pass_objs
+
+    def saved_user(self, saved, index, user_data):
+        user = saved.find(user_data['email'], user_data['phone'])
+        try:
+            if user is None:
+                raise serializers.ValidationError({'user': 'Не удалось сохранить пользователя, повторите заявку.'})
+            self.child.fields['user'].check_unchanged(user, user_data)
+        except serializers.ValidationError as e:
+            self.conflicts[index] = {'user': e.detail}
+            return None
+        return user
+
+
 class PassSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     coords = CoordsSerializer()
@@ -71,17 +210,22 @@ class PassSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Pass
+        list_serializer_class = PassListSerializer
         fields = ['id', 'beauty_title', 'title', 'other_titles', 'connect', 'add_time', 'user', 'coords', 'level', 'images', 'status']
+        # статус меняется только модерацией (PassQuerySet.moderate), с записью в журнал
+        read_only_fields = ['status']
 
+    @transaction.atomic
     def create(self, validated_data):
         user_data = validated_data.pop('user')
         coords_data = validated_data.pop('coords')
         level_data = validated_data.pop('level')
         images_data = validated_data.pop('images', [])
 
-        user_serializer = UserSerializer(data=user_data)
-        user_serializer.is_valid(raise_exception=True)
-        user = user_serializer.save()
+        users = self.context.get('users')
+        user = users.find(user_data['email'], user_data['phone']) if users is not None else None
+        if user is None or user.pk is None:
+            user = self.fields['user'].create(user_data)
 
         coords = Coords.objects.create(**coords_data)
 
@@ -94,16 +238,22 @@ class PassSerializer(serializers.ModelSerializer):
             **validated_data
         )
 
-        for image_data in images_data:
-            Image.objects.create(pass_obj=pass_obj, **image_data)
+        images = Image.objects.bulk_create(
+            [Image(pass_obj=pass_obj, **image_data) for image_data in images_data]
+        )
+        schedule_ingestion(image.pk for image in images)
 
         return pass_obj
     
+    @transaction.atomic
     def update(self, instance, validated_data):
         coords_data = validated_data.pop('coords', None)
         level_data = validated_data.pop('level', None)
         images_data = validated_data.pop('images', None)
 
+        # перевал записывается первым: при конфликте версий связанные объекты не трогаются
+        instance.save_if_version(self.context.get('version', instance.version), **validated_data)
+
         if coords_data:
             for attr, value in coords_data.items():
                 setattr(instance.coords, attr, value)
@@ -114,13 +264,47 @@ class PassSerializer(serializers.ModelSerializer):
                 setattr(instance.level, attr, value)
             instance.level.save()
 
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-
         if images_data is not None:
-            instance.images.all().delete()
-            for image_data in images_data:
-                Image.objects.create(pass_obj=instance, **image_data)
+            self.update_images(instance, images_data)
+
+        invalidate_passes([instance.pk])
+        refresh_documents([instance.pk])
+
+        return instance
+
+    def update_images(self, instance, images_data):
+        """Приводит изображения перевала к присланному списку, трогая только изменившиеся строки.
+
+        Изображения сопоставляются по ссылке: совпавшие сохраняются (при смене
+        подписи обновляется только она), новые добавляются, лишние удаляются.
+        """
+        existing = {}
+        for image in instance.images.all():
+            existing.setdefault(image.data, []).append(image)
+
+        changed, new_images = [], []
+        for image_data in images_data:
+            matches = existing.get(image_data['data'])
+            if matches:
+                image = matches.pop(0)
+                if image.title != image_data['title']:
+                    image.title = image_data['title']
+                    changed.append(image)
+            else:
+                new_images.append(Image(pass_obj=instance, **image_data))
+
+        stale = [image.pk for images in existing.values() for image in images]
+        if stale:
+            Image.objects.filter(pk__in=stale).delete()
+        if changed:
+            Image.objects.bulk_update(changed, ['title'])
+        if new_images:
+            Image.objects.bulk_create(new_images)
+            schedule_ingestion(image.pk for image in new_images)
+
 
-        return instance
\ No newline at end of file
+class ModerationSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                max_length=MAX_MODERATION_BATCH)
+    status = serializers.ChoiceField(choices=Pass.STATUS_CHOICES)
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
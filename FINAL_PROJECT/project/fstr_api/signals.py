@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import invalidate_passes
+from .documents import refresh_documents
+from .ingestion import release_blob
+from .models import Image, Pass
+
+
+@receiver(post_save, sender=Pass)
+@receiver(post_delete, sender=Pass)
+def invalidate_pass_cache(sender, instance, **kwargs):
+    invalidate_passes([instance.pk])
+
+
+@receiver(post_save, sender=Pass)
+def refresh_pass_document(sender, instance, created, **kwargs):
+    if created:
+        # новому перевалу документ собирается после фиксации транзакции, когда записаны и изображения
+        pk = instance.pk
+        transaction.on_commit(lambda: refresh_documents([pk]))
+    else:
+        refresh_documents([instance.pk])
+
+
+@receiver(post_delete, sender=Image)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id)
@@ -0,0 +1,112 @@
+import random
+
+from django.db.models import Max
+
+from .documents import rebuild_documents
+from .models import *
+
+STATUS_WEIGHTS = {
+    'new': 1,
+    'pending': 1,
+    'accepted': 90,
+    'rejected': 8,
+}
+
+
+def make_phone(number):
+    return (f'+7 ({number // 10**7 % 1000:03d}) {number // 10**4 % 1000:03d}-'
+            f'{number // 100 % 100:02d}-{number % 100:02d}')
+
+
+def generate_users(count, batch_size=5000, start=0):
+    users = [
+        User(
+            email=f'user{i}@example.com',
+            fam=f'Фамилия{i}',
+            name=f'Имя{i}',
+            otc=f'Отчество{i}',
+            phone=make_phone(i),
+        )
+        for i in range(start, start + count)
+    ]
+    return User.objects.bulk_create(users, batch_size=batch_size)
+
+
+def generate_passes(users, count, images_per_pass=0, status_weights=STATUS_WEIGHTS,
+                    batch_size=5000, seed=0, progress=None):
+    """Заполняет базу синтетическими перевалами пачками по batch_size.
+
+    Перевалы распределяются по пользователям случайно, статусы — по весам
+    status_weights. progress вызывается с числом уже созданных записей.
+    """
+    rng = random.Random(seed)
+    statuses = list(status_weights)
+    weights = list(status_weights.values())
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        coords = Coords.objects.bulk_create([
+            Coords(
+                latitude=round(rng.uniform(-90, 90), 4),
+                longitude=round(rng.uniform(-180, 180), 4),
+                height=rng.randint(0, 8848),
+            )
+            for _ in range(size)
+        ])
+        levels = Level.objects.bulk_create([Level(summer='1А') for _ in range(size)])
+        passes = Pass.objects.bulk_create([
+            Pass(
+                title=f'Перевал {created + i}',
+                user=rng.choice(users),
+                coords=coords_obj,
+                level=level_obj,
+                status=rng.choices(statuses, weights)[0],
+            )
+            for i, (coords_obj, level_obj) in enumerate(zip(coords, levels))
+        ])
+        if images_per_pass:
+            Image.objects.bulk_create([
+                Image(pass_obj=pass_obj, data=f'https://example.com/{pass_obj.pk}/{i}.jpg', title=f'Фото {i}')
+                for pass_obj in passes
+                for i in range(images_per_pass)
+            ])
+        created += size
+        if progress:
+            progress(created)
+
+
+def generate_dataset(users, passes, images_per_pass=2, heavy_users=10, heavy_share=0.05,
+                     batch_size=5000, start=0, seed=0, progress=None):
+    """Набор для нагрузочных проверок: пользователи, перевалы с координатами, уровнями,
+    изображениями и собранными документами.
+
+    Пользователи создаются пачками по batch_size, и каждая пачка сразу получает
+    свою долю перевалов, поэтому миллионы записей не держатся в памяти. Первые
+    heavy_users пользователей получают долю heavy_share всех перевалов.
+    progress вызывается с описанием этапа и числом готовых записей.
+    Возвращает email тяжёлых пользователей.
+    """
+    last_pk = Pass.objects.aggregate(last=Max('pk'))['last'] or 0
+    report = progress or (lambda stage, done: None)
+
+    heavy = generate_users(heavy_users, start=start)
+    heavy_passes = int(passes * heavy_share) if heavy else 0
+    if heavy_passes:
+        generate_passes(heavy, heavy_passes, images_per_pass, batch_size=batch_size, seed=seed)
+
+    regular_users = users - len(heavy)
+    regular_passes = passes - heavy_passes
+    done_users = done_passes = 0
+    while done_users < regular_users:
+        size = min(batch_size, regular_users - done_users)
+        chunk = generate_users(size, batch_size=batch_size, start=start + len(heavy) + done_users)
+        done_users += size
+        count = regular_passes * done_users // regular_users - done_passes
+        if count:
+            generate_passes(chunk, count, images_per_pass, batch_size=batch_size, seed=seed + done_users)
+        done_passes += count
+        report('пользователи и перевалы', done_users)
+
+    rebuild_documents(last_pk, progress=lambda done, _: report('документы', done))
+    return [user.email for user in heavy]
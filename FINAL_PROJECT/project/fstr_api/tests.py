@@ -1,3 +1,1296 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import socket
+import tempfile
+import threading
+from concurrent.futures import wait
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth.models import User as AuthUser
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework.decorators import api_view, parser_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from .ingestion import (HttpImageFetcher, ImageIngestionPipeline, LocalImageFetcher, UnsafeURL, blob_path,
+                        schedule_ingestion, store_content)
+from .models import *
+from .geo import cell_for, covered_radius_km
+from .serializers import PassListSerializer, PassSerializer, UserLookup, UserSerializer
+from .synthetic import generate_dataset
+from .validation import pass_validator
+from .caching import get_cache
+from .documents import refresh_documents
+from .export import stream_export
+from .instrumentation import metrics
+from .routing import dispatch_by_method
+from .views import (list_by_user_email, moderation_queue, nearest_passes, pass_detail, passes_in_bbox,
+                    submit_data, submit_data_bulk, update_pass)
+
+
+def create_user(**kwargs):
+    return User.objects.create(**{
+        'email': 'climber@example.com', 'fam': 'Иванов', 'name': 'Иван', 'otc': 'Иванович',
+        'phone': '+7 (900) 123-45-67', **kwargs,
+    })
+
+
+def create_pass(user, title='Перевал', images=2, latitude='45.3842', longitude='7.1525', **kwargs):
+    pass_obj = Pass.objects.create(
+        user=user,
+        coords=Coords.objects.create(latitude=latitude, longitude=longitude, height=1200),
+        level=Level.objects.create(summer='1А'),
+        title=title,
+        **kwargs
+    )
+    Image.objects.bulk_create([
+        Image(pass_obj=pass_obj, data=f'https://example.com/{pass_obj.pk}/{i}.jpg', title=f'Фото {i}')
+        for i in range(images)
+    ])
+    refresh_documents([pass_obj.pk])
+    return pass_obj
+
+
+class ListByUserEmailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.factory = APIRequestFactory()
+
+    def get(self, email, headers=None, **params):
+        request = self.factory.get('/api/submitData/', {'user__email': email, **params}, **(headers or {}))
+        return list_by_user_email(request)
+
+    def test_query_count_does_not_depend_on_pass_count(self):
+        for i in range(3):
+            create_pass(self.user, title=f'Перевал {i}')
+        with self.assertNumQueries(1):
+            response = self.get(self.user.email)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+
+        for i in range(3, 30):
+            create_pass(self.user, title=f'Перевал {i}')
+        with self.assertNumQueries(1):
+            response = self.get(self.user.email)
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(len(response.data['results'][0]['images']), 2)
+        self.assertEqual(response.data['results'][0]['user']['email'], self.user.email)
+
+    def test_conditional_get_of_unchanged_page(self):
+        pass_obj = create_pass(self.user)
+        create_pass(self.user)
+        response = self.get(self.user.email)
+
+        with self.assertNumQueries(1):
+            not_modified = self.get(self.user.email, headers={'HTTP_IF_NONE_MATCH': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+        pass_obj.title = 'Новое название'
+        pass_obj.save()
+        changed = self.get(self.user.email, headers={'HTTP_IF_NONE_MATCH': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_unknown_email(self):
+        response = self.get('nobody@example.com')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_pages_cover_full_history_in_order(self):
+        created = [create_pass(self.user, title=f'Перевал {i}', images=0).id for i in range(7)]
+
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 3}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.get(self.user.email, **params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(response.data['count'], 3)
+            seen.extend(item['id'] for item in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(seen, created)
+
+    def test_invalid_cursor(self):
+        response = self.get(self.user.email, cursor='not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+
+class ModerationQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = create_user()
+        cls.new = create_pass(user, status='new', images=0)
+        cls.pending = create_pass(user, status='pending', images=0)
+        cls.accepted = create_pass(user, status='accepted', images=0)
+        cls.moderator = AuthUser.objects.create_superuser('moderator', 'moderator@example.com', 'password')
+        cls.factory = APIRequestFactory()
+
+    def get(self, user=None, **params):
+        request = self.factory.get('/api/submitData/moderation/', params)
+        force_authenticate(request, user=user or self.moderator)
+        return moderation_queue(request)
+
+    def test_default_queue_contains_new_and_pending(self):
+        response = self.get()
+        self.assertEqual([item['id'] for item in response.data['results']], [self.new.id, self.pending.id])
+
+    def test_filter_by_status_and_date(self):
+        response = self.get(status='accepted', date_from=self.accepted.add_time.date().isoformat())
+        self.assertEqual([item['id'] for item in response.data['results']], [self.accepted.id])
+
+        response = self.get(date_to='2000-01-01')
+        self.assertEqual(response.data['results'], [])
+
+    def test_unknown_status(self):
+        self.assertEqual(self.get(status='archived').status_code, 400)
+
+    def test_queue_is_only_for_staff(self):
+        self.assertEqual(moderation_queue(self.factory.get('/api/submitData/moderation/')).status_code, 403)
+        self.assertEqual(self.get(user=AuthUser.objects.create_user('climber')).status_code, 403)
+
+
+class ModerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.moderator = AuthUser.objects.create_superuser('moderator', 'moderator@example.com', 'password')
+
+    def setUp(self):
+        get_cache().clear()
+        self.new = create_pass(self.user, status='new', images=0)
+        self.pending = create_pass(self.user, status='pending', images=0)
+        self.accepted = create_pass(self.user, status='accepted', images=0)
+        self.url = reverse('moderate_passes')
+
+    def post(self, data):
+        return self.client.post(self.url, data, content_type='application/json')
+
+    def test_batch_follows_transition_table(self):
+        self.client.force_login(self.moderator)
+        missing = self.accepted.pk + 1000
+        ids = [self.new.pk, self.pending.pk, self.accepted.pk, missing]
+        response = self.post({'ids': ids, 'status': 'accepted', 'comment': 'Проверено'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['updated'], [self.new.pk, self.pending.pk])
+        self.assertEqual(response.json()['skipped'], [{'id': self.accepted.pk, 'status': 'accepted'}])
+        self.assertEqual(response.json()['not_found'], [missing])
+
+        for pass_obj in (self.new, self.pending):
+            current = Pass.objects.get(pk=pass_obj.pk)
+            self.assertEqual(current.status, 'accepted')
+            self.assertEqual(current.version, pass_obj.version + 1)
+            self.assertEqual(current.document.data['status'], 'accepted')
+        self.assertEqual(self.client.get(reverse('pass_detail', args=[self.new.pk])).json()['status'], 'accepted')
+
+        self.assertEqual(
+            list(ModerationLog.objects.order_by('pass_obj').values_list(
+                'pass_obj', 'from_status', 'to_status', 'moderator', 'comment')),
+            [(self.new.pk, 'new', 'accepted', 'moderator', 'Проверено'),
+             (self.pending.pk, 'pending', 'accepted', 'moderator', 'Проверено')],
+        )
+
+    def test_query_count_does_not_grow_with_batch(self):
+        more = [create_pass(self.user, title=f'Перевал {i}', images=0).pk for i in range(20)]
+        with CaptureQueriesContext(connection) as small:
+            Pass.objects.filter(pk=self.new.pk).moderate('pending')
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(len(Pass.objects.filter(pk__in=more).moderate('pending')), len(more))
+        self.assertEqual(len(large), len(small))
+
+    def test_requires_staff(self):
+        response = self.post({'ids': [self.new.pk], 'status': 'accepted'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Pass.objects.get(pk=self.new.pk).status, 'new')
+
+    def test_invalid_request(self):
+        self.client.force_login(self.moderator)
+        for data in [{'ids': [self.new.pk], 'status': 'archived'}, {'ids': [], 'status': 'accepted'}]:
+            with self.subTest(data=data):
+                self.assertEqual(self.post(data).status_code, 400)
+
+    def test_status_is_not_writable_through_the_api(self):
+        payload = {
+            'title': 'Перевал',
+            'user': {'email': self.user.email, 'fam': 'Иванов', 'name': 'Иван', 'otc': 'Иванович',
+                     'phone': self.user.phone},
+            'coords': {'latitude': '45.1', 'longitude': '7.2', 'height': 1200},
+            'level': {'summer': '1А'},
+            'status': 'accepted',
+        }
+        response = self.client.post(reverse('pass_list'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Pass.objects.get(pk=response.json()['id']).status, 'new')
+
+        response = self.client.post(reverse('submit_data_bulk'), [payload], content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Pass.objects.get(pk=response.json()['results'][0]['id']).status, 'new')
+
+        response = self.client.patch(reverse('pass_detail', args=[self.new.pk]), {'status': 'accepted'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Pass.objects.get(pk=self.new.pk).status, 'new')
+        self.assertFalse(ModerationLog.objects.exists())
+
+    def test_log_is_append_only(self):
+        Pass.objects.filter(pk=self.new.pk).moderate('rejected')
+        entry = ModerationLog.objects.get()
+        with self.assertRaises(TypeError):
+            entry.save()
+        with self.assertRaises(TypeError):
+            entry.delete()
+        with self.assertRaises(TypeError):
+            ModerationLog.objects.update(comment='')
+        with self.assertRaises(TypeError):
+            ModerationLog.objects.all().delete()
+
+    def test_admin_action(self):
+        self.client.force_login(self.moderator)
+        response = self.client.post(reverse('admin:fstr_api_pass_changelist'), {
+            'action': 'moderate_rejected',
+            '_selected_action': [self.new.pk, self.accepted.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Pass.objects.get(pk=self.new.pk).status, 'rejected')
+        self.assertEqual(Pass.objects.get(pk=self.accepted.pk).status, 'accepted')
+        self.assertEqual(ModerationLog.objects.get().moderator, 'moderator')
+
+
+class SpatialSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = create_user()
+        cls.elbrus = create_pass(user, latitude='43.3499', longitude='42.4453', images=0)
+        cls.kazbek = create_pass(user, latitude='42.6996', longitude='44.5186', images=0)
+        cls.alps = create_pass(user, latitude='45.8326', longitude='6.8652', images=0)
+        cls.kamchatka = create_pass(user, latitude='56.0560', longitude='160.6420', images=0)
+        cls.chukotka = create_pass(user, latitude='65.0000', longitude='-179.9000', images=0)
+        cls.factory = APIRequestFactory()
+
+    def ids(self, view, **params):
+        response = view(self.factory.get('/', params))
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_cell_is_stored_on_save(self):
+        self.assertEqual(self.elbrus.coords.cell, cell_for(43.3499, 42.4453))
+
+    def test_bbox(self):
+        ids = self.ids(passes_in_bbox, min_lat=40, min_lon=40, max_lat=45, max_lon=45)
+        self.assertEqual(ids, [self.elbrus.id, self.kazbek.id])
+
+    def test_bbox_across_antimeridian(self):
+        ids = self.ids(passes_in_bbox, min_lat=50, min_lon=150, max_lat=70, max_lon=-170)
+        self.assertEqual(ids, [self.kamchatka.id, self.chukotka.id])
+
+    def test_nearest(self):
+        response = nearest_passes(self.factory.get('/', {'lat': 43.0, 'lon': 43.0, 'k': 3}))
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids, [self.elbrus.id, self.kazbek.id, self.alps.id])
+        distances = [item['distance_km'] for item in response.data['results']]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_nearest_near_pole(self):
+        user = self.elbrus.user
+        svalbard = create_pass(user, latitude='89.6000', longitude='-170.0000', images=0)
+        greenland = create_pass(user, latitude='88.0000', longitude='20.0000', images=0)
+        self.assertGreater(covered_radius_km(89.5, 0.5), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = nearest_passes(self.factory.get('/', {'lat': 89.5, 'lon': 10.0, 'k': 2}))
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids, [svalbard.id, greenland.id])
+        # хватает квадрата в 2° (около 220 км), а не всего земного шара
+        self.assertLessEqual(len(queries), 4)
+
+    def test_invalid_coordinates(self):
+        response = nearest_passes(self.factory.get('/', {'lat': 100, 'lon': 0}))
+        self.assertEqual(response.status_code, 400)
+
+
+def make_jpeg(size=(2000, 1500), color='red'):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class ImageIngestionTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = create_user()
+        self.pass_obj = create_pass(user, images=0)
+        self.fetcher = LocalImageFetcher({
+            'https://example.com/a.jpg': make_jpeg(),
+            'https://example.com/copy-of-a.jpg': make_jpeg(),
+        })
+        self.pipeline = ImageIngestionPipeline(self.fetcher, fetch_workers=4, render_workers=0)
+        self.addCleanup(self.pipeline.shutdown)
+
+    def add_image(self, url):
+        return Image.objects.create(pass_obj=self.pass_obj, data=url, title='Фото')
+
+    def test_images_are_stored_by_content_with_variants(self):
+        first = self.add_image('https://example.com/a.jpg')
+        second = self.add_image('https://example.com/copy-of-a.jpg')
+        wait(self.pipeline.submit([first.pk, second.pk]))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.state, second.state), ('ready', 'ready'))
+        self.assertEqual(first.blob_id, second.blob_id)
+        with default_storage.open(blob_path(first.blob_id, 'thumbnail.jpg')) as thumbnail:
+            self.assertEqual(max(PILImage.open(thumbnail).size), 256)
+
+    def test_parallel_workers(self):
+        colors = ['red', 'green', 'blue', 'white', 'black', 'yellow', 'purple', 'orange']
+        self.fetcher.files.update({f'https://example.com/{color}.jpg': make_jpeg((64, 64), color) for color in colors})
+        images = [self.add_image(f'https://example.com/{color}.jpg') for color in colors]
+        wait(self.pipeline.submit([image.pk for image in images]))
+        self.assertEqual(set(Image.objects.values_list('state', flat=True)), {'ready'})
+        self.assertEqual(ImageBlob.objects.count(), len(colors))
+
+    def test_identical_content_is_stored_once_and_freed_with_last_reference(self):
+        images = [self.add_image(url) for url in ('https://example.com/a.jpg', 'https://example.com/copy-of-a.jpg')]
+        wait(self.pipeline.submit([image.pk for image in images]))
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        original = blob_path(blob.pk, 'original')
+
+        Image.objects.get(pk=images[0].pk).delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(original))
+
+        self.pass_obj.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(original))
+
+    def test_known_url_is_not_downloaded_again(self):
+        first = self.add_image('https://example.com/a.jpg')
+        wait(self.pipeline.submit([first.pk]))
+        second = self.add_image('https://example.com/a.jpg')
+        with mock.patch.object(self.fetcher, 'fetch') as fetch:
+            wait(self.pipeline.submit([second.pk]))
+        fetch.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.blob_id, first.blob_id)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    @override_settings(FSTR_IMAGE_REUSE_KNOWN_URLS=False)
+    def test_known_url_reuse_can_be_disabled(self):
+        first = self.add_image('https://example.com/a.jpg')
+        wait(self.pipeline.submit([first.pk]))
+        self.fetcher.files['https://example.com/a.jpg'] = make_jpeg((64, 64), 'green')
+        second = self.add_image('https://example.com/a.jpg')
+        wait(self.pipeline.submit([second.pk]))
+        second.refresh_from_db()
+        self.assertEqual(second.state, 'ready')
+        self.assertEqual(ImageBlob.objects.count(), 2)
+
+    def test_file_written_concurrently_is_not_duplicated(self):
+        content = make_jpeg()
+        content_hash = store_content(content, lambda content: {})
+        folder = blob_path(content_hash, '')
+        exists = default_storage.exists
+        checked = []
+
+        def written_after_check(name):
+            # параллельный обработчик записал файл между нашей проверкой и записью
+            if name not in checked:
+                checked.append(name)
+                return False
+            return exists(name)
+
+        with mock.patch.object(default_storage, 'exists', written_after_check):
+            store_content(content, lambda content: {})
+        self.assertEqual(default_storage.listdir(folder), ([], ['original']))
+
+    def test_files_of_image_deleted_during_download_are_freed(self):
+        image = self.add_image('https://example.com/a.jpg')
+        fetch = self.fetcher.fetch
+
+        def deleted_meanwhile(url):
+            Image.objects.filter(pk=image.pk).delete()
+            return fetch(url)
+
+        with mock.patch.object(self.fetcher, 'fetch', deleted_meanwhile):
+            wait(self.pipeline.submit([image.pk]))
+        self.assertFalse(ImageBlob.objects.exists())
+        content_hash = hashlib.sha256(self.fetcher.files['https://example.com/a.jpg']).hexdigest()
+        self.assertEqual(default_storage.listdir(blob_path(content_hash, '')), ([], []))
+
+    def test_unreachable_image_is_marked_failed(self):
+        image = self.add_image('https://example.com/missing.jpg')
+        with self.assertLogs('fstr_api.ingestion', 'WARNING'):
+            wait(self.pipeline.submit([image.pk]))
+        image.refresh_from_db()
+        self.assertEqual(image.state, 'failed')
+
+    def test_ingestion_starts_only_after_commit(self):
+        image = self.add_image('https://example.com/a.jpg')
+        with mock.patch('fstr_api.ingestion.pipeline') as pipeline:
+            with transaction.atomic():
+                schedule_ingestion([image.pk])
+                pipeline.submit.assert_not_called()
+            pipeline.submit.assert_called_once_with([image.pk])
+
+
+def fake_response(status=200, headers=None, body=b''):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def fake_dns(addresses):
+    """Подменяет DNS: имя хоста -> адрес."""
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (addresses.get(host, host), 80))]
+    return mock.patch('fstr_api.ingestion.socket.getaddrinfo', getaddrinfo)
+
+
+class HttpImageFetcherTests(SimpleTestCase):
+    def setUp(self):
+        self.fetcher = HttpImageFetcher()
+
+    def test_only_public_http_urls_are_fetched(self):
+        urls = [
+            'file:///etc/passwd', 'ftp://example.com/a.jpg', 'gopher://example.com/', 'http:///a.jpg',
+            'http://127.0.0.1/a.jpg', 'http://10.0.0.5/a.jpg', 'http://192.168.1.1/a.jpg',
+            'http://169.254.169.254/latest/meta-data/', 'http://0.0.0.0/', 'http://[::1]/a.jpg',
+            'http://[::ffff:127.0.0.1]/a.jpg', 'http://[fd00::1]/a.jpg', 'http://internal.example.com/a.jpg',
+        ]
+        with fake_dns({'internal.example.com': '10.1.2.3'}), mock.patch('fstr_api.ingestion.requests.Session.get') as get:
+            for url in urls:
+                with self.subTest(url=url), self.assertRaises(UnsafeURL):
+                    self.fetcher.fetch(url)
+        get.assert_not_called()
+
+    def test_redirect_to_private_address_is_rejected(self):
+        redirect = fake_response(302, {'Location': 'http://internal.example.com/secret'})
+        with fake_dns({'example.com': '93.184.216.34', 'internal.example.com': '10.1.2.3'}), \
+                mock.patch('fstr_api.ingestion.requests.Session.get', return_value=redirect) as get:
+            with self.assertRaises(UnsafeURL):
+                self.fetcher.fetch('https://example.com/a.jpg')
+        self.assertEqual(get.call_count, 1)
+        self.assertFalse(get.call_args.kwargs['allow_redirects'])
+
+    def test_redirects_are_followed_to_public_addresses(self):
+        responses = [fake_response(301, {'Location': '/b.jpg'}), fake_response(body=b'jpeg')]
+        with fake_dns({'example.com': '93.184.216.34'}), \
+                mock.patch('fstr_api.ingestion.requests.Session.get', side_effect=responses) as get:
+            self.assertEqual(self.fetcher.fetch('https://example.com/a.jpg'), b'jpeg')
+        self.assertEqual(get.call_args.args[0], 'https://example.com/b.jpg')
+
+    def test_response_size_is_capped(self):
+        self.fetcher.max_size = 10
+        cases = [
+            fake_response(headers={'Content-Length': str(10**9)}),
+            fake_response(body=b'x' * 11),
+        ]
+        with fake_dns({'example.com': '93.184.216.34'}):
+            for response in cases:
+                with self.subTest(headers=dict(response.headers)), \
+                        mock.patch('fstr_api.ingestion.requests.Session.get', return_value=response), \
+                        self.assertRaises(ValueError):
+                    self.fetcher.fetch('https://example.com/a.jpg')
+
+    def test_connected_address_is_checked(self):
+        # имя разрешилось в публичный адрес, а соединение установлено с локальным (подмена DNS)
+        server = HTTPServer(('127.0.0.1', 0), QuietImageHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_port}/a.jpg'
+
+        with mock.patch.object(HttpImageFetcher, 'check_url'):
+            with self.assertRaises(UnsafeURL):
+                self.fetcher.fetch(url)
+            self.assertEqual(QuietImageHandler.requests, 0)
+
+            with mock.patch('fstr_api.ingestion.check_public_address'):
+                self.assertEqual(self.fetcher.fetch(url), b'jpeg')
+
+
+class QuietImageHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        QuietImageHandler.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Length', '4')
+        self.end_headers()
+        self.wfile.write(b'jpeg')
+
+    def log_message(self, *args):
+        pass
+
+
+class SubmitDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.factory = APIRequestFactory()
+
+    def payload(self, **user):
+        return {
+            'title': 'Перевал',
+            'user': {'email': self.user.email, 'fam': 'Иванов', 'name': 'Иван', 'otc': 'Иванович',
+                     'phone': self.user.phone, **user},
+            'coords': {'latitude': '45.1', 'longitude': '7.2', 'height': 1200},
+            'level': {'summer': '1А'},
+        }
+
+    def post(self, data):
+        return submit_data(self.factory.post('/api/submitData/', data, format='json'))
+
+    def test_existing_user_is_found_once_and_reused(self):
+        # поиск пользователя, точка сохранения, координаты, уровень, перевал,
+        # сборка документа (перевал, изображения, запись), освобождение точки
+        with self.assertNumQueries(9), self.captureOnCommitCallbacks(execute=True):
+            response = self.post(self.payload())
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Pass.objects.get(pk=response.data['id']).user_id, self.user.pk)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_new_user_is_created(self):
+        response = self.post(self.payload(email='new@example.com', phone='+7 (900) 765-43-21'))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Pass.objects.get(pk=response.data['id']).user.email, 'new@example.com')
+
+    def test_changed_user_data_is_rejected(self):
+        response = self.post(self.payload(fam='Петров'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('user', response.data['errors']['user'])
+
+    def post_bulk(self, items):
+        return submit_data_bulk(self.factory.post('/api/submitData/bulk/', items, format='json'))
+
+    def new_user(self, number, **user):
+        return self.payload(email=f'new{number}@example.com', phone=f'+7 (900) 000-00-{number:02}', **user)
+
+    def test_bulk_query_count_does_not_depend_on_size(self):
+        # поиск пользователей, точка сохранения, новые пользователи и их повторная выборка,
+        # координаты, уровни, перевалы, сборка документов (перевалы, изображения, запись), освобождение точки
+        for size in (2, 20):
+            with self.subTest(size=size), self.assertNumQueries(11):
+                response = self.post_bulk([self.payload()] + [self.new_user(size + i) for i in range(size - 1)])
+            self.assertEqual(response.status_code, 201, response.data)
+
+    def test_bulk_results_are_reported_per_item(self):
+        response = self.post_bulk([self.new_user(1), self.payload(fam='Петров'), self.payload(), self.new_user(1)])
+        self.assertEqual(response.status_code, 207)
+        results = response.data['results']
+        self.assertEqual([set(result) for result in results], [{'id'}, {'errors'}, {'id'}, {'id'}])
+        self.assertIn('user', results[1]['errors']['user'])
+        passes = Pass.objects.in_bulk([results[0]['id'], results[2]['id'], results[3]['id']])
+        self.assertEqual(passes[results[0]['id']].user_id, passes[results[3]['id']].user_id)
+        self.assertEqual(passes[results[2]['id']].user_id, self.user.pk)
+
+    def test_bulk_user_created_concurrently(self):
+        create = PassListSerializer.create
+
+        def concurrent_submissions(serializer, validated_data):
+            create_user(email='new1@example.com', phone='+7 (900) 000-00-01')
+            create_user(email='new2@example.com', fam='Павлов', name='Павел', otc='', phone='+7 (900) 000-00-02')
+            return create(serializer, validated_data)
+
+        with mock.patch.object(PassListSerializer, 'create', concurrent_submissions):
+            response = self.post_bulk([self.new_user(1), self.new_user(2), self.payload(), self.new_user(2)])
+        self.assertEqual(response.status_code, 207)
+        results = response.data['results']
+        self.assertEqual([set(result) for result in results], [{'id'}, {'errors'}, {'id'}, {'errors'}])
+        self.assertIn('user', results[1]['errors']['user'])
+        self.assertEqual(Pass.objects.get(pk=results[0]['id']).user.email, 'new1@example.com')
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_user_saved_by_concurrent_submission_is_reused(self):
+        data = self.payload()['user']
+        self.assertEqual(UserSerializer().create(data).pk, self.user.pk)
+
+        with self.assertRaises(ValidationError):
+            UserSerializer().create({**data, 'name': 'Пётр'})
+
+
+class PassValidatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+
+    def payload(self, path=(), value=None):
+        data = {
+            'title': ' Перевал ',
+            'other_titles': None,
+            'connect': '',
+            'user': {'email': self.user.email, 'fam': 'Иванов', 'name': 'Иван', 'otc': 'Иванович',
+                     'phone': self.user.phone},
+            'coords': {'latitude': '45.3842', 'longitude': 7.15, 'height': 1200},
+            'level': {'summer': '1А', 'winter': ''},
+            'images': [{'data': 'https://example.com/1.jpg', 'title': 'Фото'}],
+            'status': 'pending',
+        }
+        if path:
+            target = data
+            for key in path[:-1]:
+                target = target[key]
+            if value is None:
+                del target[path[-1]]
+            else:
+                target[path[-1]] = value
+        return data
+
+    def assertSameAsSerializer(self, data):
+        serializer = PassSerializer(data=data, context={'users': UserLookup.for_payloads([data])})
+        serializer.is_valid()
+        validated_data, errors = pass_validator.validate(data, {'users': UserLookup.for_payloads([data])})
+        self.assertEqual(errors, serializer.errors)
+        self.assertEqual(
+            [(error, error.code) for error in flatten(errors)],
+            [(error, error.code) for error in flatten(serializer.errors)],
+        )
+        if not errors:
+            self.assertEqual(validated_data, serializer.validated_data)
+        return errors
+
+    def test_valid_payloads(self):
+        for data in [self.payload(), self.payload(('images',)), self.payload(('title',), 12),
+                     self.payload(('user', 'email'), 'new@example.com')]:
+            with self.subTest(data=data):
+                self.assertEqual(self.assertSameAsSerializer(data), {})
+
+    def test_errors_match_serializer(self):
+        cases = [
+            (('title',), None), (('title',), ''), (('title',), 'П' * 300), (('title',), True),
+            (('user',), 'climber'), (('user', 'phone'), '89001234567'), (('user', 'email'), 'climber'),
+            (('user', 'fam'), 'Петров'), (('coords', 'latitude'), '91'), (('coords', 'latitude'), '45.12345'),
+            (('coords', 'latitude'), 'NaN'), (('coords', 'height'), 'высоко'), (('images',), 'https://example.com/1.jpg'),
+            (('images',), [{'data': 'https://example.com/1.jpg'}, 5]),
+            (('level', 'summer'), 'Очень сложно'),
+        ]
+        for path, value in cases:
+            with self.subTest(path=path, value=value):
+                self.assertNotEqual(self.assertSameAsSerializer(self.payload(path, value)), {})
+
+    def test_mixed_batch(self):
+        items = [self.payload(), self.payload(('coords', 'latitude'), '91'), [], self.payload(('title',), None)]
+        results = pass_validator.validate_many(items, {'users': UserLookup.for_payloads(items)})
+        self.assertEqual([errors == {} for _, errors in results], [True, False, False, False])
+        self.assertEqual(results[2][1], {'non_field_errors': ['Invalid data. Expected a dictionary, but got list.']})
+
+        response = submit_data_bulk(APIRequestFactory().post('/api/submitData/bulk/', items, format='json'))
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([set(result) for result in response.data['results']], [{'id'}, {'errors'}, {'errors'}, {'errors'}])
+
+
+def flatten(errors):
+    if isinstance(errors, dict):
+        errors = list(errors.values())
+    if isinstance(errors, list):
+        return [error for item in errors for error in flatten(item)]
+    return [errors]
+
+
+class UpdateImagesTests(TestCase):
+    def setUp(self):
+        user = create_user()
+        self.pass_obj = create_pass(user, images=3)
+        self.images = list(self.pass_obj.images.order_by('id'))
+
+    def update(self, images):
+        serializer = PassSerializer(self.pass_obj, data={'images': images}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+    def test_only_changed_images_are_written(self):
+        first, second, third = self.images
+        with mock.patch('fstr_api.serializers.schedule_ingestion') as schedule:
+            self.update([
+                {'data': first.data, 'title': first.title},
+                {'data': second.data, 'title': 'Новая подпись'},
+                {'data': 'https://example.com/new.jpg', 'title': 'Новое фото'},
+            ])
+
+        images = {image.data: image for image in self.pass_obj.images.all()}
+        self.assertEqual(len(images), 3)
+        self.assertEqual(images[first.data].pk, first.pk)
+        self.assertEqual(images[second.data].pk, second.pk)
+        self.assertEqual(images[second.data].title, 'Новая подпись')
+        self.assertNotIn(third.data, images)
+        schedule.assert_called_once()
+        self.assertEqual(list(schedule.call_args.args[0]), [images['https://example.com/new.jpg'].pk])
+
+    def test_unchanged_list_writes_nothing(self):
+        payload = [{'data': image.data, 'title': image.title} for image in self.images]
+        # точка сохранения, выборка изображений, запись перевала, сборка документа
+        # (перевал, изображения, запись), освобождение точки; сами изображения не перезаписываются
+        with self.assertNumQueries(7):
+            self.update(payload)
+        self.assertEqual([image.pk for image in self.pass_obj.images.order_by('id')],
+                         [image.pk for image in self.images])
+
+
+class UpdateConcurrencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+
+    def setUp(self):
+        get_cache().clear()
+        self.pass_obj = create_pass(self.user)
+        self.url = reverse('pass_detail', args=[self.pass_obj.pk])
+
+    def patch(self, data, **headers):
+        return self.client.patch(self.url, data, content_type='application/json', headers=headers)
+
+    def test_matching_version_is_saved(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.patch({'title': 'Новое название'}, if_match=etag)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['version'], self.pass_obj.version + 1)
+
+        detail = self.client.get(self.url)
+        self.assertEqual(detail['ETag'], response['ETag'])
+        self.assertEqual(detail.json()['title'], 'Новое название')
+
+        response = self.patch({'title': 'Ещё одно', 'version': response.json()['version']})
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_stale_version_is_rejected(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.patch({'title': 'Первая правка'}, if_match=etag).status_code, 200)
+
+        for data, headers in [({'title': 'Вторая правка'}, {'if_match': etag}),
+                              ({'title': 'Вторая правка', 'version': self.pass_obj.version}, {})]:
+            with self.subTest(data=data, headers=headers):
+                response = self.patch(data, **headers)
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json()['version'], self.pass_obj.version + 1)
+                self.assertEqual(response['ETag'], self.client.get(self.url)['ETag'])
+        self.assertEqual(Pass.objects.get(pk=self.pass_obj.pk).title, 'Первая правка')
+
+    def test_invalid_version(self):
+        response = self.patch({'title': 'Новое название', 'version': 'последняя'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_change_between_read_and_write_is_a_conflict(self):
+        is_valid = PassSerializer.is_valid
+
+        def moderated_meanwhile(serializer, *args, **kwargs):
+            Pass.objects.filter(pk=serializer.instance.pk).update(status='pending')
+            Pass.objects.filter(pk=serializer.instance.pk).touch()
+            return is_valid(serializer, *args, **kwargs)
+
+        with mock.patch.object(PassSerializer, 'is_valid', moderated_meanwhile):
+            response = self.patch({'title': 'Новое название', 'coords': {'height': 3000}})
+        self.assertEqual(response.status_code, 409, response.content)
+
+        pass_obj = Pass.objects.select_related('coords').get(pk=self.pass_obj.pk)
+        self.assertEqual(pass_obj.status, 'pending')
+        self.assertEqual(pass_obj.title, 'Перевал')
+        self.assertEqual(pass_obj.coords.height, 1200)
+        self.assertEqual(self.client.get(self.url).json()['status'], 'pending')
+
+
+class PassDetailCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        user = create_user()
+        self.pass_obj = create_pass(user)
+        self.factory = APIRequestFactory()
+
+    def get(self, **headers):
+        return pass_detail(self.factory.get(f'/api/submitData/{self.pass_obj.pk}/', **headers), pk=self.pass_obj.pk)
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.get()
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIsNone(response.data)
+
+    def test_update_invalidates_cached_entry(self):
+        etag = self.get()['ETag']
+        serializer = PassSerializer(self.pass_obj, data={'title': 'Новое название'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Новое название')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_pass(self):
+        response = pass_detail(self.factory.get('/api/submitData/0/'), pk=0)
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get_without_cache_reads_only_the_version(self):
+        response = self.get()
+        get_cache().clear()
+        with self.assertNumQueries(1):
+            not_modified = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.assertNumQueries(1):
+            not_modified = self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_image_ingestion_changes_version(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Pass.objects.filter(pk=self.pass_obj.pk).touch()
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class PassDocumentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+
+    def setUp(self):
+        get_cache().clear()
+        self.pass_obj = create_pass(self.user)
+
+    def assertDocumentIsCurrent(self, pass_obj):
+        pass_obj = Pass.objects.with_related().get(pk=pass_obj.pk)
+        document = PassDocument.objects.get(pk=pass_obj.pk)
+        self.assertEqual(document.data, PassSerializer(pass_obj).data)
+        self.assertEqual(document.version, pass_obj.version)
+        self.assertEqual(document.user_email, self.user.email)
+
+    def test_document_follows_submission_update_and_status_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = submit_data(APIRequestFactory().post('/api/submitData/', {
+                'title': 'Перевал',
+                'user': {'email': self.user.email, 'fam': 'Иванов', 'name': 'Иван', 'otc': 'Иванович',
+                         'phone': self.user.phone},
+                'coords': {'latitude': '45.1', 'longitude': '7.2', 'height': 1200},
+                'level': {'summer': '1А'},
+                'images': [{'data': 'https://example.com/1.jpg', 'title': 'Фото'}],
+            }, format='json'))
+        pass_obj = Pass.objects.get(pk=response.data['id'])
+        self.assertDocumentIsCurrent(pass_obj)
+
+        serializer = PassSerializer(pass_obj, data={'title': 'Новое название', 'images': []}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertDocumentIsCurrent(pass_obj)
+        self.assertEqual(PassDocument.objects.get(pk=pass_obj.pk).data['images'], [])
+
+        pass_obj.refresh_from_db()
+        pass_obj.status = 'accepted'
+        pass_obj.save()
+        self.assertDocumentIsCurrent(pass_obj)
+
+        Pass.objects.filter(pk=pass_obj.pk).touch()
+        self.assertDocumentIsCurrent(pass_obj)
+
+    def test_detail_is_a_single_row_read(self):
+        with self.assertNumQueries(1):
+            response = pass_detail(APIRequestFactory().get('/'), pk=self.pass_obj.pk)
+        self.assertEqual(response.data, PassDocument.objects.get(pk=self.pass_obj.pk).data)
+
+    def test_missing_document_is_built_on_read(self):
+        PassDocument.objects.all().delete()
+        response = pass_detail(APIRequestFactory().get('/'), pk=self.pass_obj.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertDocumentIsCurrent(self.pass_obj)
+
+    def test_rebuild_command(self):
+        other = create_pass(self.user)
+        PassDocument.objects.all().delete()
+        call_command('rebuild_pass_documents', batch_size=1, stdout=io.StringIO())
+        self.assertDocumentIsCurrent(self.pass_obj)
+        self.assertDocumentIsCurrent(other)
+
+    def test_pass_created_directly_gets_document_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                pass_obj = Pass.objects.create(
+                    user=self.user, title='Из консоли',
+                    coords=Coords.objects.create(latitude='45.0', longitude='7.0', height=1000),
+                    level=Level.objects.create(summer='1А'),
+                )
+                Image.objects.create(pass_obj=pass_obj, data='https://example.com/shell.jpg', title='Фото')
+                self.assertFalse(PassDocument.objects.filter(pk=pass_obj.pk).exists())
+        self.assertDocumentIsCurrent(pass_obj)
+        self.assertEqual(len(PassDocument.objects.get(pk=pass_obj.pk).data['images']), 1)
+
+
+class SyntheticDatasetTests(TestCase):
+    def test_dataset_is_generated_in_batches_with_documents(self):
+        heavy = generate_dataset(users=30, passes=200, images_per_pass=1, heavy_users=2, heavy_share=0.5,
+                                 batch_size=7, start=10**9)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Pass.objects.count(), 200)
+        self.assertEqual(Image.objects.count(), 200)
+        self.assertEqual(PassDocument.objects.count(), 200)
+        self.assertEqual(PassDocument.objects.filter(user_email__in=heavy).count(), 100)
+        self.assertEqual(len(heavy), 2)
+
+
+class BenchApiTests(SimpleTestCase):
+    def test_refuses_to_write_into_the_default_database(self):
+        for command in ['bench_api', 'bench_asgi']:
+            for database in ['default', 'missing']:
+                with self.subTest(command=command, database=database), self.assertRaises(CommandError):
+                    call_command(command, database=database, stdout=io.StringIO())
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.passes = [create_pass(cls.user, title=f'Перевал {i}') for i in range(5)]
+        cls.partner = AuthUser.objects.create_superuser('partner', 'partner@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.partner)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_data'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_in_id_order_and_resumable(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        ids = [json.loads(line)['id'] for line in body.splitlines()]
+        self.assertEqual(ids, [pass_obj.pk for pass_obj in self.passes])
+
+        _, rest = self.export(after_id=ids[1])
+        self.assertEqual([json.loads(line)['id'] for line in rest.splitlines()], ids[2:])
+
+    def test_geojson(self):
+        _, body = self.export(output='geojson')
+        collection = json.loads(body)
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        feature = collection['features'][0]
+        self.assertEqual(feature['id'], self.passes[0].pk)
+        self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': [7.1525, 45.3842, 1200]})
+        self.assertNotIn('coords', feature['properties'])
+        self.assertEqual(feature['properties']['title'], 'Перевал 0')
+
+    def test_since_and_invalid_parameters(self):
+        Pass.objects.filter(pk=self.passes[3].pk).update(updated_at=timezone.now() + timedelta(days=2))
+        PassDocument.objects.filter(pk=self.passes[3].pk).update(updated_at=timezone.now() + timedelta(days=2))
+        _, body = self.export(since=(timezone.now() + timedelta(days=1)).date().isoformat())
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [self.passes[3].pk])
+
+        for params in [{'output': 'csv'}, {'after_id': 'x'}, {'since': 'вчера'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('export_data'), params).status_code, 400)
+
+    def test_export_is_only_for_staff(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('export_data')).status_code, 403)
+
+    def test_passes_without_documents_are_exported(self):
+        _, expected = self.export()
+        PassDocument.objects.filter(pk__in=[self.passes[1].pk, self.passes[4].pk]).delete()
+        _, body = self.export()
+        self.assertEqual(body, expected)
+        self.assertEqual(PassDocument.objects.count(), 5)
+
+        PassDocument.objects.all().delete()
+        with tempfile.NamedTemporaryFile('r', suffix='.ndjson', encoding='utf-8') as out:
+            call_command('export_passes', file=out.name, chunk_size=2)
+            self.assertEqual(out.read(), expected)
+
+    def test_reads_in_fixed_size_chunks(self):
+        with self.assertNumQueries(3):
+            lines = list(stream_export('ndjson', chunk_size=2))
+        self.assertEqual(len(lines), 5)
+
+    def test_command_continues_file(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.ndjson', encoding='utf-8') as out:
+            call_command('export_passes', file=out.name, chunk_size=2)
+            call_command('export_passes', file=out.name, after_id=self.passes[-1].pk)
+            self.assertEqual(len(out.read().splitlines()), 5)
+            create_pass(self.user)
+            call_command('export_passes', file=out.name, after_id=self.passes[-1].pk)
+            out.seek(0)
+            self.assertEqual(len(out.read().splitlines()), 6)
+
+
+class AsyncViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.passes = [create_pass(cls.user, title=f'Перевал {i}') for i in range(3)]
+
+    def setUp(self):
+        get_cache().clear()
+
+    async def test_reads_match_sync_views(self):
+        pk = self.passes[0].pk
+        cases = [
+            (reverse('pass_detail', args=[pk]), reverse('pass_detail_async', args=[pk]), {}),
+            (reverse('pass_list'), reverse('pass_list_async'), {'user__email': self.user.email, 'page_size': 2}),
+            (reverse('pass_list'), reverse('pass_list_async'), {'user__email': 'nobody@example.com'}),
+            (reverse('pass_detail', args=[0]), reverse('pass_detail_async', args=[0]), {}),
+        ]
+        for sync_url, async_url, params in cases:
+            with self.subTest(url=async_url, params=params):
+                expected = await self.async_client.get(sync_url, params)
+                response = await self.async_client.get(async_url, params)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+                self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+    async def test_conditional_requests(self):
+        for url, params in [(reverse('pass_detail_async', args=[self.passes[0].pk]), {}),
+                            (reverse('pass_list_async'), {'user__email': self.user.email})]:
+            with self.subTest(url=url):
+                etag = (await self.async_client.get(url, params))['ETag']
+                await get_cache().aclear()
+                response = await self.async_client.get(url, params, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+
+    async def test_list_errors_are_json(self):
+        params = {'user__email': self.user.email}
+        bad_cursor = {**params, 'cursor': 'испорчен'}
+        expected = await self.async_client.get(reverse('pass_list'), bad_cursor)
+        response = await self.async_client.get(reverse('pass_list_async'), bad_cursor)
+        self.assertEqual((response.status_code, response.json()), (400, expected.json()))
+
+        failure = OSError('база недоступна')
+        with mock.patch('fstr_api.reads.PassCursorPagination.apaginate_queryset', side_effect=failure), \
+                self.assertLogs('fstr_api.async_views', 'ERROR'):
+            response = await self.async_client.get(reverse('pass_list_async'), params)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'status': 500, 'message': 'Ошибка при выполнении операции',
+                                           'error_details': 'база недоступна'})
+
+    async def test_writes_go_to_sync_views(self):
+        response = await self.async_client.post(reverse('pass_list_async'), {
+            'title': 'Новый перевал',
+            'user': {'email': 'new@example.com', 'fam': 'Петров', 'name': 'Пётр', 'otc': 'Петрович',
+                     'phone': '+7 (900) 765-43-21'},
+            'coords': {'latitude': '45.1', 'longitude': '7.2', 'height': 1200},
+            'level': {'summer': '1А'},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        url = reverse('pass_detail_async', args=[response.json()['id']])
+        response = await self.async_client.patch(url, {'title': 'Новое название'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((await self.async_client.get(url)).json()['title'], 'Новое название')
+
+        response = await self.async_client.delete(url)
+        self.assertEqual(response.status_code, 405)
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.pass_obj = create_pass(cls.user)
+
+    def setUp(self):
+        get_cache().clear()
+        metrics.reset()
+
+    def server_timing(self, response):
+        return dict(item.split(';', 1) for item in response['Server-Timing'].split(', '))
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('pass_detail', args=[self.pass_obj.pk]))
+        timing = self.server_timing(response)
+        self.assertEqual(timing['db-queries'], f'desc="{len(queries)}"')
+        self.assertIn('db', timing)
+        self.assertIn('render', timing)
+        self.assertIn('total', timing)
+
+    @override_settings(FSTR_METRICS_TOKEN='secret')
+    def test_metrics_are_served_by_token(self):
+        self.client.get(reverse('pass_detail', args=[self.pass_obj.pk]))
+        self.client.get(reverse('pass_detail', args=[0]))
+
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('fstr_requests_total{view="pass_detail",method="GET",status="200"} 1', text)
+        self.assertIn('fstr_requests_total{view="pass_detail",method="GET",status="404"} 1', text)
+        self.assertIn('fstr_request_duration_seconds_count{view="pass_detail"} 2', text)
+        self.assertNotIn('view="metrics"', text)
+
+        # адрес клиента не даёт доступа: за прокси он всегда локальный
+        for headers in [{}, {'Authorization': 'Bearer wrong'}]:
+            with self.subTest(headers=headers):
+                self.assertEqual(self.client.get(reverse('metrics'), headers=headers).status_code, 403)
+
+    def test_metrics_are_served_to_staff(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(AuthUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_slow_requests_are_sampled_to_log(self):
+        url = reverse('pass_detail', args=[self.pass_obj.pk])
+        with override_settings(FSTR_SLOW_REQUEST_SECONDS=0):
+            with self.assertLogs('fstr_api.slow_requests', 'WARNING') as logs:
+                self.client.get(url)
+            self.assertIn(f'GET {url}: 200', logs.output[0])
+            self.assertIn('SELECT', logs.output[0])
+
+            with override_settings(FSTR_SLOW_REQUEST_SAMPLE_RATE=0):
+                with self.assertNoLogs('fstr_api.slow_requests'):
+                    self.client.get(url)
+
+        with self.assertNoLogs('fstr_api.slow_requests'):
+            self.client.get(url)
+
+    def test_unexpected_error_is_logged(self):
+        with mock.patch.object(pass_validator, 'validate', side_effect=RuntimeError('сбой')):
+            with self.assertLogs('fstr_api.views', 'ERROR') as logs:
+                response = self.client.post(reverse('pass_list'), {}, content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('RuntimeError', logs.output[0])
+
+
+class SubmitInstrumentationTests(TransactionTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def server_timing(self, response):
+        return dict(item.split(';', 1) for item in response['Server-Timing'].split(', '))
+
+    def test_submit_reports_validation(self):
+        # документ нового перевала собирается при фиксации транзакции заявки, в том же запросе
+        response = self.client.post(reverse('pass_list'), {
+            'title': 'Новый перевал',
+            'user': {'email': 'new@example.com', 'fam': 'Петров', 'name': 'Пётр', 'otc': 'Петрович',
+                     'phone': '+7 (900) 765-43-21'},
+            'coords': {'latitude': '45.1', 'longitude': '7.2', 'height': 1200},
+            'level': {'summer': '1А'},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        timing = self.server_timing(response)
+        self.assertIn('validation', timing)
+        self.assertIn('serialization', timing)
+
+
+class RoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.pass_obj = create_pass(cls.user)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_shared_paths_map_each_method_to_its_handler(self):
+        cases = [
+            (reverse('pass_list'), {'get': list_by_user_email, 'post': submit_data}),
+            (reverse('pass_detail', args=[self.pass_obj.pk]), {'get': pass_detail, 'patch': update_pass}),
+        ]
+        for url, handlers in cases:
+            self.assertEqual(resolve(url).func.cls.handlers, handlers)
+
+    def request_dispatches(self, method, url, data=None):
+        with mock.patch.object(APIView, 'initial', autospec=True, side_effect=APIView.initial) as initial:
+            response = getattr(self.client, method)(url, data, content_type='application/json')
+        return response, initial.call_count
+
+    def test_every_method_reaches_its_handler_in_one_dispatch(self):
+        list_url = reverse('pass_list')
+        detail_url = reverse('pass_detail', args=[self.pass_obj.pk])
+        payload = {
+            'title': 'Новый перевал',
+            'user': {'email': 'new@example.com', 'fam': 'Петров', 'name': 'Пётр', 'otc': 'Петрович',
+                     'phone': '+7 (900) 765-43-21'},
+            'coords': {'latitude': '45.1', 'longitude': '7.2', 'height': 1200},
+            'level': {'summer': '1А'},
+        }
+        cases = [
+            ('get', f'{list_url}?user__email={self.user.email}', None, 200),
+            ('post', list_url, payload, 201),
+            ('get', detail_url, None, 200),
+            ('patch', detail_url, {'title': 'Новое название'}, 200),
+        ]
+        for method, url, data, expected_status in cases:
+            with self.subTest(method=method, url=url):
+                response, dispatches = self.request_dispatches(method, url, data)
+                self.assertEqual(response.status_code, expected_status, response.content)
+                self.assertEqual(dispatches, 1)
+
+    def test_unsupported_method(self):
+        response = self.client.delete(reverse('pass_detail', args=[self.pass_obj.pk]))
+        self.assertEqual(response.status_code, 405)
+
+    def test_old_url_names_still_resolve(self):
+        detail_url = reverse('pass_detail', args=[self.pass_obj.pk])
+        self.assertEqual(reverse('submit_data'), reverse('pass_list'))
+        self.assertEqual(reverse('list_by_user_email'), reverse('pass_list'))
+        self.assertEqual(reverse('update_pass', args=[self.pass_obj.pk]), detail_url)
+        self.assertEqual(resolve(detail_url).url_name, 'pass_detail')
+
+    def test_handler_policies_are_kept(self):
+        @api_view(['GET'])
+        @permission_classes([IsAdminUser])
+        @throttle_classes([])
+        @parser_classes([JSONParser])
+        def read(request):
+            return Response()
+
+        @api_view(['POST'])
+        @permission_classes([IsAdminUser])
+        @throttle_classes([])
+        @parser_classes([JSONParser])
+        def write(request):
+            return Response()
+
+        view = dispatch_by_method('AdminView', get=read, post=write)
+        self.assertEqual(view.cls.permission_classes, [IsAdminUser])
+        self.assertEqual(view.cls.throttle_classes, [])
+        self.assertEqual(view.cls.parser_classes, [JSONParser])
+        self.assertEqual(view(APIRequestFactory().get('/')).status_code, 403)
+
+        with self.assertRaises(ImproperlyConfigured):
+            dispatch_by_method('MixedView', get=read, post=submit_data)
+
+    def test_each_method_has_its_own_operation_id(self):
+        schema = SchemaGenerator().get_schema(request=None, public=True)
+        operation_ids = [operation['operationId'] for item in schema['paths'].values() for operation in item.values()]
+        self.assertEqual(len(operation_ids), len(set(operation_ids)))
+        self.assertEqual(
+            {method: operation['operationId'] for method, operation in schema['paths']['/api/submitData/'].items()},
+            {'get': 'list_by_user_email', 'post': 'submit_data'},
+        )
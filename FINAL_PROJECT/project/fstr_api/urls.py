@@ -1,11 +1,22 @@
 from django.urls import path
-from django.urls import path
+
+from .routing import dispatch_by_method
 from .views import *
 
+pass_list = dispatch_by_method('PassListView', get=list_by_user_email, post=submit_data)
+pass_detail_view = dispatch_by_method('PassDetailView', get=pass_detail, patch=update_pass)
 
 urlpatterns = [
-    path('', submit_data, name='submit_data'),
-    path('<int:pk>/', pass_detail, name='pass_detail'),
-    path('<int:pk>/', update_pass, name='update_pass'),
-    path('', list_by_user_email, name='list_by_user_email'),
+    path('', pass_list, name='pass_list'),
+    path('<int:pk>/', pass_detail_view, name='pass_detail'),
+    # прежние имена путей: по ним строят ссылки reverse() клиентов, запросы обслуживают пути выше
+    path('', pass_list, name='submit_data'),
+    path('', pass_list, name='list_by_user_email'),
+    path('<int:pk>/', pass_detail_view, name='update_pass'),
+    path('bulk/', submit_data_bulk, name='submit_data_bulk'),
+    path('moderation/', moderation_queue, name='moderation_queue'),
+    path('moderation/transition/', moderate_passes, name='moderate_passes'),
+    path('export/', export_data, name='export_data'),
+    path('search/bbox/', passes_in_bbox, name='passes_in_bbox'),
+    path('search/nearest/', nearest_passes, name='nearest_passes'),
 ]
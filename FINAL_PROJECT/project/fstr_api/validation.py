@@ -0,0 +1,325 @@
+import decimal
+from collections.abc import Mapping
+from functools import cached_property
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import (MaxLengthValidator, MaxValueValidator, MinLengthValidator,
+                                    MinValueValidator, ProhibitNullCharactersValidator)
+from rest_framework import fields, serializers
+from rest_framework.exceptions import ErrorDetail, ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils import html
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from .instrumentation import timed
+from .serializers import PassSerializer
+
+SKIP = object()
+
+
+class Fallback(Exception):
+    """Быстрая проверка не уверена в значении: его разбирает само поле DRF."""
+
+
+class Errors:
+    """Ошибки узла в том виде, в каком их вернул бы сериализатор."""
+    __slots__ = ('detail',)
+
+    def __init__(self, detail):
+        self.detail = detail
+
+
+def extra_validators(field):
+    """Валидаторы поля, кроме тех, что быстрые проверки выполняют сами по его атрибутам."""
+    inline = {
+        (MaxLengthValidator, getattr(field, 'max_length', None)),
+        (MinLengthValidator, getattr(field, 'min_length', None)),
+        (MaxValueValidator, getattr(field, 'max_value', None)),
+        (MinValueValidator, getattr(field, 'min_value', None)),
+    }
+    return [
+        validator for validator in field.validators
+        if not isinstance(validator, (ProhibitNullCharactersValidator, ProhibitSurrogateCharactersValidator))
+        and (type(validator), getattr(validator, 'limit_value', None)) not in inline
+    ]
+
+
+def run_field(field, data):
+    """Проверка силами самого поля: значение, SKIP или Errors."""
+    try:
+        return field.run_validation(data)
+    except ValidationError as exc:
+        return Errors(exc.detail)
+    except DjangoValidationError as exc:
+        return Errors(fields.get_error_detail(exc))
+    except fields.SkipField:
+        return SKIP
+
+
+def compile_char(field):
+    trim, allow_blank = field.trim_whitespace, field.allow_blank
+    max_length, min_length = field.max_length, field.min_length
+    validators = extra_validators(field)
+
+    def check(data):
+        if type(data) is not str:
+            raise Fallback
+        value = data.strip() if trim else data
+        if not value:
+            if allow_blank and (trim or data == ''):
+                return ''
+            raise Fallback
+        if max_length is not None and len(value) > max_length:
+            raise Fallback
+        if min_length is not None and len(value) < min_length:
+            raise Fallback
+        if '\x00' in value:
+            raise Fallback
+        if not value.isascii():
+            try:
+                value.encode()
+            except UnicodeEncodeError:
+                raise Fallback
+        for validator in validators:
+            validator(value)
+        return value
+    return check
+
+
+def compile_decimal(field):
+    min_value, max_value = field.min_value, field.max_value
+    validators = extra_validators(field)
+
+    def check(data):
+        if type(data) not in (str, int, float) or field.localize:
+            raise Fallback
+        data = str(data).strip()
+        if len(data) > field.MAX_STRING_LENGTH:
+            raise Fallback
+        try:
+            value = decimal.Decimal(data)
+        except decimal.DecimalException:
+            raise Fallback
+        if not value.is_finite():
+            raise Fallback
+        value = field.quantize(field.validate_precision(value))
+        if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+            raise Fallback
+        for validator in validators:
+            validator(value)
+        return value
+    return check
+
+
+def compile_integer(field):
+    min_value, max_value = field.min_value, field.max_value
+    validators = extra_validators(field)
+
+    def check(data):
+        if type(data) is not int:
+            raise Fallback
+        if (min_value is not None and data < min_value) or (max_value is not None and data > max_value):
+            raise Fallback
+        for validator in validators:
+            validator(data)
+        return data
+    return check
+
+
+def compile_choice(field):
+    choices = field.choice_strings_to_values
+    validators = list(field.validators)
+
+    def check(data):
+        if type(data) is not str or data not in choices:
+            raise Fallback
+        value = choices[data]
+        for validator in validators:
+            validator(value)
+        return value
+    return check
+
+
+FAST_CHECKS = {
+    fields.CharField: compile_char,
+    fields.EmailField: compile_char,
+    fields.DecimalField: compile_decimal,
+    fields.IntegerField: compile_integer,
+    fields.ChoiceField: compile_choice,
+}
+
+
+class Leaf:
+    """Скалярное поле: быстрая проверка, при сомнении — run_validation самого поля."""
+
+    def __init__(self, field):
+        self.field = field
+        compile_check = FAST_CHECKS.get(type(field))
+        self.check = compile_check(field) if compile_check else None
+
+    def run(self, data, hooks):
+        if data is not fields.empty and data is not None and self.check is not None:
+            try:
+                return self.check(data)
+            except (Fallback, DjangoValidationError, ValidationError):
+                pass
+        return run_field(self.field, data)
+
+
+class Node:
+    """Вложенный сериализатор, разобранный на поля один раз."""
+
+    def __init__(self, serializer):
+        self.field = serializer
+        self.serializer_class = type(serializer)
+        self.invalid_message = serializer.error_messages['invalid']
+        self.has_validators = bool(serializer.validators)
+        self.has_validate = self.serializer_class.validate is not serializers.Serializer.validate
+
+        self.fields = []
+        for field in serializer._writable_fields:
+            method_name = 'validate_' + field.field_name
+            if not hasattr(self.serializer_class, method_name):
+                method_name = None
+            self.fields.append((field.field_name, field.source_attrs, method_name, compile_node(field)))
+        self.has_hooks = self.has_validators or self.has_validate or any(f[2] for f in self.fields)
+
+    def hook_instance(self, hooks):
+        # методы validate_* и validate() вызываются на экземпляре без полей: он создаётся дёшево
+        # и видит контекст текущей проверки
+        instance = hooks['instances'].get(self)
+        if instance is None:
+            instance = hooks['instances'][self] = self.serializer_class(context=hooks['context'])
+        return instance
+
+    def run(self, data, hooks):
+        if data is fields.empty or data is None:
+            return run_field(self.field, data)
+        if not isinstance(data, Mapping):
+            message = self.invalid_message.format(datatype=type(data).__name__)
+            return Errors({api_settings.NON_FIELD_ERRORS_KEY: [ErrorDetail(message, code='invalid')]})
+
+        instance = self.hook_instance(hooks) if self.has_hooks else None
+        ret, errors = {}, {}
+        for name, source_attrs, method_name, node in self.fields:
+            value = node.run(data.get(name, fields.empty), hooks)
+            if value is SKIP:
+                continue
+            if type(value) is Errors:
+                errors[name] = value.detail
+                continue
+            if method_name is not None:
+                try:
+                    value = getattr(instance, method_name)(value)
+                except ValidationError as exc:
+                    errors[name] = exc.detail
+                    continue
+                except DjangoValidationError as exc:
+                    errors[name] = fields.get_error_detail(exc)
+                    continue
+                except fields.SkipField:
+                    continue
+            if len(source_attrs) == 1:
+                ret[source_attrs[0]] = value
+            else:
+                fields.set_value(ret, source_attrs, value)
+        if errors:
+            return Errors(errors)
+
+        if self.has_validators or self.has_validate:
+            try:
+                if self.has_validators:
+                    instance.run_validators(ret)
+                if self.has_validate:
+                    ret = instance.validate(ret)
+            except (ValidationError, DjangoValidationError) as exc:
+                return Errors(serializers.as_serializer_error(exc))
+        return ret
+
+
+class ListNode:
+    """Вложенный список сериализаторов (many=True)."""
+
+    def __init__(self, field):
+        self.field = field
+        self.child = Node(field.child)
+        self.hooked = bool(field.validators) or type(field).validate is not serializers.ListSerializer.validate
+
+    def run(self, data, hooks):
+        field = self.field
+        if (self.hooked or not isinstance(data, list)
+                or (not field.allow_empty and not data)
+                or (field.max_length is not None and len(data) > field.max_length)
+                or (field.min_length is not None and len(data) < field.min_length)):
+            return run_field(field, data)
+
+        ret, errors = [], {}
+        for index, item in enumerate(data):
+            value = self.child.run(item, hooks)
+            if type(value) is Errors:
+                errors[index] = value.detail
+            else:
+                ret.append(value)
+        if errors:
+            if not getattr(api_settings, 'LIST_SERIALIZER_ERRORS_AS_DICT', False):
+                errors = [errors.get(index, {}) for index in range(len(data))]
+            return Errors(errors)
+        return ret
+
+
+def compile_node(field):
+    if isinstance(field, serializers.ListSerializer):
+        return ListNode(field)
+    if isinstance(field, serializers.BaseSerializer):
+        return Node(field)
+    return Leaf(field)
+
+
+class PayloadValidator:
+    """Проверка заявок по схеме сериализатора, собранной один раз.
+
+    Возвращает те же validated_data и ошибки, что и сериализатор, но не строит
+    поля на каждую заявку: проверка каждого поля заранее скомпилирована по его
+    атрибутам, а значения, в которых быстрая проверка не уверена (и все ошибки),
+    разбирает само поле DRF. Методы validate_* и validate() сериализаторов
+    вызываются как обычно, с переданным контекстом.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def root(self):
+        return Node(self.serializer_class())
+
+    def validate(self, data, context=None):
+        """Возвращает пару (validated_data, errors); при ошибках validated_data равно None."""
+        return self.validate_many([data], context)[0]
+
+    def validate_many(self, items, context=None):
+        """Проверяет пачку заявок с общим контекстом; результат — пары (validated_data, errors)."""
+        with timed('validation'):
+            return self.run_many(items, {} if context is None else context)
+
+    def run_many(self, items, context):
+        hooks = {'context': context, 'instances': {}}
+        results = []
+        for data in items:
+            if not isinstance(data, Mapping) or html.is_html_input(data):
+                # не JSON-объект: редкий случай, ответ целиком за сериализатором
+                serializer = self.serializer_class(data=data, context=context)
+                if serializer.is_valid():
+                    results.append((serializer.validated_data, {}))
+                else:
+                    results.append((None, serializer.errors))
+                continue
+
+            value = self.root.run(data, hooks)
+            if type(value) is Errors:
+                results.append((None, value.detail))
+            else:
+                results.append((value, {}))
+        return results
+
+
+pass_validator = PayloadValidator(PassSerializer)
@@ -1,13 +1,30 @@
-from drf_spectacular.utils import OpenApiResponse, extend_schema
+import logging
+from datetime import datetime, time, timedelta
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from drf_spectacular.utils import (OpenApiParameter, OpenApiResponse,
+                                   extend_schema)
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from .caching import if_match, pass_etag
+from .export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, stream_export
+from .instrumentation import timed
 from .models import *
+from .pagination import InvalidCursor, PassCursorPagination
+from .reads import read_pass_detail, read_pass_list, server_error
 from .serializers import *
+from .validation import pass_validator
+
+logger = logging.getLogger(__name__)
 
 
 @extend_schema(
+    operation_id='submit_data',
     summary="Отправка данных о перевале",
     description="Создаёт запись о перевале с данными пользователя, координат, уровня сложности и изображений.",
     request=PassSerializer,
@@ -20,9 +37,10 @@ from .serializers import *
 @api_view(['POST'])
 def submit_data(request):
     try:
-        pass_serializer = PassSerializer(data=request.data)
-        if pass_serializer.is_valid():
-            pass_obj = pass_serializer.save()
+        context = {}
+        validated_data, errors = pass_validator.validate(request.data, context)
+        if not errors:
+            pass_obj = PassSerializer(context=context).create(validated_data)
             return Response({
                 'status': 200,
                 'message': 'Отправлено успешно',
@@ -31,9 +49,85 @@ def submit_data(request):
         return Response({
             'status': 400,
             'message': 'Ошибка валидации',
-            'errors': pass_serializer.errors
+            'errors': errors
         }, status=status.HTTP_400_BAD_REQUEST)
+    except serializers.ValidationError as e:
+        return Response({
+            'status': 400,
+            'message': 'Ошибка валидации',
+            'errors': e.detail
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.exception('Ошибка при обработке %s %s', request.method, request.path)
+        return Response({
+            'status': 500,
+            'message': 'Ошибка при выполнении операции',
+            'error_details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+MAX_BULK_SUBMIT = 500
+
+
+@extend_schema(
+    summary="Пакетная отправка данных о перевалах",
+    description="Принимает массив заявок, проверяет их вместе и сохраняет корректные одной транзакцией. "
+                "Для каждого элемента возвращается id созданной записи или ошибки валидации.",
+    request=PassSerializer(many=True),
+    responses={
+        201: OpenApiResponse(description="Все записи созданы"),
+        207: OpenApiResponse(description="Часть записей создана, часть не прошла валидацию"),
+        400: OpenApiResponse(description="Ни одна запись не прошла валидацию или неверный формат запроса"),
+        500: OpenApiResponse(description="Внутренняя ошибка",)
+    },
+)
+@api_view(['POST'])
+def submit_data_bulk(request):
+    items = request.data
+    if not isinstance(items, list) or not items:
+        return Response({
+            'status': 400,
+            'message': 'Ожидается непустой массив заявок'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > MAX_BULK_SUBMIT:
+        return Response({
+            'status': 400,
+            'message': f'За один запрос можно отправить не более {MAX_BULK_SUBMIT} заявок'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        context = {'users': UserLookup.for_payloads(items)}
+        results = []
+        valid_data = []
+        for validated_data, errors in pass_validator.validate_many(items, context):
+            if errors:
+                results.append({'errors': errors})
+            else:
+                valid_data.append(validated_data)
+                results.append(None)
+
+        serializer = PassSerializer(many=True, context=context)
+        pass_objs = serializer.create(valid_data) if valid_data else []
+
+        # заявка, не сохранённая из-за параллельно созданного пользователя, получает свою ошибку
+        created = iter(pass_objs)
+        pending = [position for position, result in enumerate(results) if result is None]
+        for index, position in enumerate(pending):
+            conflict = serializer.conflicts.get(index)
+            results[position] = {'errors': conflict} if conflict else {'id': next(created).id}
+
+        if len(pass_objs) == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif pass_objs:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'status': response_status,
+            'message': f'Сохранено {len(pass_objs)} из {len(items)}',
+            'results': results
+        }, status=response_status)
     except Exception as e:
+        logger.exception('Ошибка при обработке %s %s', request.method, request.path)
         return Response({
             'status': 500,
             'message': 'Ошибка при выполнении операции',
@@ -41,28 +135,71 @@ def submit_data(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @extend_schema(
+    operation_id='pass_detail',
     summary="Получение полной информации о перевале",
-    description="Возвращает полную информацию о перевале по его идентификатору.",
-    responses=PassSerializer
+    description="Возвращает полную информацию о перевале по его идентификатору. "
+                "Ответ кэшируется и содержит заголовки ETag и Last-Modified; "
+                "при совпадении If-None-Match или If-Modified-Since возвращается 304.",
+    responses={
+        200: PassSerializer,
+        304: OpenApiResponse(description="Запись не изменилась"),
+        404: OpenApiResponse(description="Запись не найдена"),
+    }
 )
 @api_view(['GET'])
 def pass_detail(request, pk):
+    data, status_code, headers = read_pass_detail(request, pk)
+    return Response(data, status=status_code, headers=headers)
+
+
+def expected_version(request, pass_obj):
+    """Версия, которую клиент редактирует: по If-Match (ETag карточки) и полю version.
+
+    Возвращает None, если клиент прислал устаревшую версию. Без заголовка и поля
+    ожидается версия, прочитанная в начале запроса.
+    """
+    if not if_match(request, pass_etag(pass_obj.pk, pass_obj.version)):
+        return None
+    if 'version' not in request.data:
+        return pass_obj.version
     try:
-        pass_obj = Pass.objects.get(id=pk)
-        serializer = PassSerializer(pass_obj)
-        return Response(serializer.data)
-    except Pass.DoesNotExist:
-        return Response({'error': 'Запись не найдена'}, status=status.HTTP_404_NOT_FOUND)
-    
+        version = int(request.data['version'])
+    except (TypeError, ValueError):
+        raise ValueError('Поле version должно быть целым числом')
+    return version if version == pass_obj.version else None
+
+
+def version_conflict(pk):
+    version = Pass.objects.filter(pk=pk).values_list('version', flat=True).first()
+    if version is None:
+        return Response({
+            'state': 0,
+            'message': 'Запись не найдена'
+        }, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'state': 0,
+        'message': 'Запись была изменена после того, как вы её получили. Загрузите актуальную версию и повторите редактирование',
+        'version': version
+    }, status=status.HTTP_409_CONFLICT, headers={'ETag': pass_etag(pk, version)})
+
+
 @extend_schema(
+    operation_id='update_pass',
     summary="Редактирование данных перевала",
-    description="Редактирует существующую запись, если она в статусе new. Запрещено изменять любые данные пользователя.",
+    description="Редактирует существующую запись, если она в статусе new. Запрещено изменять любые данные пользователя. "
+                "Чтобы не перезаписать чужие изменения, передайте ETag карточки перевала в заголовке If-Match "
+                "или её версию в поле version: если запись с тех пор изменилась, возвращается 409.",
+    parameters=[
+        OpenApiParameter('If-Match', str, OpenApiParameter.HEADER,
+                         description="ETag карточки перевала, которую редактирует клиент"),
+    ],
     request=PassSerializer,
     responses={
         200: OpenApiResponse(description="Запись успешно обновлена"),
         400: OpenApiResponse(description="Ошибка валидации или попытка изменить данные пользователя"),
         403: OpenApiResponse(description="Редактирование запрещено (неверный статус)"),
         404: OpenApiResponse(description="Запись не найдена"),
+        409: OpenApiResponse(description="Запись изменена после того, как клиент её получил"),
     }
 )
 @api_view(['PATCH'])
@@ -82,13 +219,29 @@ def update_pass(request, pk):
                 'message': 'Запрещено изменять данные пользователя (ФИО, email, телефон)'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = PassSerializer(pass_obj, data=request.data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
+        try:
+            version = expected_version(request, pass_obj)
+        except ValueError as e:
+            return Response({
+                'state': 0,
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if version is None:
+            return version_conflict(pk)
+
+        serializer = PassSerializer(pass_obj, data=request.data, partial=True, context={'version': version})
+        with timed('validation'):
+            is_valid = serializer.is_valid()
+        if is_valid:
+            try:
+                serializer.save()
+            except VersionConflict:
+                return version_conflict(pk)
             return Response({
                 'state': 1,
-                'message': 'Обновлено успешно'
-            }, status=status.HTTP_200_OK)
+                'message': 'Обновлено успешно',
+                'version': pass_obj.version
+            }, status=status.HTTP_200_OK, headers={'ETag': pass_etag(pk, pass_obj.version)})
         else:
             return Response({
                 'state': 0,
@@ -104,43 +257,303 @@ def update_pass(request, pk):
 
 
 @extend_schema(
+    operation_id='list_by_user_email',
     summary="Получение списка перевалов",
-    description="Возвращает список данных обо всех объектах, которые пользователь с почтой <email> отправил на сервер.",
+    description="Возвращает список данных обо всех объектах, которые пользователь с почтой <email> отправил на сервер. "
+                "Записи упорядочены по времени добавления и отдаются страницами размера page_size; "
+                "для получения следующей страницы передайте next_cursor из ответа в параметре cursor. "
+                "Страница содержит заголовки ETag и Last-Modified; если её записи не менялись, "
+                "на условный запрос возвращается 304.",
+    parameters=[
+        OpenApiParameter('user__email', str, required=True),
+        OpenApiParameter('cursor', str, description="Курсор следующей страницы из поля next_cursor"),
+        OpenApiParameter('page_size', int, description="Размер страницы (по умолчанию 50, не более 500)"),
+    ],
     request=PassSerializer,
     responses={
         200: OpenApiResponse(description="Список успешно получен"),
-        400: OpenApiResponse(description="Отсутствует обязательный параметр user__email"),
+        400: OpenApiResponse(description="Отсутствует обязательный параметр user__email или некорректный курсор"),
         404: OpenApiResponse(description="Пользователь не существует"),
         500: OpenApiResponse(description="Ошибка при выполнении операции"),
     }
 )
 @api_view(['GET'])
 def list_by_user_email(request):
-    email = request.query_params.get('user__email')
-    if not email:
+    try:
+        data, status_code, headers = read_pass_list(request)
+    except Exception as e:
+        logger.exception('Ошибка при обработке %s %s', request.method, request.path)
+        data, status_code, headers = server_error(e)
+    return Response(data, status=status_code, headers=headers)
+
+
+def parse_date_bound(value, upper=False):
+    """Разбирает границу периода: дату-время или дату (для верхней границы — весь день)."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        if upper:
+            day += timedelta(days=1)
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+@extend_schema(
+    summary="Очередь модерации",
+    description="Возвращает перевалы в указанных статусах (по умолчанию new и pending) в порядке поступления. "
+                "Можно ограничить период добавления параметрами date_from и date_to. "
+                "Выдача постраничная, как у списка перевалов пользователя. Доступно только персоналу.",
+    parameters=[
+        OpenApiParameter('status', str, many=True, description="Статусы заявок (по умолчанию new, pending)"),
+        OpenApiParameter('date_from', str, description="Начало периода (дата или дата-время ISO 8601)"),
+        OpenApiParameter('date_to', str, description="Конец периода включительно (дата или дата-время ISO 8601)"),
+        OpenApiParameter('cursor', str, description="Курсор следующей страницы из поля next_cursor"),
+        OpenApiParameter('page_size', int, description="Размер страницы (по умолчанию 50, не более 500)"),
+    ],
+    responses={
+        200: OpenApiResponse(description="Страница очереди успешно получена"),
+        400: OpenApiResponse(description="Неизвестный статус, некорректная дата или курсор"),
+        403: OpenApiResponse(description="Нет прав модератора"),
+        500: OpenApiResponse(description="Ошибка при выполнении операции"),
+    }
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def moderation_queue(request):
+    statuses = request.query_params.getlist('status') or Pass.MODERATION_STATUSES
+    allowed_statuses = dict(Pass.STATUS_CHOICES)
+    unknown = [value for value in statuses if value not in allowed_statuses]
+    if unknown:
         return Response({
             'status': 400,
-            'message': 'Параметр user__email обязателен'
+            'message': f'Неизвестный статус: {", ".join(unknown)}'
         }, status=status.HTTP_400_BAD_REQUEST)
 
+    passes = Pass.objects.filter(status__in=statuses)
     try:
-        user_exists = User.objects.filter(email=email).exists()
-        if not user_exists:
-            return Response({
-                'status': 404,
-                'message': f'Пользователь с email {email} не найден'
-            }, status=status.HTTP_404_NOT_FOUND)
+        if request.query_params.get('date_from'):
+            passes = passes.filter(add_time__gte=parse_date_bound(request.query_params['date_from']))
+        if request.query_params.get('date_to'):
+            passes = passes.filter(add_time__lt=parse_date_bound(request.query_params['date_to'], upper=True))
+    except ValueError as e:
+        return Response({
+            'status': 400,
+            'message': f'Некорректная дата: {e}'
+        }, status=status.HTTP_400_BAD_REQUEST)
 
-        passes = Pass.objects.filter(user__email=email)
-        serializer = PassSerializer(passes, many=True)
+    try:
+        paginator = PassCursorPagination()
+        page = paginator.paginate_queryset(passes.with_related(), request)
+        with timed('serialization'):
+            results = PassSerializer(page, many=True).data
         return Response({
             'status': 200,
-            'count': passes.count(),
-            'results': serializer.data
+            'count': len(page),
+            'next_cursor': paginator.next_cursor,
+            'results': results
         }, status=status.HTTP_200_OK)
+    except InvalidCursor as e:
+        return Response({
+            'status': 400,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
+        logger.exception('Ошибка при обработке %s %s', request.method, request.path)
         return Response({
             'status': 500,
             'message': 'Ошибка при выполнении операции',
             'error_details': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@extend_schema(
+    summary="Смена статуса перевалов",
+    description="Переводит перевалы с указанными id в новый статус одним набором, если переход допустим "
+                "из их текущего статуса (Pass.STATUS_TRANSITIONS). Каждый переход записывается в журнал "
+                f"модерации. За один запрос — не более {MAX_MODERATION_BATCH} перевалов. Доступно только персоналу.",
+    request=ModerationSerializer,
+    responses={
+        200: OpenApiResponse(description="Статус изменён; перевалы с недопустимым переходом перечислены в skipped"),
+        400: OpenApiResponse(description="Ошибка валидации"),
+        403: OpenApiResponse(description="Нет прав модератора"),
+    }
+)
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def moderate_passes(request):
+    serializer = ModerationSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'status': 400,
+            'message': 'Ошибка валидации',
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    to_status = serializer.validated_data['status']
+    moved = Pass.objects.filter(pk__in=ids).moderate(
+        to_status, moderator=request.user.get_username(), comment=serializer.validated_data['comment'],
+    )
+    updated = {pk for pk, _ in moved}
+    current = dict(Pass.objects.filter(pk__in=[pk for pk in ids if pk not in updated]).values_list('pk', 'status'))
+    return Response({
+        'status': 200,
+        'message': f'Статус "{to_status}" установлен у {len(updated)} из {len(ids)} перевалов',
+        'updated': [pk for pk in ids if pk in updated],
+        'skipped': [{'id': pk, 'status': current[pk]} for pk in ids if pk in current],
+        'not_found': [pk for pk in ids if pk not in updated and pk not in current]
+    }, status=status.HTTP_200_OK)
+
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'geojson': 'application/geo+json; charset=utf-8',
+}
+
+
+@extend_schema(
+    summary="Выгрузка всех перевалов",
+    description="Потоково отдаёт все перевалы в порядке возрастания id: в формате NDJSON (по записи "
+                "PassSerializer в строке) или GeoJSON FeatureCollection с координатами в геометрии. "
+                "Прерванную выгрузку можно продолжить, передав в after_id id последней полученной записи; "
+                "since ограничивает выгрузку перевалами, изменёнными с указанного момента. "
+                "Выгрузка содержит контакты авторов заявок, поэтому доступна только персоналу.",
+    parameters=[
+        OpenApiParameter('output', str, enum=EXPORT_FORMATS, description="Формат выгрузки (по умолчанию ndjson)"),
+        OpenApiParameter('after_id', int, description="Выгрузить перевалы с id больше указанного"),
+        OpenApiParameter('since', str, description="Только изменённые с этого момента (дата или дата-время ISO 8601)"),
+    ],
+    responses={
+        200: OpenApiResponse(description="Поток записей"),
+        400: OpenApiResponse(description="Неизвестный формат, некорректный after_id или since"),
+        403: OpenApiResponse(description="Нет прав персонала"),
+    }
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_data(request):
+    params = request.query_params
+    output = params.get('output', 'ndjson')
+    try:
+        if output not in EXPORT_FORMATS:
+            raise ValueError(f'Неизвестный формат: {output}')
+        after_id = int(params.get('after_id', 0))
+        since = parse_date_bound(params['since']) if params.get('since') else None
+    except ValueError as e:
+        return Response({
+            'status': 400,
+            'message': f'Некорректный параметр: {e}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        stream_export(output, after_id, since, EXPORT_CHUNK_SIZE),
+        content_type=EXPORT_CONTENT_TYPES[output],
+    )
+    response['Content-Disposition'] = f'attachment; filename="passes.{output}"'
+    return response
+
+
+MAX_BBOX_RESULTS = 2000
+MAX_NEAREST = 100
+
+
+def parse_float_param(params, name, low, high, default=None):
+    value = params.get(name)
+    if value is None:
+        if default is None:
+            raise ValueError(f'Параметр {name} обязателен')
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f'Параметр {name} должен быть числом')
+    if not low <= number <= high:
+        raise ValueError(f'Параметр {name} должен быть в диапазоне [{low}, {high}]')
+    return number
+
+
+@extend_schema(
+    summary="Перевалы в прямоугольной области",
+    description="Возвращает перевалы, координаты которых попадают в прямоугольник карты. "
+                "Если min_lon больше max_lon, область пересекает 180-й меридиан.",
+    parameters=[
+        OpenApiParameter('min_lat', float, required=True),
+        OpenApiParameter('min_lon', float, required=True),
+        OpenApiParameter('max_lat', float, required=True),
+        OpenApiParameter('max_lon', float, required=True),
+        OpenApiParameter('limit', int, description=f"Максимум записей (по умолчанию и не более {MAX_BBOX_RESULTS})"),
+    ],
+    responses={
+        200: OpenApiResponse(description="Список успешно получен"),
+        400: OpenApiResponse(description="Некорректные границы области"),
+    }
+)
+@api_view(['GET'])
+def passes_in_bbox(request):
+    params = request.query_params
+    try:
+        min_lat = parse_float_param(params, 'min_lat', -90, 90)
+        max_lat = parse_float_param(params, 'max_lat', -90, 90)
+        min_lon = parse_float_param(params, 'min_lon', -180, 180)
+        max_lon = parse_float_param(params, 'max_lon', -180, 180)
+        limit = int(parse_float_param(params, 'limit', 1, MAX_BBOX_RESULTS, default=MAX_BBOX_RESULTS))
+        if min_lat > max_lat:
+            raise ValueError('min_lat не может быть больше max_lat')
+    except ValueError as e:
+        return Response({
+            'status': 400,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    passes = Pass.objects.in_bbox(min_lat, min_lon, max_lat, max_lon).with_related().order_by('id')[:limit]
+    with timed('serialization'):
+        results = PassSerializer(passes, many=True).data
+    return Response({
+        'status': 200,
+        'count': len(results),
+        'results': results
+    }, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    summary="Ближайшие перевалы",
+    description="Возвращает k перевалов, ближайших к точке, с расстоянием до неё в километрах.",
+    parameters=[
+        OpenApiParameter('lat', float, required=True),
+        OpenApiParameter('lon', float, required=True),
+        OpenApiParameter('k', int, description=f"Количество перевалов (по умолчанию 10, не более {MAX_NEAREST})"),
+    ],
+    responses={
+        200: OpenApiResponse(description="Список успешно получен"),
+        400: OpenApiResponse(description="Некорректные координаты"),
+    }
+)
+@api_view(['GET'])
+def nearest_passes(request):
+    params = request.query_params
+    try:
+        latitude = parse_float_param(params, 'lat', -90, 90)
+        longitude = parse_float_param(params, 'lon', -180, 180)
+        k = int(parse_float_param(params, 'k', 1, MAX_NEAREST, default=10))
+    except ValueError as e:
+        return Response({
+            'status': 400,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    found = Pass.objects.with_related().nearest(latitude, longitude, k)
+    results = []
+    for pass_obj, distance in found:
+        with timed('serialization'):
+            item = PassSerializer(pass_obj).data
+        item['distance_km'] = round(distance, 3)
+        results.append(item)
+    return Response({
+        'status': 200,
+        'count': len(results),
+        'results': results
+    }, status=status.HTTP_200_OK)
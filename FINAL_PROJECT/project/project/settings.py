@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'fstr_api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +92,10 @@ DATABASES = {
     },
 }
 
+# Отдельная база для нагрузочной проверки bench_api: команда наполняет её синтетическим набором
+if os.getenv('FSTR_BENCH_DB_NAME'):
+    DATABASES['bench'] = {**DATABASES['default'], 'NAME': os.getenv('FSTR_BENCH_DB_NAME')}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -128,6 +133,41 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Загрузчик изображений перевалов; для работы без сети — fstr_api.ingestion.LocalImageFetcher
+FSTR_IMAGE_FETCHER = 'fstr_api.ingestion.HttpImageFetcher'
+# Ссылка, которая уже загружалась, не скачивается повторно: изменения содержимого
+# по той же ссылке не подхватываются. Отключите, если изображения по ссылкам меняются.
+FSTR_IMAGE_REUSE_KNOWN_URLS = True
+
+# Кэш ответов API: Redis, если задан FSTR_REDIS_URL, иначе память процесса
+if os.getenv('FSTR_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('FSTR_REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+FSTR_PASS_CACHE = 'default'
+FSTR_PASS_CACHE_TIMEOUT = 300
+
+# Замеры запросов: заголовок Server-Timing, журнал медленных запросов (доля sample rate
+# запросов дольше порога) и токен, по которому сборщик читает метрики /metrics/
+# (без токена они доступны только персоналу)
+FSTR_SERVER_TIMING = True
+FSTR_SLOW_REQUEST_SECONDS = 1.0
+FSTR_SLOW_REQUEST_SAMPLE_RATE = 1.0
+FSTR_METRICS_TOKEN = os.getenv('FSTR_METRICS_TOKEN')
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -3,13 +3,17 @@ from django.urls import include, path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from rest_framework.routers import DefaultRouter
 
+from fstr_api.instrumentation import metrics_view
+
 router = DefaultRouter()
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/submitData/', include('fstr_api.urls')),
+    path('api/async/submitData/', include('fstr_api.async_urls')),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 
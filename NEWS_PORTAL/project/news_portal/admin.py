@@ -1,8 +1,16 @@
 from django.contrib import admin
 from .models import *
 
+
+class PostAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        # __str__ публикации выводит её категории и автора
+        return super().get_queryset(request).for_listing()
+
+
 admin.site.register(Author)
 admin.site.register(Category)
-admin.site.register(Post)
+admin.site.register(Post, PostAdmin)
 admin.site.register(PostCategory)
 admin.site.register(Comment)
+admin.site.register(OutgoingEmail)
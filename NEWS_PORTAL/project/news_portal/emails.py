@@ -0,0 +1,47 @@
+import re
+import secrets
+
+from django.template.loader import render_to_string
+from django.utils.html import conditional_escape
+
+RECIPIENT_FIELDS = ['username', 'email', 'first_name', 'last_name']
+
+
+class RecipientPlaceholder:
+    """Получатель, поля которого при отрисовке шаблона выводятся метками [[токен:поле]].
+
+    Токен случаен для каждой отрисовки, поэтому текст публикации не может
+    подделать метку.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        for field in RECIPIENT_FIELDS:
+            setattr(self, field, f'[[{token}:{field}]]')
+
+    def marks(self):
+        return re.compile(rf'\[\[{self.token}:({"|".join(RECIPIENT_FIELDS)})\]\]')
+
+
+class PersonalizedTemplate:
+    """Отрисованное письмо, в которое для каждого получателя подставляются только его поля.
+
+    Шаблон отрисовывается один раз (render_once), поэтому фильтры над текстом
+    публикаций и теги выполняются не для каждого получателя. Поля получателя
+    можно выводить в шаблоне только как есть, без фильтров.
+    """
+
+    def __init__(self, text, marks):
+        self.parts = marks.split(text) #на нечётных местах — имена полей получателя из RECIPIENT_FIELDS
+
+    def render(self, user):
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = conditional_escape(getattr(user, parts[i]))
+        return ''.join(parts)
+
+
+def render_once(template_name, context, recipient='user'):
+    """Отрисовывает шаблон письма один раз, подставив вместо получателя recipient метки его полей."""
+    placeholder = RecipientPlaceholder(secrets.token_hex(16))
+    return PersonalizedTemplate(render_to_string(template_name, {**context, recipient: placeholder}), placeholder.marks())
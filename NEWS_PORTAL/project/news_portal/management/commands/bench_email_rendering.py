@@ -0,0 +1,65 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from ...emails import render_once
+from ...models import Author, Category, Post
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает время отрисовки писем подписчикам категории: шаблон целиком для каждого "
+            "получателя и render_once с подстановкой полей получателя. Данные откатываются.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=100_000)
+        parser.add_argument('--posts', type=int, default=10, help="Публикаций в еженедельной рассылке")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        author = Author.objects.create(user=User.objects.create(username='bench-author'))
+        category = Category.objects.create(name='Раздел для замера')
+        User.objects.bulk_create([
+            User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(options['subscribers'])
+        ], batch_size=5000)
+        category.subscribers.add(*User.objects.filter(username__startswith='bench').exclude(pk=author.user_id))
+        posts = [
+            Post.objects.create(author=author, title=f'Новость {i}', text='Блин, ну и новость! ' * 100)
+            for i in range(options['posts'])
+        ]
+        for post in posts:
+            post.categories.add(category)
+        subscribers = list(category.subscribers.only('username', 'email'))
+
+        cases = [
+            ('Новая публикация', 'email_messages/new_post_message.html', {'post': posts[0]}),
+            ('Еженедельная', 'email_messages/weekly_newsletter.html', {'posts': posts}),
+        ]
+        self.stdout.write(f"Подписчиков: {len(subscribers)}")
+        self.stdout.write(f"{'Письмо':<18} {'шаблон на получателя, с':>24} {'render_once, с':>15} {'ускорение':>10}")
+        for name, template_name, context in cases:
+            started = time.perf_counter()
+            expected = [render_to_string(template_name, {**context, 'user': user}) for user in subscribers]
+            full_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            template = render_once(template_name, context)
+            actual = [template.render(user) for user in subscribers]
+            once_time = time.perf_counter() - started
+
+            self.stdout.write(f"{name:<18} {full_time:>24.2f} {once_time:>15.2f} {full_time / once_time:>9.0f}x")
+            if actual != expected:
+                self.stdout.write(self.style.ERROR(f"{name}: письма расходятся"))
@@ -0,0 +1,121 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import send_mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test.utils import override_settings
+
+from ...models import Author, Category, Post
+from ...outbox import drain
+from ...tasks import message_subscribers_task
+
+
+class HandshakeEmailBackend(EmailBackend):
+    """Почта в памяти с задержкой на каждое соединение, как при подключении к SMTP-серверу."""
+    delay = 0
+    connections = 0
+    opened = False
+
+    def open(self):
+        if self.opened:
+            return False
+        HandshakeEmailBackend.connections += 1
+        time.sleep(self.delay)
+        self.opened = True
+        return True
+
+    def close(self):
+        self.opened = False
+
+    def send_messages(self, messages):
+        # как SMTP-бэкенд: без открытого соединения открывает его на время отправки
+        new_connection = self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает рассылку уведомлений о публикации по одному письму на соединение "
+            "и через исходящую очередь пачками по одному соединению. Письма не отправляются: используется почта в памяти "
+            "с задержкой --handshake-ms на соединение. Данные откатываются.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=5000)
+        parser.add_argument('--categories', type=int, default=2,
+                            help="Категорий у публикации; каждый подписчик подписан на все")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--handshake-ms', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        HandshakeEmailBackend.delay = options['handshake_ms'] / 1000
+        backend = f'{__name__}.HandshakeEmailBackend'
+        try:
+            with transaction.atomic(), override_settings(EMAIL_BACKEND=backend, CELERY_TASK_ALWAYS_EAGER=True,
+                                                        OUTBOX_BATCH_SIZE=options['chunk_size'],
+                                                        OUTBOX_RATE_LIMIT=None):
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        users = User.objects.bulk_create([
+            User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(options['subscribers'])
+        ])
+        author = Author.objects.create(user=User.objects.create(username='bench-author'))
+        categories = [Category.objects.create(name=f'Раздел {i}') for i in range(options['categories'])]
+        for category in categories:
+            category.subscribers.add(*users)
+        post = Post.objects.create(author=author, title='Новость', text='Текст новости ' * 100)
+        category_pks = [category.pk for category in categories]
+
+        runs = [
+            ('По одному письму', lambda: self.send_one_by_one(post, category_pks)),
+            ('Через очередь', lambda: self.send_via_outbox(post, category_pks, options['chunk_size'])),
+        ]
+        self.stdout.write(f"Подписчиков: {len(users)}, категорий у публикации: {len(categories)}")
+        self.stdout.write(f"{'Рассылка':<18} {'писем':>7} {'соединений':>11} {'писем/с':>9}")
+        for name, run in runs:
+            mail.outbox = []
+            HandshakeEmailBackend.connections = 0
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{name:<18} {len(mail.outbox):>7} {HandshakeEmailBackend.connections:>11} "
+                              f"{len(mail.outbox) / elapsed:>9.0f}")
+
+    def send_via_outbox(self, post, category_pks, chunk_size):
+        message_subscribers_task.delay(post.pk, category_pks, chunk_size)
+        # отправка очереди запускается после фиксации транзакции, а здесь она откатывается
+        drain()
+
+    def send_one_by_one(self, post, category_pks):
+        # прежняя рассылка: по каждой категории, по письму и соединению на подписчика
+        for category in Category.objects.filter(pk__in=category_pks):
+            for user in category.subscribers.all():
+                html_content = render_to_string(
+                    'email_messages/new_post_message.html', {
+                        'post': post,
+                        'category': category,
+                        'user': user,
+                    }
+                )
+                send_mail(
+                    subject=post.title,
+                    message=f'Здравствуй, {user.username}. Новая публикация в твоём любимом разделе!',
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    recipient_list=[user.email],
+                    html_message=html_content,
+                )
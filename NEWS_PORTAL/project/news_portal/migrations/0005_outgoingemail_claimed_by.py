@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news_portal', '0004_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
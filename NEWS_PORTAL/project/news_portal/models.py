@@ -1,8 +1,10 @@
 from django.contrib.auth.models import User
+from django.core.mail import EmailMultiAlternatives
 from django.core.cache import cache
 from django.db import models
 from django.db.models import Sum
 from django.urls import reverse
+from django.utils import timezone
 
 
 class Author(models.Model):
@@ -34,6 +36,13 @@ class Category(models.Model):
         return reverse('posts_category_list', args=[str(self.id)])
 
 
+class PostQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Публикации для списков: автор с пользователем и категории загружаются вместе с ними,
+        а не отдельным запросом на каждую публикацию."""
+        return self.select_related('author__user').prefetch_related('categories')
+
+
 class Post(models.Model):
     """Модель, содержащая статьи и новости, которые создают пользователи."""
     article = 'AR'
@@ -51,6 +60,8 @@ class Post(models.Model):
     text = models.TextField() #текст статьи/новости
     rating = models.IntegerField(default=0) #рейтинг статьи/новости
 
+    objects = PostQuerySet.as_manager()
+
     def __str__(self):
         return f"""{self.datetime_creation.strftime('%d.%m.%y %H:%M')} {self.get_type_display()}
 {self.categories_post()}
@@ -59,6 +70,7 @@ class Post(models.Model):
 {self.preview()}"""
     
     def categories_post(self):
+        # categories.all() берёт категории из prefetch_related, если они загружены (см. PostQuerySet.for_listing)
         return ', '.join([category.name for category in self.categories.all()])
 
     def get_absolute_url(self):
@@ -106,3 +118,47 @@ class Comment(models.Model):
         return f'''{self.post.title} {self.datetime_creation}
 {self.user.username}
 {self.text}'''
+
+
+class OutgoingEmail(models.Model):
+    """Исходящая очередь писем: письма сохраняются в базе и отправляются задачей drain_outbox_task."""
+    pending = 'PE'
+    sent = 'SE'
+    failed = 'FA'
+    STATUS = [
+        (pending, 'ожидает отправки'),
+        (sent, 'отправлено'),
+        (failed, 'не отправлено'),
+    ]
+
+    idempotency_key = models.CharField(max_length=255, unique=True) #письмо с уже известным ключом повторно не ставится в очередь
+    to = models.EmailField()
+    from_email = models.CharField(max_length=254, blank=True) #пустой — DEFAULT_FROM_EMAIL на момент отправки
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=2, choices=STATUS, default=pending)
+    attempts = models.PositiveIntegerField(default=0) #число попыток отправки
+    next_attempt_at = models.DateTimeField(default=timezone.now) #раньше этого времени письмо не отправляется
+    claimed_by = models.CharField(max_length=32, blank=True) #обработчик, последним забравший письмо на отправку
+    last_error = models.TextField(blank=True)
+    datetime_creation = models.DateTimeField(auto_now_add=True)
+    datetime_sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def message(self, connection=None):
+        message = EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email or None,
+            to=[self.to],
+            connection=connection,
+        )
+        if self.html_body:
+            message.attach_alternative(self.html_body, 'text/html')
+        return message
+
+    def __str__(self):
+        return f'{self.to}: {self.subject} ({self.get_status_display()})'
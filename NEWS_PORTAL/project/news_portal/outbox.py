@@ -0,0 +1,156 @@
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничивает частоту отправки: в среднем rate писем в секунду, не больше burst подряд.
+
+    Пустой rate снимает ограничение.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+
+    def take(self):
+        if not self.rate:
+            return
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            self.tokens = 1
+            self.updated = now + wait
+        self.tokens -= 1
+
+
+def enqueue(emails):
+    """Сохраняет письма в исходящую очередь; письма с уже известным idempotency_key пропускаются."""
+    OutgoingEmail.objects.bulk_create(emails, ignore_conflicts=True, batch_size=settings.OUTBOX_BATCH_SIZE)
+
+
+def retry_delay(attempts):
+    """Задержка перед следующей попыткой: удваивается с каждой неудачей, но не больше OUTBOX_RETRY_MAX_DELAY."""
+    return timedelta(seconds=min(settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX_DELAY))
+
+
+def claim(batch_size):
+    """Забирает из очереди пачку писем, которым пора отправляться.
+
+    До отправки письма откладываются на OUTBOX_LEASE секунд, поэтому параллельный
+    обработчик их не возьмёт, а письма упавшего обработчика по истечении этого
+    времени вернутся в очередь. Письмо забирается условным UPDATE: из двух
+    обработчиков, выбравших одни и те же письма, его получит только первый,
+    даже там, где select_for_update ничего не блокирует (SQLite).
+    """
+    owner = uuid.uuid4().hex
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutgoingEmail.objects.filter(status=OutgoingEmail.pending, next_attempt_at__lte=now)
+        pks = list(
+            due.select_for_update(skip_locked=True)
+            .order_by('next_attempt_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        due.filter(pk__in=pks).update(
+            claimed_by=owner,
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=settings.OUTBOX_LEASE),
+        )
+    return list(OutgoingEmail.objects.filter(claimed_by=owner).order_by('next_attempt_at', 'pk'))
+
+
+def send_batch(emails, bucket):
+    """Отправляет пачку писем через одно SMTP-соединение и записывает результат каждого письма.
+
+    Письмо отмечается отправленным сразу после отправки, чтобы сбой посреди
+    пачки не привёл к повторной отправке уже ушедших писем. Письма, срок аренды
+    которых истёк до отправки, пропускаются: их мог забрать другой обработчик.
+    Отметка ставится только на письмо, которое всё ещё за этим обработчиком.
+    """
+    try:
+        connection = get_connection()
+        connection.open()
+    except Exception as error:
+        logger.warning("Failed to connect to the mail server: %s", error)
+        for email in emails:
+            reschedule(email, error)
+        return 0
+
+    sent = 0
+    try:
+        for email in emails:
+            bucket.take()
+            # next_attempt_at забранного письма — конец срока аренды
+            if timezone.now() >= email.next_attempt_at:
+                logger.warning("Lease on email %s to %s expired before sending, leaving it to the queue",
+                               email.pk, email.to)
+                continue
+            try:
+                connection.send_messages([email.message()])
+            except Exception as error:
+                logger.warning("Failed to send email %s to %s: %s", email.pk, email.to, error)
+                reschedule(email, error)
+                # соединение после ошибки могло оборваться
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+            else:
+                marked = OutgoingEmail.objects.filter(pk=email.pk, claimed_by=email.claimed_by).update(
+                    status=OutgoingEmail.sent, datetime_sent=timezone.now(),
+                )
+                if not marked:
+                    logger.warning("Email %s to %s was sent after another worker reclaimed it",
+                                   email.pk, email.to)
+                sent += 1
+    finally:
+        connection.close()
+    return sent
+
+
+def reschedule(email, error):
+    # письмо, которое после истечения срока забрал другой обработчик, остаётся за ним
+    claimed = OutgoingEmail.objects.filter(pk=email.pk, claimed_by=email.claimed_by)
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        claimed.update(status=OutgoingEmail.failed, last_error=str(error))
+        logger.error("Giving up on email %s to %s after %s attempts", email.pk, email.to, email.attempts)
+    else:
+        claimed.update(
+            next_attempt_at=timezone.now() + retry_delay(email.attempts),
+            last_error=str(error),
+        )
+
+
+def drain(batch_size=None, bucket=None, on_batch=None):
+    """Отправляет письма очереди пачками, пока в ней есть письма, которым пора отправляться.
+
+    on_batch вызывается перед отправкой каждой пачки. Возвращает число отправленных писем.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    bucket = bucket or TokenBucket(settings.OUTBOX_RATE_LIMIT, settings.OUTBOX_BURST)
+    sent = 0
+    while emails := claim(batch_size):
+        if on_batch:
+            on_batch()
+        sent += send_batch(emails, bucket)
+    return sent
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
 
@@ -9,10 +10,11 @@ def message_subscribers(sender, instance, action, pk_set, **kwargs):
     if action != 'post_add':
         return
     
-    message_subscribers_task.delay(
+    category_pks = list(pk_set)
+    transaction.on_commit(lambda: message_subscribers_task.delay(
         post_pk=instance.pk,
-        category_pks=list(pk_set)
-    )
+        category_pks=category_pks
+    ))
     
     """categories = Category.objects.filter(id__in=pk_set)
     
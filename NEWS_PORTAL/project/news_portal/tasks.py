@@ -1,106 +1,159 @@
-from celery import shared_task
+import logging
+import uuid
+from datetime import timedelta
+from itertools import groupby, islice
+from operator import itemgetter
+
+from celery import group, shared_task
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Category, Post
+from .emails import RECIPIENT_FIELDS, render_once
+from .models import Category, OutgoingEmail, Post
+from .outbox import drain, enqueue
 
-@shared_task
-def message_subscribers_task(post_pk, category_pks, **kwargs):
-    post = Post.objects.get(pk=post_pk)
+NOTIFICATION_CHUNK_SIZE = 500 #получателей в одной подзадаче рассылки
+DIGEST_CHUNK_SIZE = 500 #писем еженедельной рассылки, сохраняемых в очередь за раз
+DIGEST_TEMPLATES_LIMIT = 1000 #отрисованных вариантов письма, хранимых одновременно
+DRAIN_LOCK = 'news_portal:outbox-drain'
 
-    categories = Category.objects.filter(pk__in=category_pks)
-    
-    for category in categories:
-        subscribers = category.subscribers.all()
-        
-        for user in subscribers:
-            html_content = render_to_string(
-                'email_messages/new_post_message.html', {
-                    'post': post,
-                    'category': category,
-                    'user': user,
-                }
-            )
-            
-            kwargs = {
-                'subject': post.title,
-                'message': f'Здравствуй, {user.username}. Новая публикация в твоём любимом разделе!',
-                'from_email': settings.DEFAULT_FROM_EMAIL,
-                'recipient_list': [user.email],
-                'fail_silently': True,
-                'html_message': html_content
-            }
-
-            message_subscribers_task.delay(kwargs)
-            
-            send_mail(
-                subject=post.title,
-                message=f'Здравствуй, {user.username}. Новая публикация в твоём любимом разделе!',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True,
-                html_message=html_content,
-            )
+logger = logging.getLogger(__name__)
 
 
 @shared_task
-def send_weekly_newslettert_task():
-    pass
-
-
-from celery import shared_task
-from collections import defaultdict
-from datetime import timedelta
-import logging
+def message_subscribers_task(post_pk, category_pks, chunk_size=NOTIFICATION_CHUNK_SIZE):
+    """Раздаёт уведомление о новой публикации подписчикам её категорий.
+
+    Пользователь, подписанный на несколько категорий публикации, получает одно
+    письмо. Получатели делятся на пачки по chunk_size, каждая пачка ставится в
+    исходящую очередь отдельной подзадачей send_post_notifications_task.
+    """
+    recipients = list(
+        User.objects.filter(categories__pk__in=category_pks)
+        .exclude(email='')
+        .order_by('pk')
+        .values_list('pk', flat=True)
+        .distinct()
+    )
+    chunks = [recipients[i:i + chunk_size] for i in range(0, len(recipients), chunk_size)]
+    group(send_post_notifications_task.s(post_pk, chunk) for chunk in chunks).apply_async()
+    return len(recipients)
 
-from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils import timezone
 
-from .models import Post
+@shared_task
+def send_post_notifications_task(post_pk, user_pks):
+    """Ставит в исходящую очередь уведомления о публикации для пачки пользователей."""
+    post = Post.objects.get(pk=post_pk)
+    template = render_once('email_messages/new_post_message.html', {'post': post})
+    emails = [
+        OutgoingEmail(
+            idempotency_key=f'post-{post.pk}-user-{user.pk}',
+            subject=post.title,
+            body=f'Здравствуй, {user.username}. Новая публикация в твоём любимом разделе!',
+            html_body=template.render(user),
+            to=user.email,
+        )
+        for user in User.objects.filter(pk__in=user_pks).only('username', 'email')
+    ]
+    queue_emails(emails)
+    return len(emails)
 
-logger = logging.getLogger(__name__)
 
 @shared_task
-def send_weekly_newsletter_task():
+def send_weekly_newsletter_task(chunk_size=DIGEST_CHUNK_SIZE):
+    """Ставит в исходящую очередь каждому подписчику одно письмо с новыми за неделю публикациями всех его разделов.
+
+    Письма сохраняются пачками по chunk_size. Повторный запуск в ту же неделю
+    писем не дублирует.
+    """
     week_ago = timezone.now() - timedelta(days=7)
+    year, week, _ = timezone.localdate().isocalendar()
+    templates = {}
+    queued = 0
+    digests = weekly_digests(week_ago)
+    while chunk := list(islice(digests, chunk_size)):
+        emails = []
+        for user, posts in chunk:
+            key = tuple(post.pk for post in posts)
+            if key not in templates:
+                if len(templates) >= DIGEST_TEMPLATES_LIMIT:
+                    templates.clear()
+                templates[key] = render_once('email_messages/weekly_newsletter.html', {'posts': posts})
+            emails.append(OutgoingEmail(
+                idempotency_key=f'weekly-{year}-{week}-user-{user.pk}',
+                subject='Новые публикации за неделю в твоих разделах',
+                body=f'Здравствуй, {user.username}! В твоих любимых разделах появились новые публикации за последнюю неделю',
+                html_body=templates[key].render(user),
+                to=user.email,
+            ))
+        queue_emails(emails)
+        queued += len(emails)
+
+    logger.info("Queued %s weekly digests", queued)
+    return queued
 
-    new_posts = Post.objects.filter(datetime_creation__gte=week_ago).prefetch_related('categories')
 
-    if not new_posts.exists():
-        logger.info("No new posts this week.")
+@shared_task
+def drain_outbox_task():
+    """Отправляет письма исходящей очереди; как правило, одновременно работает один обработчик.
+
+    Блокировка в кэше только снижает число параллельных обработчиков (add в
+    файловом кэше не атомарен): одно письмо двум обработчикам не достанется
+    и без неё, это обеспечивает claim.
+    """
+    token = uuid.uuid4().hex
+    if not cache.add(DRAIN_LOCK, token, settings.OUTBOX_LEASE):
+        return 0
+
+    def extend_lock():
+        # рассылка может идти дольше OUTBOX_LEASE, своя блокировка продлевается на каждой пачке
+        if cache.get(DRAIN_LOCK) == token:
+            cache.touch(DRAIN_LOCK, settings.OUTBOX_LEASE)
+
+    try:
+        return drain(on_batch=extend_lock)
+    finally:
+        # блокировку, истёкшую и взятую другим обработчиком, не снимаем
+        if cache.get(DRAIN_LOCK) == token:
+            cache.delete(DRAIN_LOCK)
+
+
+def queue_emails(emails):
+    """Сохраняет письма в исходящую очередь и после фиксации транзакции запускает их отправку.
+
+    Если брокер недоступен, ошибка запуска только записывается в журнал: письма
+    уже в базе, и их отправит периодический drain_outbox_task.
+    """
+    enqueue(emails)
+    transaction.on_commit(drain_outbox_task.delay, robust=True)
+
+
+def weekly_digests(since, chunk_size=DIGEST_CHUNK_SIZE):
+    """Выдаёт пары (подписчик, его новые публикации) по одной, не загружая всех подписчиков в память.
+
+    Связи подписчиков с публикациями их разделов, созданными после since, читаются
+    одним запросом, упорядоченным по пользователю. Публикация из нескольких разделов
+    пользователя попадает в его письмо один раз.
+    """
+    posts = {
+        post.pk: post
+        for post in Post.objects.filter(datetime_creation__gte=since).prefetch_related('categories')
+    }
+    if not posts:
         return
-
-    category_posts = defaultdict(list)
-    for post in new_posts:
-        for category in post.categories.all():
-            category_posts[category].append(post)
-
-    for category, posts in category_posts.items():
-        subscribers = category.subscribers.all()
-
-        for user in subscribers:
-            try:
-                html_content = render_to_string(
-                    'email_messages/weekly_newsletter.html',{
-                        'user': user,
-                        'category': category,
-                        'posts': posts,
-                    }
-                )
-
-                send_mail(
-                    subject=f'Новые публикации за неделю в разделе "{category.name}"',
-                    message=f'Здравствуй, {user.username}! В разделе "{category.name}" появились новые публикации за последнюю неделю',
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                    html_message=html_content,
-                )
-                logger.info(f"Sent weekly digest to {user.email} for category {category.name}")
-
-            except Exception as e:
-                logger.error(f"Failed to send email to {user.email}: {str(e)}")
-
+    rows = (
+        Category.subscribers.through.objects
+        .filter(category__postcategory__post__in=list(posts))
+        .exclude(user__email='')
+        .order_by('user_id', 'category__postcategory__post_id')
+        .values_list('user_id', *(f'user__{field}' for field in RECIPIENT_FIELDS), 'category__postcategory__post_id')
+        .distinct()
+        .iterator(chunk_size=chunk_size)
+    )
+    for user_pk, user_rows in groupby(rows, key=itemgetter(0)):
+        user_rows = list(user_rows)
+        user = User(pk=user_pk, **dict(zip(RECIPIENT_FIELDS, user_rows[0][1:-1])))
+        yield user, [posts[row[-1]] for row in user_rows]
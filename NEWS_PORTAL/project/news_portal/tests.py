@@ -1,3 +1,425 @@
-from django.test import TestCase
+import smtplib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.db.models import QuerySet
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .emails import render_once
+from .models import Author, Category, OutgoingEmail, Post
+from .outbox import TokenBucket, claim, drain, enqueue, retry_delay, send_batch
+from .tasks import (DRAIN_LOCK, drain_outbox_task, message_subscribers_task, send_post_notifications_task,
+                    send_weekly_newsletter_task)
+
+
+def create_users(count, prefix='user', **kwargs):
+    return User.objects.bulk_create([
+        User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', **kwargs) for i in range(count)
+    ])
+
+
+# подзадачи Celery выполняются сразу, без брокера
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', CELERY_TASK_ALWAYS_EAGER=True,
+                   OUTBOX_RATE_LIMIT=None)
+class PostNotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(user=User.objects.create(username='author'))
+        cls.sport = Category.objects.create(name='Спорт')
+        cls.science = Category.objects.create(name='Наука')
+        cls.politics = Category.objects.create(name='Политика')
+
+    def create_post(self):
+        return Post.objects.create(author=self.author, title='Новость', text='Текст новости ' * 20)
+
+    def test_subscriber_of_several_categories_gets_one_message(self):
+        both, sport_only, other, no_email = create_users(4)
+        no_email.email = ''
+        no_email.save()
+        self.sport.subscribers.add(both, sport_only, no_email)
+        self.science.subscribers.add(both)
+        self.politics.subscribers.add(other)
+
+        post = self.create_post()
+        with self.captureOnCommitCallbacks(execute=True):
+            post.categories.add(self.sport, self.science)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [both.email, sport_only.email])
+        self.assertEqual({message.subject for message in mail.outbox}, {post.title})
+
+    @override_settings(OUTBOX_BATCH_SIZE=10)
+    def test_outbox_is_drained_in_batches_over_one_connection(self):
+        self.sport.subscribers.add(*create_users(25))
+        post = self.create_post()
+        post.categories.add(self.sport)
+
+        with mock.patch('news_portal.outbox.get_connection', wraps=get_connection) as connections, \
+                self.captureOnCommitCallbacks(execute=True):
+            queued = message_subscribers_task.delay(post.pk, [self.sport.pk], chunk_size=10).get()
+
+        self.assertEqual(queued, 25)
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(connections.call_count, 3)
+
+    def test_chunk_query_count_does_not_depend_on_size(self):
+        users = create_users(50)
+        post = self.create_post()
+        # публикация, её категории для шаблона, пользователи пачки и запись в очередь
+        with self.assertNumQueries(4):
+            send_post_notifications_task(post.pk, [user.pk for user in users])
+        self.assertEqual(OutgoingEmail.objects.count(), 50)
+
+    def test_rerun_does_not_send_twice(self):
+        user = create_users(1)[0]
+        post = self.create_post()
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_post_notifications_task(post.pk, [user.pk])
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_message_is_personalized(self):
+        user = create_users(1)[0]
+        self.sport.subscribers.add(user)
+        post = self.create_post()
+        post.categories.add(self.sport)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            send_post_notifications_task(post.pk, [user.pk])
+        html, _ = mail.outbox[0].alternatives[0]
+        self.assertIn(f'Здравствуй, {user.username}.', html)
+        self.assertIn(self.sport.name, html)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', CELERY_TASK_ALWAYS_EAGER=True,
+                   OUTBOX_RATE_LIMIT=None)
+class WeeklyNewsletterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(user=User.objects.create(username='author'))
+        cls.sport = Category.objects.create(name='Спорт')
+        cls.science = Category.objects.create(name='Наука')
+        cls.politics = Category.objects.create(name='Политика')
+
+    def create_post(self, title, *categories, days_ago=0):
+        post = Post.objects.create(author=self.author, title=title, text='Текст новости ' * 20)
+        post.categories.add(*categories)
+        if days_ago:
+            Post.objects.filter(pk=post.pk).update(datetime_creation=timezone.now() - timedelta(days=days_ago))
+        return post
+
+    def test_one_digest_per_subscriber_across_categories(self):
+        both, sport_only, politics_only = create_users(3)
+        self.sport.subscribers.add(both, sport_only)
+        self.science.subscribers.add(both)
+        self.politics.subscribers.add(politics_only)
+        match = self.create_post('Матч', self.sport)
+        shared = self.create_post('Спорт и наука', self.sport, self.science)
+        self.create_post('Старый матч', self.sport, days_ago=8)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            queued = send_weekly_newsletter_task()
+
+        self.assertEqual(queued, 2)
+        digests = {message.to[0]: message.alternatives[0][0] for message in mail.outbox}
+        self.assertEqual(sorted(digests), [both.email, sport_only.email])
+        html = digests[both.email]
+        self.assertIn(f'Здравствуй, {both.username}.', html)
+        self.assertEqual(html.count(match.title), 1)
+        self.assertEqual(html.count(shared.title), 1)
+        self.assertNotIn('Старый матч', html)
+
+    def test_nothing_is_sent_without_new_posts(self):
+        self.sport.subscribers.add(*create_users(3))
+        self.create_post('Старый матч', self.sport, days_ago=8)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(send_weekly_newsletter_task(), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_rerun_in_the_same_week_does_not_send_twice(self):
+        self.sport.subscribers.add(*create_users(3))
+        self.create_post('Матч', self.sport)
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_weekly_newsletter_task()
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_query_count_does_not_depend_on_subscribers(self):
+        self.sport.subscribers.add(*create_users(25))
+        self.science.subscribers.add(*create_users(25, prefix='reader'))
+        self.create_post('Матч', self.sport)
+        self.create_post('Открытие', self.science)
+
+        # публикации недели, их категории, связи подписчиков с публикациями и запись в очередь
+        with self.assertNumQueries(4):
+            queued = send_weekly_newsletter_task()
+
+        self.assertEqual(queued, 50)
+        self.assertEqual(OutgoingEmail.objects.count(), 50)
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """Почта в памяти, которая не принимает письма на адреса из rejected."""
+    rejected = set()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & self.rejected:
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'rejected')})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND=f'{__name__}.FlakyEmailBackend', OUTBOX_RATE_LIMIT=None,
+                   OUTBOX_RETRY_DELAY=60, OUTBOX_RETRY_MAX_DELAY=3600, OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.rejected = set()
+
+    def queue(self, *addresses):
+        enqueue([
+            OutgoingEmail(idempotency_key=address, to=address, subject='Тема', body='Текст', html_body='<p>Текст</p>')
+            for address in addresses
+        ])
+
+    def test_sends_pending_and_marks_them_sent(self):
+        self.queue('a@example.com', 'b@example.com')
+        self.assertEqual(drain(), 2)
+        self.assertEqual(drain(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>Текст</p>')
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.sent).exists())
+
+    def test_duplicate_key_is_ignored(self):
+        self.queue('a@example.com')
+        self.queue('a@example.com')
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    def test_failed_message_is_retried_with_backoff(self):
+        FlakyEmailBackend.rejected = {'bad@example.com'}
+        self.queue('bad@example.com', 'good@example.com')
+
+        with self.assertLogs('news_portal.outbox', 'WARNING'):
+            self.assertEqual(drain(), 1)
+            bad = OutgoingEmail.objects.get(to='bad@example.com')
+            self.assertEqual((bad.status, bad.attempts), (OutgoingEmail.pending, 1))
+            self.assertIn('rejected', bad.last_error)
+            delays = []
+            for attempt in (2, 3):
+                # письмо не уходит раньше срока следующей попытки
+                self.assertEqual(drain(), 0)
+                delays.append(bad.next_attempt_at - timezone.now())
+                OutgoingEmail.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+                drain()
+                bad.refresh_from_db()
+                self.assertEqual(bad.attempts, attempt)
+
+        self.assertEqual(bad.status, OutgoingEmail.failed)
+        self.assertAlmostEqual(delays[0].total_seconds(), 60, delta=5)
+        self.assertAlmostEqual(delays[1].total_seconds(), 120, delta=5)
+        self.assertEqual([message.to[0] for message in mail.outbox], ['good@example.com'])
+
+    def test_email_claimed_by_a_concurrent_worker_is_not_taken(self):
+        self.queue('a@example.com', 'b@example.com')
+        rival = []
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # другой обработчик выбрал те же письма и успел забрать их раньше
+            if 'claimed_by' in kwargs and not rival:
+                rival.append(None)
+                rival.extend(claim(10))
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            mine = claim(10)
+        self.assertEqual(mine, [])
+        self.assertEqual(sorted(email.to for email in rival[1:]), ['a@example.com', 'b@example.com'])
+        self.assertEqual(OutgoingEmail.objects.filter(attempts=1).count(), 2)
+
+    def test_sent_messages_are_marked_before_the_batch_ends(self):
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+        bucket = mock.Mock()
+        bucket.take.side_effect = [None, None, RuntimeError('worker stopped')]
+        with self.assertRaises(RuntimeError):
+            send_batch(claim(10), bucket)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.sent).count(), 2)
+
+    def test_email_with_expired_lease_is_not_sent(self):
+        self.queue('a@example.com', 'b@example.com')
+        emails = claim(10)
+        emails[0].next_attempt_at = timezone.now() - timedelta(seconds=1)
+        with self.assertLogs('news_portal.outbox', 'WARNING'):
+            self.assertEqual(send_batch(emails, TokenBucket(None, 1)), 1)
+        self.assertEqual([message.to[0] for message in mail.outbox], ['b@example.com'])
+        self.assertEqual(OutgoingEmail.objects.get(to='a@example.com').status, OutgoingEmail.pending)
+
+    def test_reclaimed_email_is_left_to_its_new_owner(self):
+        self.queue('a@example.com')
+        emails = claim(10)
+        # срок аренды истёк, и письмо забрал другой обработчик
+        OutgoingEmail.objects.update(claimed_by='rival')
+        with self.assertLogs('news_portal.outbox', 'WARNING'):
+            send_batch(emails, TokenBucket(None, 1))
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.pending)
+
+    def test_retry_delay_is_capped(self):
+        self.assertEqual(retry_delay(1), timedelta(seconds=60))
+        self.assertEqual(retry_delay(3), timedelta(seconds=240))
+        self.assertEqual(retry_delay(20), timedelta(seconds=3600))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', OUTBOX_RATE_LIMIT=None,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'drain-lock-tests'}})
+class DrainLockTests(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+
+    def test_runs_once_at_a_time(self):
+        cache.add(DRAIN_LOCK, 'other', 60)
+        with mock.patch('news_portal.tasks.drain') as drain_mock:
+            self.assertEqual(drain_outbox_task(), 0)
+        drain_mock.assert_not_called()
+        self.assertEqual(cache.get(DRAIN_LOCK), 'other')
+
+    def test_releases_only_its_own_lock(self):
+        def lock_expires_and_is_taken(on_batch):
+            cache.set(DRAIN_LOCK, 'other', 60)
+            on_batch()
+            return 0
+
+        with mock.patch('news_portal.tasks.drain', side_effect=lock_expires_and_is_taken):
+            drain_outbox_task()
+        self.assertEqual(cache.get(DRAIN_LOCK), 'other')
+
+        with mock.patch('news_portal.tasks.drain', return_value=0):
+            cache.delete(DRAIN_LOCK)
+            drain_outbox_task()
+        self.assertIsNone(cache.get(DRAIN_LOCK))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.waits = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=self.clock, sleep=self.sleep)
+        for _ in range(5):
+            bucket.take()
+        self.assertEqual(self.waits, [0.5, 0.5])
+
+    def test_tokens_refill_over_time(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=self.clock, sleep=self.sleep)
+        for _ in range(3):
+            bucket.take()
+        self.now += 10
+        for _ in range(3):
+            bucket.take()
+        self.assertEqual(self.waits, [])
+
+    def test_no_rate_means_no_limit(self):
+        bucket = TokenBucket(rate=None, burst=1, clock=self.clock, sleep=self.sleep)
+        for _ in range(100):
+            bucket.take()
+        self.assertEqual(self.waits, [])
+
+
+class RenderOnceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(user=User.objects.create(username='author'))
+        cls.posts = [
+            Post.objects.create(author=author, title=f'Новость {i}', text='Блин, ну и новость! ' * 40)
+            for i in range(3)
+        ]
+
+    def test_matches_per_recipient_rendering(self):
+        users = [
+            User(username='ivan', email='ivan@example.com'),
+            User(username='<b>&"хакер"</b>', email='x@example.com'),
+        ]
+        cases = [
+            ('email_messages/new_post_message.html', {'post': self.posts[0]}),
+            ('email_messages/weekly_newsletter.html', {'posts': self.posts}),
+        ]
+        for template_name, context in cases:
+            template = render_once(template_name, context)
+            for user in users:
+                with self.subTest(template=template_name, user=user.username):
+                    self.assertEqual(template.render(user), render_to_string(template_name, {**context, 'user': user}))
+
+    def test_marks_in_post_text_are_not_substituted(self):
+        author = Author.objects.get()
+        post = Post.objects.create(
+            author=author, title='[[recipient:email]]',
+            text='Пароль: [[recipient:password]], [[recipient:nosuch]], [[recipient:username]]',
+        )
+        user = User(username='ivan', email='ivan@example.com', password='secret-hash')
+        for template_name, context in [
+            ('email_messages/new_post_message.html', {'post': post}),
+            ('email_messages/weekly_newsletter.html', {'posts': [post]}),
+        ]:
+            with self.subTest(template=template_name):
+                html = render_once(template_name, context).render(user)
+                self.assertEqual(html, render_to_string(template_name, {**context, 'user': user}))
+                self.assertIn('[[recipient:password]]', html)
+                self.assertNotIn('secret-hash', html)
+
+
+class PostListingQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sport = Category.objects.create(name='Спорт')
+        cls.science = Category.objects.create(name='Наука')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def create_posts(self, count):
+        for i in range(count):
+            author = Author.objects.create(user=User.objects.create(username=f'writer{Author.objects.count()}'))
+            post = Post.objects.create(author=author, title=f'Новость {i}', text='Текст новости ' * 20)
+            post.categories.add(self.sport, self.science)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_page_query_count_does_not_depend_on_posts(self):
+        # число публикаций страницы, сами публикации с авторами, их категории;
+        # поиску ещё нужны категории для формы фильтра, списку категории — сама категория
+        pages = [
+            (reverse('posts'), 3),
+            (reverse('posts_search') + f'?categories={self.sport.pk}', 5),
+            (reverse('posts_category_list', args=[self.sport.pk]), 4),
+        ]
+        for posts in (1, 10):
+            self.create_posts(posts - Post.objects.count())
+            for url, queries in pages:
+                with self.subTest(url=url, posts=posts):
+                    self.assertEqual(self.count_queries(url), queries)
+
+    def test_admin_changelist_query_count_does_not_depend_on_posts(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:news_portal_post_changelist')
+        self.create_posts(1)
+        few = self.count_queries(url)
+        self.create_posts(9)
+        self.assertEqual(self.count_queries(url), few)
@@ -19,6 +19,9 @@ class PostsList(ListView):
     context_object_name = 'posts'
     paginate_by = 10
 
+    def get_queryset(self):
+        return super().get_queryset().for_listing()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         for post in context['posts']:
@@ -71,13 +74,12 @@ class PostsCategoriesListView(PostsList):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        category = Category.objects.get(pk=self.kwargs['pk'])
-        context['category'] = category
+        context['category'] = self.category
         return context
     
     def get_queryset(self):
         self.category = Category.objects.get(pk=self.kwargs['pk'])
-        return Post.objects.filter(categories=self.category).order_by('-datetime_creation')
+        return Post.objects.filter(categories=self.category).for_listing().order_by('-datetime_creation')
 
 
 class PostDetail(DetailView):
@@ -10,8 +10,12 @@ app.config_from_object('django.conf:settings', namespace = 'CELERY')
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
-    'send_weekly_newslettert_task': {
-        'task': 'news_portal.tasks.send_weekly_newslettert_task',
+    'send_weekly_newsletter_task': {
+        'task': 'news_portal.tasks.send_weekly_newsletter_task',
         'schedule': crontab(hour=8, minute=0, day_of_week='monday'),
-    }
+    },
+    'drain_outbox_task': {
+        'task': 'news_portal.tasks.drain_outbox_task',
+        'schedule': crontab(),
+    },
 }
\ No newline at end of file
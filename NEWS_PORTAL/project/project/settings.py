@@ -190,6 +190,14 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+OUTBOX_BATCH_SIZE = 100 #писем на одно SMTP-соединение
+OUTBOX_RATE_LIMIT = 5 #писем в секунду; None — без ограничения
+OUTBOX_BURST = 20 #писем подряд без ожидания
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_DELAY = 60 #секунд до первой повторной попытки, дальше задержка удваивается
+OUTBOX_RETRY_MAX_DELAY = 3600
+OUTBOX_LEASE = 600 #секунд, на которые обработчик забирает пачку писем
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
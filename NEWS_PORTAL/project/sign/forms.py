@@ -1,11 +1,11 @@
 from django import forms
-from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import Group, User
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 
 from allauth.account.forms import SignupForm
+from news_portal.models import OutgoingEmail
+from news_portal.tasks import queue_emails
 
 
 class BaseRegisterForm(UserCreationForm):
@@ -43,14 +43,14 @@ class CommonSignupForm(SignupForm):
             }
         )
 
-        send_mail(
+        queue_emails([OutgoingEmail(
+            idempotency_key=f'signup-{user.pk}',
             subject='Регистрация в приложении News Portal',
-            message='Вы успешно зарегистрировались в приложении News Portal' \
+            body='Вы успешно зарегистрировались в приложении News Portal' \
             'Подтвердите свою почту',
-            html_message=html_content,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-        )
+            html_body=html_content,
+            to=user.email,
+        )])
 
         return user
         
@@ -1,3 +1,51 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.test import TestCase, override_settings
+
+from news_portal.models import OutgoingEmail
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', CELERY_TASK_ALWAYS_EAGER=True,
+                   OUTBOX_RATE_LIMIT=None)
+class SignupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='common')
+
+    def signup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/accounts/signup/', {
+                'username': 'ivan',
+                'email': 'ivan@example.com',
+                'password1': 'Zx12!pass-word',
+                'password2': 'Zx12!pass-word',
+            })
+        self.assertEqual(response.status_code, 302)
+        return User.objects.get(username='ivan')
+
+    def test_hello_message_goes_through_outbox(self):
+        user = self.signup()
+        email = OutgoingEmail.objects.get(idempotency_key=f'signup-{user.pk}')
+        self.assertEqual(email.status, OutgoingEmail.sent)
+        self.assertEqual([message.to for message in mail.outbox], [[user.email]])
+
+    def test_signup_does_not_wait_for_smtp(self):
+        with mock.patch('news_portal.outbox.get_connection', side_effect=OSError('smtp is down')), \
+                self.assertLogs('news_portal.outbox', 'WARNING'):
+            user = self.signup()
+        self.assertTrue(user.groups.filter(name='common').exists())
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.pending, 1))
+        self.assertIn('smtp is down', email.last_error)
+
+    def test_signup_does_not_depend_on_the_broker(self):
+        def broker_is_down():
+            raise OSError('broker is down')
+
+        with mock.patch('news_portal.tasks.drain_outbox_task.delay', broker_is_down), \
+                self.assertLogs('django', 'ERROR'):
+            user = self.signup()
+        email = OutgoingEmail.objects.get(idempotency_key=f'signup-{user.pk}')
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.pending, 0))